@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+from contextvars import copy_context
+from typing import Dict, List, Optional
+import streamlit as st
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain_core.agents import AgentAction, AgentStep
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.pydantic_v1 import PrivateAttr
+from async_runtime import shared_pool
+from bedrock import get_llm_for_model_selection
+from prompt import prompt_template
+from toolset import list_of_tools, python_repl_tool
+
+# Upper bound of cached (model, region, temperature, max_tokens, streaming, prompt_caching, tool set) combinations,
+# the least recently used agent is evicted when the cache is full
+AGENT_CACHE_MAX_ENTRIES = 64
+
+# Tool calls of one model turn run concurrently on the pool shared by all sessions. The Python REPL keeps
+# global state, so its calls run one at a time in the order the model made them.
+SERIAL_TOOLS = {python_repl_tool.name}
+
+_serial_tool_lock = threading.Lock()
+# Every turn runs on an event loop of its own, its serial tool calls queue in order on a lock of that loop
+_loop_serial_tool_locks = weakref.WeakKeyDictionary()
+SERIAL_TOOL_POLL_INTERVAL = 0.05
+
+@asynccontextmanager
+async def serial_tool():
+    """
+    Holds the serial tool lock on the async path. The process wide lock is polled instead of waited for
+    on the shared pool, a thread of the pool that waits for it could be the one the lock holder needs.
+    """
+    loop_lock = _loop_serial_tool_locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+    async with loop_lock:
+        while not _serial_tool_lock.acquire(blocking=False):
+            await asyncio.sleep(SERIAL_TOOL_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _serial_tool_lock.release()
+
+class ParallelAgentExecutor(AgentExecutor):
+    """
+    An AgentExecutor that runs the tool calls of one model turn concurrently, on invoke and on ainvoke.
+    The steps are returned in the order of the tool calls, so the scratchpad is the same as with
+    sequential execution.
+    """
+
+    # The tool calls of the current turn, the futures of the calls that were dispatched to the pool and
+    # whether the turn was dispatched, the futures are popped when their step is returned
+    _actions: List[AgentAction] = PrivateAttr(default_factory=list)
+    _futures: Dict[int, object] = PrivateAttr(default_factory=dict)
+    _dispatched: bool = PrivateAttr(default=False)
+
+    def _iter_next_step(self, name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager=None):
+        # The base class yields all actions of the turn before it performs the first one
+        self._actions = []
+        self._futures = {}
+        self._dispatched = False
+        try:
+            for output in super()._iter_next_step(name_to_tool_map, color_mapping, inputs, intermediate_steps, run_manager):
+                if isinstance(output, AgentAction):
+                    self._actions.append(output)
+                yield output
+        finally:
+            self._actions = []
+            self._futures = {}
+            self._dispatched = False
+
+    def _perform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        parallel = [action for action in self._actions if action.tool not in SERIAL_TOOLS]
+        if len(parallel) > 1 and not self._dispatched:
+            self._dispatched = True
+            # Tools read the context variables of the turn, like the data store session
+            for action in parallel:
+                self._futures[id(action)] = shared_pool.submit(
+                    copy_context().run, self._timed_perform, name_to_tool_map, color_mapping, action, run_manager)
+
+        future = self._futures.pop(id(agent_action), None)
+        if future is not None:
+            return future.result()
+        if agent_action.tool in SERIAL_TOOLS:
+            with _serial_tool_lock:
+                return self._timed_perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+        return self._timed_perform(name_to_tool_map, color_mapping, agent_action, run_manager)
+
+    def _timed_perform(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        start = time.perf_counter()
+        step = super()._perform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        print(f"tool {agent_action.tool} took {time.perf_counter() - start:.2f}s")
+        return step
+
+    async def _aperform_agent_action(self, name_to_tool_map, color_mapping, agent_action, run_manager=None) -> AgentStep:
+        # The async base class already gathers the tool calls of a turn, only the serial tools wait for each other
+        start = time.perf_counter()
+        if agent_action.tool in SERIAL_TOOLS:
+            async with serial_tool():
+                step = await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        else:
+            step = await super()._aperform_agent_action(name_to_tool_map, color_mapping, agent_action, run_manager)
+        print(f"tool {agent_action.tool} took {time.perf_counter() - start:.2f}s")
+        return step
+
+class ToolTimingHandler(BaseCallbackHandler):
+    """
+    Records the wall time of every tool call of a turn, also when the calls overlap.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.started = {}
+        self.timings = []
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        with self._lock:
+            self.started[run_id] = (serialized.get("name", "tool"), time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id) -> None:
+        with self._lock:
+            if run_id in self.started:
+                name, start = self.started.pop(run_id)
+                self.timings.append((name, time.perf_counter() - start))
+
+    def summary(self) -> Optional[str]:
+        if not self.timings:
+            return None
+        return "tools: " + ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in self.timings)
+
+@st.cache_resource(max_entries=AGENT_CACHE_MAX_ENTRIES, show_spinner=False)
+def get_agent(model_selection: str, region: str, temperature: float, max_tokens: int, streaming: bool,
+              prompt_caching: bool = False, tool_names: Optional[tuple] = None):
+    """
+    Returns the tool calling agent for the given settings, shared by all sessions. The agent only sees
+    the schemas of the tools in tool_names, or of all tools when it is None.
+    """
+    llm = get_llm_for_model_selection(model_selection, max_tokens=max_tokens, temperature=temperature,
+                                      region=region, streaming=streaming, prompt_caching=prompt_caching)
+    return create_tool_calling_agent(
+        tools=[tool for tool in list_of_tools if tool_names is None or tool.name in tool_names],
+        llm=llm,
+        prompt=prompt_template(),
+    )
+
+def get_agent_executor(model_selection: str, region: str, temperature: float, max_tokens: int, streaming: bool,
+                       prompt_caching: bool = False, tool_names: Optional[tuple] = None) -> AgentExecutor:
+    """
+    Returns the agent executor of the current session, it is kept in the session state and only rebuilt
+    when the settings change. The executor can run all tools, also when the model calls a tool outside
+    of tool_names. The caller passes the chat history and saves the turn, so that a turn that is run
+    again with another model is stored once.
+    """
+    key = (model_selection, region, temperature, max_tokens, streaming, prompt_caching, tool_names)
+    if st.session_state.get('agent_executor_key') != key:
+        st.session_state.agent_executor = ParallelAgentExecutor(
+            agent=get_agent(model_selection, region, temperature, max_tokens, streaming, prompt_caching, tool_names),
+            tools=list_of_tools,
+            return_intermediate_steps=True,
+            verbose=True,
+        )
+        st.session_state.agent_executor_key = key
+    return st.session_state.agent_executor
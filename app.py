@@ -1,17 +1,33 @@
-from bedrock import get_llm_for_model_selection, calculate_token_cost
+from bedrock import calculate_token_cost, get_llm_for_model_selection, supports_prompt_caching
 import streamlit as st
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain.agents import AgentExecutor, create_tool_calling_agent
-from langchain.memory import ConversationBufferWindowMemory
+from conversation_memory import TokenBudgetMemory, estimate_tokens
+from cascade import AUTO_MODEL, CHEAP_MODEL, STRONG_MODEL, choose_model, escalation_reason, side_effect_calls
 from langchain_community.callbacks.streamlit.streamlit_callback_handler import StreamlitCallbackHandler
-from prompt import prompt_template
-from toolset import list_of_tools
+from agent import get_agent_executor, ToolTimingHandler
+from async_runtime import run_async
+from prompt_cache import track_prompt_cache_usage
+from progress import ToolProgress, bind_tool_progress
 from renderer import process_content
+from streaming import StreamingResponseHandler
 from langchain.callbacks import get_openai_callback
+from datastore import bind_session
+from inventory import start_refresher
+import toolcache
+from toolrouter import route_tools, widen_reason
+from response_cache import answer_ttl, cache_key, describe_age, get_response_cache
+from toolset import list_of_tools
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
 
 AWS_BEDROCK_REGION=os.environ.get("AWS_BEDROCK_REGION", "us-east-1")
 
+# Data frames registered by tools are kept per session
+bind_session(get_script_run_ctx().session_id)
+
+# Keeps the optional AWS inventory snapshot fresh, started once per process
+inventory_refresher = start_refresher()
+
 if 'selected_model' not in st.session_state:
     st.session_state.selected_model = "Sonnet 3.5"
 
@@ -23,7 +39,9 @@ st.set_page_config(page_title="Bot", page_icon=":bot:", layout="wide")
 # Sidebar
 st.sidebar.title("Settings")
 
-model_options = ["Sonnet 3.5", "Sonnet 3", "Haiku 3"]
+# Auto answers with Haiku and escalates to Sonnet 3.5 when needed, see cascade.py
+# Sonnet 3.7 and Haiku 3.5 support prompt caching
+model_options = [AUTO_MODEL, "Sonnet 3.7", "Sonnet 3.5", "Sonnet 3", "Haiku 3.5", "Haiku 3"]
 
 # Model selection
 selected_model = st.sidebar.selectbox(
@@ -42,13 +60,76 @@ st.sidebar.metric("History Size", history_size)
 
 temperature = st.sidebar.slider("temperature", 0.0, 1.0, 0.0, 0.1)
 max_tokens = st.sidebar.slider("max_tokens", 100, 200000, 100000, 100)
-memory_size = st.sidebar.slider("memory_size", 5, 100, 50, 1)
+# Estimated token budget of the conversation history that is sent with every request
+memory_tokens = st.sidebar.slider("memory_tokens", 1000, 200000, 20000, 1000)
+# Turns that no longer fit the budget are summarized by Haiku instead of dropped
+summarize_history = st.sidebar.toggle("Summarize Old Turns", value=True)
+# Turns older than the most recent N are collapsed and only rendered when expanded, 0 disables collapsing
+collapse_turns_after = st.sidebar.slider("collapse_turns_after", 0, 100, 10, 1)
 
 # Toggle for token usage display
 show_token_usage = st.sidebar.toggle("Show Token Usage", value=False)
 
+# Age of the AWS inventory snapshots, only when the inventory is enabled
+if inventory_refresher is not None:
+    with st.sidebar.expander("Inventory Snapshots"):
+        for resource, region, age in inventory_refresher.store.staleness():
+            st.caption(f"{resource} {region}: {age / 60:.0f} min old")
+
+# Hits and misses of the tool result cache of this process
+with st.sidebar.expander("Tool Cache"):
+    tool_cache_stats = toolcache.stats()
+    hits_column, misses_column = st.columns(2)
+    hits_column.metric("Hits", tool_cache_stats["hits"])
+    misses_column.metric("Misses", tool_cache_stats["misses"])
+    for tool_name, (hits, misses) in tool_cache_stats["tools"].items():
+        st.caption(f"{tool_name}: {hits} hits, {misses} misses")
+    if st.button("Clear Tool Cache"):
+        toolcache.clear()
+
+# Toggle for streaming the answer while it is generated
+stream_response = st.sidebar.toggle("Stream Response", value=True)
+
+# Toggle for the async agent path, blocking calls run on a pool shared by all sessions. It overlaps the tool
+# calls of a turn and the Athena polling, it does not reduce the threads per session, see the readme
+async_execution = st.sidebar.toggle("Async Execution", value=True,
+                                    help="Lowers the latency of a turn, the session still holds a thread while it runs")
+
+# Toggle for Bedrock prompt caching of the system prompt, the tool schemas and the history,
+# only models that support prompt caching on Bedrock accept the cache checkpoints
+turn_models = [CHEAP_MODEL, STRONG_MODEL] if st.session_state.selected_model == AUTO_MODEL else [st.session_state.selected_model]
+prompt_caching_supported = all(supports_prompt_caching(model) for model in turn_models)
+prompt_caching = st.sidebar.toggle("Prompt Caching", value=False, disabled=not prompt_caching_supported,
+                                   help=None if prompt_caching_supported else "The selected model does not support prompt caching on Bedrock")
+prompt_caching = prompt_caching and prompt_caching_supported
+
+# Toggle for routing, every turn only sends the schemas of the tools the question is about. Routing changes
+# the tool schemas at the start of the cached prefix, so it is off while prompt caching is on.
+tool_routing = st.sidebar.toggle("Tool Routing", value=True, disabled=prompt_caching,
+                                 help="Off while prompt caching is on, the cache needs the same tool schemas every turn" if prompt_caching else None)
+tool_routing = tool_routing and not prompt_caching
+
+# Toggle for answering repeated questions from a cache on disk that all sessions share
+response_caching = st.sidebar.toggle("Response Cache", value=False)
+if response_caching:
+    with st.sidebar.expander("Response Cache"):
+        st.metric("Cached Answers", len(get_response_cache()))
+        if st.button("Clear Response Cache"):
+            get_response_cache().clear()
+
 if 'memory' not in st.session_state:
-    st.session_state.memory = ConversationBufferWindowMemory(return_messages=True, memory_key="chat_history", k=memory_size)
+    st.session_state.memory = TokenBudgetMemory(memory_key="chat_history")
+
+st.session_state.memory.max_token_limit = memory_tokens
+if not summarize_history:
+    st.session_state.memory.summarizer = None
+elif st.session_state.memory.summarizer is None:
+    st.session_state.memory.summarizer = get_llm_for_model_selection("Haiku 3", max_tokens=1024, temperature=0,
+                                                                     region=AWS_BEDROCK_REGION)
+
+if st.session_state.memory.summary:
+    with st.sidebar.expander("Conversation Summary"):
+        st.caption(st.session_state.memory.summary)
 
 # Main content
 st.title("AWS Bedrock Chat")
@@ -56,53 +137,185 @@ st.title("AWS Bedrock Chat")
 user_query = st.chat_input("Your message")
 
 print(f"{temperature}/{max_tokens}")
-# Select the appropriate model
-llm = get_llm_for_model_selection(st.session_state.selected_model)
-
-agent = create_tool_calling_agent(
-    tools=list_of_tools,
-    llm=llm,
-    prompt=prompt_template(),
-)
 
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=list_of_tools,
-    memory=st.session_state.memory,
-    verbose=True,
-)
-
-# Display conversation history
-for message in st.session_state.messages:
+def render_message(message):
     if isinstance(message, HumanMessage):
         with st.chat_message("user"):
             st.markdown(message.content)
     else:
         with st.chat_message("assistant"):
             process_content(message.content)
+            if message.response_metadata.get("model"):
+                st.caption(f"{message.response_metadata['model']}: {message.response_metadata['model_reason']}")
+
+# Display conversation history, a turn starts with a user message
+turns = []
+for message in st.session_state.messages:
+    if isinstance(message, HumanMessage) or not turns:
+        turns.append([])
+    turns[-1].append(message)
+
+collapsed_turns = max(0, len(turns) - collapse_turns_after) if collapse_turns_after > 0 else 0
+for index, turn in enumerate(turns):
+    if index < collapsed_turns:
+        # Collapsed turns are not rendered at all until they are expanded
+        summary = turn[0].content.splitlines()[0][:100] if turn[0].content else ""
+        if not st.toggle(f"Turn {index + 1}: {summary}", key=f"expand_turn_{index}"):
+            continue
+    for message in turn:
+        render_message(message)
 
 if user_query is not None and user_query != "":
     st.session_state.messages.append(HumanMessage(content=user_query))
-    print(f'modelId: {llm.model_id}')
+    print(f'model: {st.session_state.selected_model}')
     with st.chat_message("user"):
         st.markdown(user_query)
 
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            st_callback = StreamlitCallbackHandler(st.container(), expand_new_thoughts=True, collapse_completed_thoughts=True)
-            config = {"callbacks": [st_callback]}
+    tool_names = None
+    if tool_routing:
+        routed_tools, routing_reason = route_tools(user_query, st.session_state.get('previous_tools', []))
+        print(f"tool routing: {len(routed_tools)} of {len(list_of_tools)} tools, {routing_reason}")
+        tool_names = tuple(routed_tools)
+
+    # The memory is loaded and saved here instead of by the executor, so that a turn that is escalated
+    # to a stronger model is still stored once
+    history = st.session_state.memory.load_memory_variables({})
+
+    auto_model = st.session_state.selected_model == AUTO_MODEL
+    if auto_model:
+        turn_model, model_reason = choose_model(user_query, tool_names, estimate_tokens(history["chat_history"]))
+        print(f"model: {turn_model} ({model_reason})")
+    else:
+        turn_model, model_reason = st.session_state.selected_model, None
+
+    refresh_requested = toolcache.bind_refresh_intent(user_query)
+
+    # A repeated question is answered from the response cache, asking for fresh data skips the lookup
+    response_key = None
+    cached = None
+    if response_caching:
+        response_key = cache_key(user_query, st.session_state.selected_model, history["chat_history"],
+                                 temperature, max_tokens)
+        if not refresh_requested:
+            cached = get_response_cache().get(response_key)
+
+    if cached is not None:
+        print(f"response cache: hit, {describe_age(cached.age)} old")
+        answer = cached.answer
+        model_metadata = {"model": cached.model, "model_reason": f"cached answer, {describe_age(cached.age)} old"}
+        with st.chat_message("assistant"):
+            process_content(answer)
+            st.caption(f"{cached.model}: {model_metadata['model_reason']}")
+            st.button("Invalidate Cached Answer", key=f"invalidate_{cached.key}",
+                      on_click=get_response_cache().invalidate, args=(cached.key,))
+    else:
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                st_callback = StreamlitCallbackHandler(st.container(), expand_new_thoughts=True, collapse_completed_thoughts=True)
+                # Tool calls of one turn run concurrently, the handler records the time of each call
+                tool_timing = ToolTimingHandler()
+                callbacks = [st_callback, tool_timing]
 
-            with get_openai_callback() as cb:
-                response = agent_executor.invoke({"input": user_query}, config=config)
+                stream_handler = None
+                if stream_response:
+                    stream_handler = StreamingResponseHandler(st.container())
+                    callbacks.append(stream_handler)
 
-                process_content(response['output'])
+                # The Streamlit handlers write to the page, so they run on the thread of the event loop
+                st_callback.run_inline = True
+                config = {"callbacks": callbacks}
+
+                # Asking for fresh data, eg. 'refresh the RDS list', bypasses the tool cache for this turn
+                if refresh_requested:
+                    st.caption("Refreshing, the tool cache is bypassed for this answer.")
+
+                def run_attempt(model_selection: str, attempt_tools):
+                    # Select the appropriate model, the agent is cached across reruns and sessions
+                    agent_executor = get_agent_executor(
+                        model_selection,
+                        region=AWS_BEDROCK_REGION,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        streaming=stream_response,
+                        prompt_caching=prompt_caching,
+                        tool_names=attempt_tools,
+                    )
+                    inputs = {"input": user_query, **history}
+                    with get_openai_callback() as cb:
+                        if async_execution:
+                            response = run_async(agent_executor.ainvoke(inputs, config=config))
+                        else:
+                            response = agent_executor.invoke(inputs, config=config)
+                    cost = calculate_token_cost(model_selection, cb.prompt_tokens, cb.completion_tokens)
+                    return response, (cb.prompt_tokens, cb.completion_tokens, cost)
+
+                # Tools report their progress, like the batches of a Logs Insights query, while they run
+                with track_prompt_cache_usage() as cache_usage, bind_tool_progress(ToolProgress(st.container())):
+                    response, attempt_usage = run_attempt(turn_model, tool_names)
+                    attempts = [attempt_usage]
+
+                    # The model only saw the routed tools, a turn they could not answer runs again with all tools
+                    # unless its tools may have changed something, see cascade.side_effect_calls
+                    reason = widen_reason(user_query, tool_names, response['output'], response['intermediate_steps'])
+                    side_effects = side_effect_calls(response['intermediate_steps']) if reason is not None else []
+                    if side_effects:
+                        print(f"tool routing: not widening, {reason}, side effects of {', '.join(side_effects)}")
+                    elif reason is not None:
+                        print(f"tool routing: widening to all tools, {reason}")
+                        st.caption(f"Asked again with all tools: {reason}")
+                        tool_names = None
+                        response, attempt_usage = run_attempt(turn_model, tool_names)
+                        attempts.append(attempt_usage)
+
+                    if auto_model and turn_model != STRONG_MODEL:
+                        reason = escalation_reason(response['output'], response['intermediate_steps'])
+                        # Running the turn again would repeat tool calls that may have changed something
+                        side_effects = side_effect_calls(response['intermediate_steps']) if reason is not None else []
+                        if side_effects:
+                            print(f"model: not escalating from {turn_model}, {reason}, side effects of {', '.join(side_effects)}")
+                            st.caption(f"Not escalated to {STRONG_MODEL} ({reason}): it would run {', '.join(side_effects)} again")
+                        elif reason is not None:
+                            print(f"model: escalating from {turn_model} to {STRONG_MODEL}, {reason}")
+                            st.caption(f"Escalated from {turn_model} to {STRONG_MODEL}: {reason}")
+                            turn_model, model_reason = STRONG_MODEL, f"escalated, {reason}"
+                            response, attempt_usage = run_attempt(turn_model, tool_names)
+                            attempts.append(attempt_usage)
+
+                if stream_handler is not None and stream_handler.has_content:
+                    stream_handler.finish()
+                else:
+                    process_content(response['output'])
+                if auto_model:
+                    st.caption(f"{turn_model}: {model_reason}")
 
                 if show_token_usage:
-                    cost = calculate_token_cost(st.session_state.selected_model, cb.prompt_tokens, cb.completion_tokens)
-                    st.write(f"Tokens: prompt:({cb.prompt_tokens}/{cost['input_cost']:.6f}), completion:({cb.completion_tokens}/{cost['output_cost']:.6f}), total:({cb.total_tokens}/{cost['total_cost']})")
+                    prompt_tokens = sum(attempt[0] for attempt in attempts)
+                    completion_tokens = sum(attempt[1] for attempt in attempts)
+                    input_cost = sum(attempt[2]['input_cost'] for attempt in attempts)
+                    output_cost = sum(attempt[2]['output_cost'] for attempt in attempts)
+                    usage = f"Tokens: prompt:({prompt_tokens}/{input_cost:.6f}), completion:({completion_tokens}/{output_cost:.6f}), total:({prompt_tokens + completion_tokens}/{input_cost + output_cost})"
+                    if stream_handler is not None and stream_handler.time_to_first_token is not None:
+                        usage += f", time to first token: {stream_handler.time_to_first_token:.2f}s"
+                    if prompt_caching:
+                        usage += f", cache read: {cache_usage.cache_read_tokens}, cache write: {cache_usage.cache_write_tokens}"
+                    if tool_timing.summary() is not None:
+                        usage += f", {tool_timing.summary()}"
+                    st.write(usage)
+
+        answer = response['output']
+
+        # The tools of this turn stay exposed for follow-up questions
+        used_tools = list(dict.fromkeys(name for name, _ in tool_timing.timings))
+        st.session_state.previous_tools = used_tools
+
+        # Answers that struggled are not worth repeating, the others are kept for the TTL of their intent
+        if response_key is not None and escalation_reason(answer, response['intermediate_steps']) is None:
+            ttl = answer_ttl(used_tools)
+            if get_response_cache().put(response_key, user_query, turn_model, answer, ttl):
+                print(f"response cache: stored for {describe_age(ttl)}")
 
-    st.session_state.messages.append(AIMessage(content=response['output']))
+        # Auto turns record the model that answered and why
+        model_metadata = {"model": turn_model, "model_reason": model_reason} if auto_model else {}
 
-    # Update memory with the new interaction
-    st.session_state.memory.chat_memory.add_user_message(user_query)
-    st.session_state.memory.chat_memory.add_ai_message(response['output'])
\ No newline at end of file
+    st.session_state.memory.save_context({"input": user_query}, {"output": answer})
+    st.session_state.messages.append(AIMessage(content=answer, response_metadata=model_metadata))
@@ -0,0 +1,52 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# Blocking work of the async path, the boto3 calls of the tools and the Bedrock calls, runs on one bounded
+# pool that is shared by all sessions of the process. The script thread of every session still waits for
+# its turn, so the pool adds up to ASYNC_MAX_WORKERS threads on top of one thread per active session.
+ASYNC_MAX_WORKERS = int(os.environ.get("ASYNC_MAX_WORKERS", "32"))
+
+def _run_with_script_run_ctx(script_run_ctx, func, *args, **kwargs):
+    # Work that writes to the page, like callback handlers, renders into the session that submitted it
+    if script_run_ctx is not None:
+        add_script_run_ctx(threading.current_thread(), script_run_ctx)
+    return func(*args, **kwargs)
+
+class SharedThreadPool(ThreadPoolExecutor):
+    """
+    A thread pool that is used as the default executor of the event loop of every turn. Closing a loop shuts
+    down its default executor, so shutdown is ignored and the pool lives as long as the process.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_with_script_run_ctx, get_script_run_ctx(suppress_warning=True), fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        pass
+
+shared_pool = SharedThreadPool(max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="shared")
+
+def run_async(coroutine):
+    """
+    Runs the coroutine to completion on a fresh event loop in the current thread, with the shared pool
+    as the default executor.
+    """
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(shared_pool)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+async def offload(func, *args, **kwargs):
+    """
+    Runs a blocking function, like a boto3 call, on the default executor in a copy of the current context.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(copy_context().run, func, *args, **kwargs))
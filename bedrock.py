@@ -1,43 +1,183 @@
 from langchain_aws import ChatBedrock
-import boto3
+from langchain_aws.chat_models.bedrock import ChatPromptAdapter
+from langchain_aws.function_calling import _tools_in_params
+from langchain_aws.llms.bedrock import LLMInputOutputAdapter
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk
+from typing import Iterator, Optional
+import json
+from multi_region import regional_client
+from prompt_cache import register_prompt_caching
 
-def _get_bedrock_model(model_id: str, temperature: int, max_tokens: int, region: str) -> ChatBedrock:
-    bedrock_client = boto3.client('bedrock-runtime', region)
-    return ChatBedrock(model_id=model_id,
+MODEL_IDS = {
+    "Sonnet 3": "anthropic.claude-3-sonnet-20240229-v1:0",
+    "Sonnet 3.5": "anthropic.claude-3-5-sonnet-20240620-v1:0",
+    "Sonnet 3.7": "anthropic.claude-3-7-sonnet-20250219-v1:0",
+    "Haiku 3": "anthropic.claude-3-haiku-20240307-v1:0",
+    "Haiku 3.5": "anthropic.claude-3-5-haiku-20241022-v1:0",
+}
+
+# Models that are invoked through the cross-region inference profile of the geography of the region,
+# the profile id prefixes the model id with the geography, eg. us.anthropic...
+INFERENCE_PROFILE_MODEL_IDS = {
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "anthropic.claude-3-7-sonnet-20250219-v1:0",
+}
+INFERENCE_PROFILE_GEOGRAPHIES = {"us": "us", "eu": "eu", "ap": "apac"}
+
+# Models that accept prompt cache checkpoints on Bedrock, other models reject the request or ignore them
+PROMPT_CACHING_MODEL_IDS = {
+    "anthropic.claude-3-5-haiku-20241022-v1:0",
+    "anthropic.claude-3-7-sonnet-20250219-v1:0",
+    "anthropic.claude-sonnet-4-20250514-v1:0",
+    "anthropic.claude-opus-4-20250514-v1:0",
+}
+
+def base_model_id(model_id: str) -> str:
+    """
+    Returns the model id without the geography of a cross-region inference profile.
+    """
+    geography, _, rest = model_id.partition(".")
+    return rest if geography in INFERENCE_PROFILE_GEOGRAPHIES.values() else model_id
+
+def model_id_for_region(model_id: str, region: str) -> str:
+    geography = INFERENCE_PROFILE_GEOGRAPHIES.get(region.split("-")[0])
+    if model_id in INFERENCE_PROFILE_MODEL_IDS and geography is not None:
+        return f"{geography}.{model_id}"
+    return model_id
+
+def supports_prompt_caching(model_selection: str) -> bool:
+    return base_model_id(MODEL_IDS.get(model_selection, "")) in PROMPT_CACHING_MODEL_IDS
+
+def get_bedrock_client(region: str, prompt_caching: bool = False):
+    # Prompt caching hooks into the requests of the client, so it has clients of its own
+    return regional_client('bedrock-runtime', region, configure=register_prompt_caching if prompt_caching else None)
+
+def _anthropic_event_to_chunk(event: dict) -> Optional[ChatGenerationChunk]:
+    """
+    Converts an event of an Anthropic messages stream to a chunk, text deltas become content and
+    tool use blocks become tool call chunks that are merged by their index.
+    """
+    if event["type"] == "message_start":
+        usage = event["message"].get("usage", {})
+        input_tokens = usage.get("input_tokens", 0)
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content="", usage_metadata={"input_tokens": input_tokens, "output_tokens": 0, "total_tokens": input_tokens}))
+    if event["type"] == "content_block_start" and event["content_block"]["type"] == "tool_use":
+        block = event["content_block"]
+        return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+            {"name": block["name"], "id": block["id"], "args": "", "index": event["index"]}]))
+    if event["type"] == "content_block_delta":
+        delta = event["delta"]
+        if delta["type"] == "text_delta":
+            return ChatGenerationChunk(message=AIMessageChunk(content=delta["text"]))
+        if delta["type"] == "input_json_delta":
+            return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": None, "id": None, "args": delta["partial_json"], "index": event["index"]}]))
+    if event["type"] == "message_delta":
+        output_tokens = event.get("usage", {}).get("output_tokens", 0)
+        return ChatGenerationChunk(message=AIMessageChunk(
+            content="", response_metadata={"stop_reason": event["delta"].get("stop_reason")},
+            usage_metadata={"input_tokens": 0, "output_tokens": output_tokens, "total_tokens": output_tokens}))
+    return None
+
+class ToolStreamingChatBedrock(ChatBedrock):
+    """
+    ChatBedrock that streams Claude 3 answers also when tools are bound. langchain_aws 0.1.10 falls back
+    from _stream to _generate and from a streaming _generate to _stream when tools are bound, which
+    recurses until the stack is exhausted. Here the tool calls are read from the response stream.
+    """
+
+    # langchain_aws reads the provider and the model from the model id, an inference profile id starts with its geography
+    def _get_provider(self) -> str:
+        return self.provider or base_model_id(self.model_id).split(".")[0]
+
+    def _get_model(self) -> str:
+        return base_model_id(self.model_id).split(".")[1]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if "claude-3" not in self._get_model() or not _tools_in_params(kwargs):
+            yield from super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            return
+        system, formatted_messages = ChatPromptAdapter.format_messages("anthropic", messages)
+        params = {**(self.model_kwargs or {}), **kwargs}
+        if stop:
+            params["stop_sequences"] = stop
+        body = LLMInputOutputAdapter.prepare_input(provider="anthropic", model_kwargs=params, system=system,
+                                                   messages=formatted_messages, tools=params["tools"])
+        response = self.client.invoke_model_with_response_stream(
+            body=json.dumps(body), modelId=self.model_id, accept="application/json", contentType="application/json")
+        for event in response["body"]:
+            chunk = _anthropic_event_to_chunk(json.loads(event["chunk"]["bytes"]))
+            if chunk is not None:
+                yield chunk
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if not (self.streaming and "claude-3" in self._get_model() and _tools_in_params(kwargs)):
+            return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        chunks = []
+        for chunk in self._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            if run_manager is not None and chunk.text:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            chunks.append(chunk)
+        return generate_from_stream(iter(chunks))
+
+def _get_bedrock_model(model_id: str, temperature: int, max_tokens: int, region: str, streaming: bool = False,
+                       prompt_caching: bool = False) -> ChatBedrock:
+    bedrock_client = get_bedrock_client(region, prompt_caching)
+    return ToolStreamingChatBedrock(model_id=model_id_for_region(model_id, region),
                        client=bedrock_client,
                        model_kwargs={"temperature": temperature, "max_tokens": max_tokens},
-                       streaming=False,
+                       streaming=streaming,
     )
 
-def get_sonnet_3(max_tokens: int, temperature: int, region: str) -> ChatBedrock:
-    model_id="anthropic.claude-3-sonnet-20240229-v1:0"
-    return _get_bedrock_model(model_id, temperature, max_tokens, region)
+def get_sonnet_3(max_tokens: int, temperature: int, region: str, streaming: bool = False, prompt_caching: bool = False) -> ChatBedrock:
+    model_id = MODEL_IDS["Sonnet 3"]
+    return _get_bedrock_model(model_id, temperature, max_tokens, region, streaming, prompt_caching)
+
+def get_sonnet_35(max_tokens: int, temperature: int, region: str, streaming: bool = False, prompt_caching: bool = False) -> ChatBedrock:
+    model_id = MODEL_IDS["Sonnet 3.5"]
+    return _get_bedrock_model(model_id, temperature, max_tokens, region, streaming, prompt_caching)
+
+def get_haiku_3(max_tokens: int, temperature: int, region: str, streaming: bool = False, prompt_caching: bool = False) -> ChatBedrock:
+    model_id = MODEL_IDS["Haiku 3"]
+    return _get_bedrock_model(model_id, temperature, max_tokens, region, streaming, prompt_caching)
 
-def get_sonnet_35(max_tokens: int, temperature: int, region: str) -> ChatBedrock:
-    model_id="anthropic.claude-3-5-sonnet-20240620-v1:0"
-    return _get_bedrock_model(model_id, temperature, max_tokens, region)
+def get_sonnet_37(max_tokens: int, temperature: int, region: str, streaming: bool = False, prompt_caching: bool = False) -> ChatBedrock:
+    model_id = MODEL_IDS["Sonnet 3.7"]
+    return _get_bedrock_model(model_id, temperature, max_tokens, region, streaming, prompt_caching)
 
-def get_haiku_3(max_tokens: int, temperature: int, region: str) -> ChatBedrock:
-    model_id="anthropic.claude-3-haiku-20240307-v1:0"
-    return _get_bedrock_model(model_id, temperature, max_tokens, region)
+def get_haiku_35(max_tokens: int, temperature: int, region: str, streaming: bool = False, prompt_caching: bool = False) -> ChatBedrock:
+    model_id = MODEL_IDS["Haiku 3.5"]
+    return _get_bedrock_model(model_id, temperature, max_tokens, region, streaming, prompt_caching)
 
-def get_llm_for_model_selection(model_selection: str) -> ChatBedrock:
+def get_llm_for_model_selection(model_selection: str, max_tokens: int = 100000, temperature: float = 0, region: str = "us-east-1", streaming: bool = False,
+                                prompt_caching: bool = False) -> ChatBedrock:
+    prompt_caching = prompt_caching and supports_prompt_caching(model_selection)
     if model_selection == "Sonnet 3":
-        return get_sonnet_3(max_tokens=100000, temperature=0, region="us-east-1")
+        return get_sonnet_3(max_tokens=max_tokens, temperature=temperature, region=region, streaming=streaming, prompt_caching=prompt_caching)
     elif model_selection == "Sonnet 3.5":
-        return get_sonnet_35(max_tokens=100000, temperature=0, region="us-east-1")
+        return get_sonnet_35(max_tokens=max_tokens, temperature=temperature, region=region, streaming=streaming, prompt_caching=prompt_caching)
+    elif model_selection == "Sonnet 3.7":
+        return get_sonnet_37(max_tokens=max_tokens, temperature=temperature, region=region, streaming=streaming, prompt_caching=prompt_caching)
     elif model_selection == "Haiku 3":
-        return get_haiku_3(max_tokens=100000, temperature=0, region="us-east-1")
+        return get_haiku_3(max_tokens=max_tokens, temperature=temperature, region=region, streaming=streaming, prompt_caching=prompt_caching)
+    elif model_selection == "Haiku 3.5":
+        return get_haiku_35(max_tokens=max_tokens, temperature=temperature, region=region, streaming=streaming, prompt_caching=prompt_caching)
     else:
         raise ValueError("Unknown model")
 
 def calculate_token_cost(model: str, input_tokens: int, output_tokens: int) -> dict:
-    if model in ["Sonnet 3", "Sonnet 3.5"]:
+    if model in ["Sonnet 3", "Sonnet 3.5", "Sonnet 3.7"]:
         input_cost = (input_tokens / 1000) * 0.003
         output_cost = (output_tokens / 1000) * 0.015
     elif model == "Haiku 3":
         input_cost = (input_tokens / 1000) * 0.00025
         output_cost = (output_tokens / 1000) * 0.00125
+    elif model == "Haiku 3.5":
+        input_cost = (input_tokens / 1000) * 0.0008
+        output_cost = (output_tokens / 1000) * 0.004
     else:
         raise ValueError("Unknown model")
 
@@ -0,0 +1,163 @@
+"""
+Compares how many concurrent sessions one process serves with the sync and the async agent path.
+
+Every session runs one agent turn against simulated AWS latencies: a model call, two inventory tool
+calls and an Athena query that runs for a while, and a second model call for the answer. The model
+and boto3 calls block like the real clients do, the Athena tool polls with the real wait_for_query
+and await_query of tool_aws_athena_execute_query.
+
+    sync      AgentExecutor.invoke, one thread per session, tool calls one after another (before)
+    parallel  ParallelAgentExecutor.invoke, one thread per session, tool calls concurrently
+    async     ParallelAgentExecutor.ainvoke with run_async, one thread per session, blocking calls on the shared pool
+
+Every mode runs a session on a thread of its own, like Streamlit runs the script of every session on a
+thread of its own, and the async mode calls run_async from that thread like the app does. A session holds
+its thread for the whole turn in every mode, the async path does not serve more sessions per thread. It
+bounds the threads of the tool and model calls by the shared pool, which also queues them once more calls
+block at the same time than the pool has workers.
+
+The report shows the turn latency, the throughput and the peak number of threads.
+
+Usage:
+    python benchmark_async_sessions.py [sessions ...]
+"""
+import contextlib
+import io
+import statistics
+import sys
+import threading
+import time
+from langchain.agents import AgentExecutor
+from langchain.agents.agent import RunnableMultiActionAgent
+from langchain.tools import tool
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import StructuredTool
+from agent import ParallelAgentExecutor
+from async_runtime import ASYNC_MAX_WORKERS, run_async
+from tool_aws_athena_execute_query import await_query, wait_for_query
+
+MODEL_LATENCY = 0.4
+TOOL_LATENCY = 0.2
+ATHENA_QUERY_TIME = 1.0
+ATHENA_CALL_LATENCY = 0.02
+DEFAULT_SESSIONS = [10, 50, 100, 200]
+
+class FakeAthenaClient:
+    """
+    Answers get_query_execution like Athena does for a query that runs for ATHENA_QUERY_TIME seconds.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def get_query_execution(self, QueryExecutionId: str) -> dict:
+        time.sleep(ATHENA_CALL_LATENCY)
+        state = 'SUCCEEDED' if time.monotonic() - self.started >= ATHENA_QUERY_TIME else 'RUNNING'
+        return {'QueryExecution': {'QueryExecutionId': QueryExecutionId, 'Status': {'State': state}}}
+
+@tool
+def list_inventory(region: str) -> str:
+    """Lists the resources of a region."""
+    time.sleep(TOOL_LATENCY)
+    return f"resources of {region}"
+
+def _athena_query(query: str) -> str:
+    """Runs an Athena query."""
+    return wait_for_query(FakeAthenaClient(), 'query')['Status']['State']
+
+async def _aathena_query(query: str) -> str:
+    return (await await_query(FakeAthenaClient(), 'query'))['Status']['State']
+
+athena_query = StructuredTool.from_function(func=_athena_query, coroutine=_aathena_query, name="athena_query")
+
+def plan(inputs: dict):
+    # The model call blocks like ChatBedrock, which has no native async client
+    time.sleep(MODEL_LATENCY)
+    if inputs['intermediate_steps']:
+        return AgentFinish({'output': 'done'}, '')
+    return [
+        AgentAction('list_inventory', {'region': 'eu-west-1'}, ''),
+        AgentAction('list_inventory', {'region': 'us-east-1'}, ''),
+        AgentAction('athena_query', {'query': 'SELECT 1'}, ''),
+    ]
+
+def make_executor(executor_class):
+    agent = RunnableMultiActionAgent(runnable=RunnableLambda(plan), stream_runnable=False)
+    return executor_class(agent=agent, tools=[list_inventory, athena_query])
+
+class ThreadMonitor(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = threading.active_count()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+def run_threaded(executor, sessions: int) -> list:
+    latencies = [0.0] * sessions
+
+    def session(index: int):
+        start = time.perf_counter()
+        executor.invoke({'input': 'question'})
+        latencies[index] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def run_threaded_async(executor, sessions: int) -> list:
+    latencies = [0.0] * sessions
+
+    def session(index: int):
+        start = time.perf_counter()
+        run_async(executor.ainvoke({'input': 'question'}))
+        latencies[index] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=session, args=(index,)) for index in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+def measure(mode: str, sessions: int) -> dict:
+    monitor = ThreadMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    # The per call timing lines of the executor are not part of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'sync':
+            latencies = run_threaded(make_executor(AgentExecutor), sessions)
+        elif mode == 'parallel':
+            latencies = run_threaded(make_executor(ParallelAgentExecutor), sessions)
+        else:
+            latencies = run_threaded_async(make_executor(ParallelAgentExecutor), sessions)
+    wall = time.perf_counter() - start
+    monitor.stopped.set()
+    monitor.join()
+    return {
+        'p50': statistics.median(latencies),
+        'p95': sorted(latencies)[max(0, int(len(latencies) * 0.95) - 1)],
+        'throughput': sessions / wall,
+        'peak_threads': monitor.peak,
+    }
+
+def main():
+    session_counts = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SESSIONS
+    print(f"shared pool: {ASYNC_MAX_WORKERS} workers")
+    print(f"{'mode':<10}{'sessions':>10}{'p50 s':>10}{'p95 s':>10}{'turns/s':>10}{'threads':>10}")
+    for mode in ['sync', 'parallel', 'async']:
+        for sessions in session_counts:
+            result = measure(mode, sessions)
+            # Threads beyond one per session are the threads of the tool and model calls
+            print(f"{mode:<10}{sessions:>10}{result['p50']:>10.2f}{result['p95']:>10.2f}"
+                  f"{result['throughput']:>10.1f}{result['peak_threads']:>10}")
+
+if __name__ == "__main__":
+    main()
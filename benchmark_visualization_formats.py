@@ -0,0 +1,64 @@
+"""
+Compares the output tokens per row of the visualization data formats.
+
+The token count is an offline approximation of a BPE tokenizer: words, runs of up to three
+digits and single punctuation characters each count as one token. It is meant to compare
+the formats with each other, not to predict the exact Bedrock bill.
+
+Usage:
+    python benchmark_visualization_formats.py [rows]
+"""
+import csv
+import io
+import json
+import re
+import sys
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def estimate_tokens(text: str) -> int:
+    return len(TOKEN_PATTERN.findall(text))
+
+def sample_rows(count: int) -> list:
+    return [
+        {
+            "LogGroupName": f"/aws/lambda/service-{i % 37}-function-{i}",
+            "CreationTime": f"2024-07-{1 + i % 28:02d} 12:{i % 60:02d}:00",
+            "MetricFilterCount": i % 4,
+            "StoredMB": round(i * 1.37, 2),
+        }
+        for i in range(count)
+    ]
+
+def as_xml(rows: list) -> str:
+    items = []
+    for row in rows:
+        fields = "".join(f"\n      <{key}>{value}</{key}>" for key, value in row.items())
+        items.append(f"    <item>{fields}\n    </item>")
+    return '<visualization type="interactive_table">\n  <data>\n' + "\n".join(items) + "\n  </data>\n</visualization>"
+
+def as_csv(rows: list) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=list(rows[0].keys()), lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
+    return '<visualization type="interactive_table" format="csv">\n  <data><![CDATA[\n' + buffer.getvalue() + "]]></data>\n</visualization>"
+
+def as_json_columns(rows: list) -> str:
+    columns = {key: [row[key] for row in rows] for key in rows[0]}
+    return '<visualization type="interactive_table" format="json-columns">\n  <data><![CDATA[' + json.dumps(columns) + "]]></data>\n</visualization>"
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows = sample_rows(count)
+    formats = {"xml": as_xml, "csv": as_csv, "json-columns": as_json_columns}
+
+    baseline = None
+    print(f"{'format':<14}{'tokens':>10}{'tokens/row':>12}{'vs xml':>9}")
+    for name, render in formats.items():
+        tokens = estimate_tokens(render(rows))
+        baseline = baseline or tokens
+        print(f"{name:<14}{tokens:>10}{tokens / count:>12.1f}{tokens / baseline:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+from conversation_memory import VISUALIZATION_PATTERN
+
+# The "Auto" model answers simple questions with Haiku and escalates to Sonnet when the question is complex
+# or when the Haiku answer shows that it struggled: a tool call failed, a visualization is malformed or the
+# answer itself is unsure. Escalation runs the turn again with Sonnet, the tool result cache makes the
+# repeated tool calls cheap. A turn whose tools may have changed something, like Python code or an Athena
+# CTAS or INSERT, is not escalated, running it again would run those tools twice.
+AUTO_MODEL = "Auto"
+CHEAP_MODEL = "Haiku 3"
+STRONG_MODEL = "Sonnet 3.5"
+
+COMPLEX_QUERY_CHARS = 400
+COMPLEX_TOOL_COUNT = 4
+LARGE_HISTORY_TOKENS = 30000
+# Writing SQL goes wrong more often with the smaller model, and a wrong query costs an Athena run
+STRONG_TOOLS = {'execute_athena_query', 'Python_REPL'}
+COMPLEX_QUERY_PATTERN = re.compile(
+    r"\b(why|analy[sz]e|analysis|compare|comparison|explain|root cause|correlat\w*|trends?|forecast|"
+    r"recommend\w*|optimi[sz]e|design|investigate|troubleshoot|join)\b", re.IGNORECASE)
+TOOL_ERROR_PATTERN = re.compile(r"^(Error|An unexpected error|Query execution failed|Query was cancelled)")
+# Tools whose calls may change state, Athena queries are only side effect free when they read
+SIDE_EFFECT_TOOLS = {'Python_REPL'}
+READ_ONLY_QUERY_PATTERN = re.compile(r"^(\s|\(|--[^\n]*(\n|$)|/\*.*?\*/)*(select|with|show|describe|explain|values)\b",
+                                     re.IGNORECASE | re.DOTALL)
+LOW_CONFIDENCE_PATTERN = re.compile(
+    r"\b(I'm not sure|I am not sure|I don't know|I do not know|I cannot determine|I can't determine|"
+    r"I'm unable to|I am unable to|I don't have enough information|I do not have enough information)\b",
+    re.IGNORECASE)
+
+def choose_model(query: str, tool_names: Optional[List[str]], history_tokens: int) -> Tuple[str, str]:
+    """
+    Chooses the model of the first attempt of a turn from the question, the routed tools and the size of the history.
+
+    Returns:
+        tuple: the model selection and the reason
+    """
+    if len(query) > COMPLEX_QUERY_CHARS:
+        return STRONG_MODEL, "long question"
+    match = COMPLEX_QUERY_PATTERN.search(query)
+    if match:
+        return STRONG_MODEL, f"complex question ({match.group(0).lower()})"
+    if tool_names is not None:
+        strong_tools = STRONG_TOOLS.intersection(tool_names)
+        if strong_tools:
+            return STRONG_MODEL, f"needs {', '.join(sorted(strong_tools))}"
+        if len(tool_names) >= COMPLEX_TOOL_COUNT:
+            return STRONG_MODEL, f"{len(tool_names)} tools"
+    if history_tokens > LARGE_HISTORY_TOKENS:
+        return STRONG_MODEL, f"large history ({history_tokens} tokens)"
+    return CHEAP_MODEL, "simple question"
+
+def malformed_visualization(output: str) -> bool:
+    if output.count("<visualization") != output.count("</visualization>"):
+        return True
+    for match in VISUALIZATION_PATTERN.finditer(output):
+        try:
+            ET.fromstring(match.group(0))
+        except ET.ParseError:
+            return True
+    return False
+
+def side_effect_calls(intermediate_steps: list) -> List[str]:
+    """
+    Returns the tool calls of an attempt that may have changed state, eg. ['execute_athena_query (CREATE)'].
+    """
+    calls = []
+    for action, _ in intermediate_steps:
+        if action.tool in SIDE_EFFECT_TOOLS:
+            calls.append(action.tool)
+        elif action.tool == 'execute_athena_query':
+            tool_input = action.tool_input if isinstance(action.tool_input, dict) else {'query': str(action.tool_input)}
+            query = tool_input.get('query', '')
+            if not READ_ONLY_QUERY_PATTERN.match(query):
+                statement = query.split()[0].upper() if query.split() else 'empty query'
+                calls.append(f"execute_athena_query ({statement})")
+    return list(dict.fromkeys(calls))
+
+def escalation_reason(output: str, intermediate_steps: list) -> Optional[str]:
+    """
+    Returns why the answer of the cheap model should be escalated, or None when it is good enough.
+    """
+    failed = [action.tool for action, observation in intermediate_steps
+              if isinstance(observation, str) and TOOL_ERROR_PATTERN.match(observation)]
+    if failed:
+        return f"tool error in {', '.join(dict.fromkeys(failed))}"
+    if malformed_visualization(output):
+        return "malformed visualization XML"
+    match = LOW_CONFIDENCE_PATTERN.search(output)
+    if match:
+        return f"low confidence ({match.group(0)})"
+    return None
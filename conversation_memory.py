@@ -0,0 +1,149 @@
+import re
+from typing import Any, Dict, List, Optional
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, get_buffer_string
+from async_runtime import offload
+
+# Roughly four characters per token for English text and code, close enough to enforce a budget
+CHARS_PER_TOKEN = 4
+VISUALIZATION_PATTERN = re.compile(r"<visualization\b([^>]*)>(.*?)</visualization>", re.DOTALL)
+_ATTRIBUTE_PATTERN = re.compile(r'(\w+)="([^"]*)"')
+_TITLE_PATTERN = re.compile(r"<title>(.*?)</title>", re.DOTALL)
+TRUNCATED_MARKER = "\n(truncated)"
+
+def estimate_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(message.content) if isinstance(message.content, str) else len(str(message.content))
+               for message in messages) // CHARS_PER_TOKEN
+
+def truncate(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(0, max_chars - len(TRUNCATED_MARKER))] + TRUNCATED_MARKER
+
+def truncate_turn(messages: List[BaseMessage], max_tokens: int) -> List[BaseMessage]:
+    """
+    Truncates the messages of a turn to the token budget, the answer is cut before the question.
+    """
+    messages = list(messages)
+    excess = estimate_tokens(messages) - max_tokens
+    for i in reversed(range(len(messages))):
+        if excess <= 0:
+            break
+        content = messages[i].content if isinstance(messages[i].content, str) else str(messages[i].content)
+        tokens = len(content) // CHARS_PER_TOKEN
+        messages[i] = messages[i].copy(update={'content': truncate(content, max(tokens - excess, 0))})
+        excess -= tokens - estimate_tokens([messages[i]])
+    return messages
+
+def latest_turn_start(messages: List[BaseMessage]) -> int:
+    for i in reversed(range(len(messages))):
+        if isinstance(messages[i], HumanMessage):
+            return i
+    return 0
+
+def compact_visualizations(text: str) -> str:
+    """
+    Replaces the visualizations in an answer with a one line placeholder, the data was shown to the user
+    and is not needed to continue the conversation. Data handles are kept so that the model can reuse them.
+    """
+    def placeholder(match: re.Match) -> str:
+        attributes = dict(_ATTRIBUTE_PATTERN.findall(match.group(1)))
+        title = _TITLE_PATTERN.search(match.group(2))
+        description = attributes.get('type', 'visualization')
+        if title:
+            description += f' "{title.group(1).strip()}"'
+        if attributes.get('source'):
+            description += f" of {attributes['source']}"
+        return f"(A {description} was shown to the user here.)"
+
+    return VISUALIZATION_PATTERN.sub(placeholder, text)
+
+class TokenBudgetMemory(BaseChatMemory):
+    """
+    Conversation memory that keeps the history within an estimated token budget. Each turn is stored once,
+    with its visualizations replaced by placeholders. The oldest turns that no longer fit are rolled up into
+    a running summary by the summarizer model, or dropped when there is no summarizer. The summary is only
+    updated when turns are pruned, so it stays the same across the turns in between.
+
+    The summary counts against the budget. The latest turn is always kept, it is truncated when it does
+    not fit on its own, and it gets at least half of the budget when the summary is long.
+    """
+
+    max_token_limit: int = 20000
+    summarizer: Optional[BaseLanguageModel] = None
+    summary: str = ""
+    memory_key: str = "chat_history"
+    return_messages: bool = True
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        # The budget can be lowered between turns
+        self.prune()
+        messages = list(self.chat_memory.messages)
+        history_budget = max(self.max_token_limit - estimate_tokens(self._summary_messages(self.summary)),
+                             self.max_token_limit // 2)
+        if estimate_tokens(messages) > history_budget:
+            messages = truncate_turn(messages[latest_turn_start(messages):], history_budget)
+        summary = self.summary
+        summary_budget = self.max_token_limit - estimate_tokens(messages)
+        if estimate_tokens(self._summary_messages(summary)) > summary_budget:
+            summary_budget -= estimate_tokens(self._summary_messages(" "))
+            summary = truncate(summary, summary_budget) if summary_budget > 0 else ""
+        messages = self._summary_messages(summary) + messages
+        if not self.return_messages:
+            return {self.memory_key: get_buffer_string(messages)}
+        return {self.memory_key: messages}
+
+    async def aload_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        # Pruning can call the summarizer, which blocks
+        return await offload(self.load_memory_variables, inputs)
+
+    def _summary_messages(self, summary: str) -> List[BaseMessage]:
+        if not summary:
+            return []
+        # Anthropic models only accept a system message at the start, so the summary is a turn of its own
+        return [
+            HumanMessage(content=f"Summary of our earlier conversation:\n{summary}"),
+            AIMessage(content="Thanks, I will take the earlier conversation into account."),
+        ]
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.chat_memory.add_messages([
+            HumanMessage(content=input_str),
+            AIMessage(content=compact_visualizations(output_str)),
+        ])
+        self.prune()
+
+    async def asave_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        # Pruning can call the summarizer, which blocks
+        await offload(self.save_context, inputs, outputs)
+
+    def prune(self) -> None:
+        messages = self.chat_memory.messages
+        pruned = []
+        # Whole turns are pruned, so the history always starts with a user message, the latest turn is kept
+        while messages and (not isinstance(messages[0], HumanMessage) or (
+                latest_turn_start(messages) > 0
+                and estimate_tokens(self._summary_messages(self.summary) + messages) > self.max_token_limit)):
+            pruned.append(messages.pop(0))
+        if pruned and self.summarizer is not None:
+            self.summary = self.summarize(pruned)
+
+    def summarize(self, messages: List[BaseMessage]) -> str:
+        prompt = SUMMARY_PROMPT.format(summary=self.summary, new_lines=get_buffer_string(messages))
+        try:
+            return self.summarizer.invoke(prompt).content
+        except Exception as e:
+            print(f"summarizing the conversation failed, the pruned turns are dropped: {e}")
+            return self.summary
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = ""
@@ -0,0 +1,65 @@
+import re
+import uuid
+from contextvars import ContextVar
+import pandas as pd
+from cache import LRUCache
+
+# Tools register their result frames here and hand a short handle to the model, the renderer
+# resolves <visualization source="handle"> straight from the store so the rows never travel
+# through the model. Frames are namespaced by the session that is bound to the current context,
+# contextvars follow the turn into the threads and tasks that langchain runs tools in.
+DATASTORE_MAX_FRAMES = 256
+DATASTORE_MAX_BYTES = 512 * 1024 * 1024
+HANDLE_PATTERN = re.compile(r"\bdf-[0-9a-f]{12}\b")
+
+_session_id: ContextVar[str] = ContextVar("datastore_session_id", default="default")
+_frames = LRUCache(max_entries=DATASTORE_MAX_FRAMES, max_bytes=DATASTORE_MAX_BYTES,
+                   sizeof=lambda df: int(df.memory_usage(index=True, deep=True).sum()))
+
+def bind_session(session_id: str) -> None:
+    """
+    Binds the data store of the given session to the current context.
+    """
+    _session_id.set(session_id)
+
+def put_frame(df: pd.DataFrame, handle: str = None) -> str:
+    """
+    Stores a DataFrame for the current session and returns its handle, a new handle unless one is given.
+    """
+    handle = handle or f"df-{uuid.uuid4().hex[:12]}"
+    _frames.put((_session_id.get(), handle), df)
+    return handle
+
+def get_frame(handle: str):
+    """
+    Returns the DataFrame of a handle of the current session, or None when it is unknown or evicted.
+    """
+    return _frames.get((_session_id.get(), handle))
+
+def has_frames(text: str) -> bool:
+    """
+    Returns whether all handles referenced in the text still resolve.
+    """
+    return all(get_frame(handle) is not None for handle in HANDLE_PATTERN.findall(text))
+
+def describe_frame(df: pd.DataFrame, title: str, sample_rows: int = 5, tail_rows: int = 0) -> str:
+    """
+    Stores the DataFrame and returns a short description for the model: the handle, the schema and a sample
+    of the first rows, and optionally of the last rows.
+    """
+    handle = put_frame(df)
+    schema = ", ".join(f"{column} ({dtype})" for column, dtype in df.dtypes.astype(str).items())
+    sample = df.head(sample_rows).to_markdown(index=False) if not df.empty else "(no rows)"
+    tail = ""
+    tail_rows = min(tail_rows, max(0, len(df) - sample_rows))
+    if tail_rows > 0:
+        tail = f"\nSample of the last {tail_rows} rows:\n{df.tail(tail_rows).to_markdown(index=False)}\n"
+    return f"""{title}
+Data handle: {handle}
+Rows: {len(df)}
+Columns: {schema}
+Sample of the first {min(sample_rows, len(df))} rows:
+{sample}
+{tail}
+To show the rows to the user render <visualization type="interactive_table" source="{handle}"></visualization>,
+the data is loaded from the handle so do not repeat the rows in the visualization."""
@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional
+import pandas as pd
+from multi_region import resolve_regions
+from toolcache import refresh_requested
+
+# The inventory snapshot is optional, it is enabled by pointing INVENTORY_DB_PATH at a SQLite file.
+# Tools answer from a snapshot that is younger than INVENTORY_MAX_AGE seconds and fall back to live
+# AWS calls otherwise, the background refresher keeps the snapshots of INVENTORY_REGIONS fresh.
+INVENTORY_DB_PATH = os.environ.get("INVENTORY_DB_PATH")
+INVENTORY_MAX_AGE = int(os.environ.get("INVENTORY_MAX_AGE", "900"))
+INVENTORY_REFRESH_INTERVAL = int(os.environ.get("INVENTORY_REFRESH_INTERVAL", "300"))
+INVENTORY_REGIONS = os.environ.get("INVENTORY_REGIONS", os.environ.get("AWS_DEFAULT_REGION", "eu-west-1"))
+
+# resource name -> (fetch(region), kind), kind is 'frame' for DataFrames and 'json' for JSON documents
+_resources = {}
+
+def register_resource(name: str, fetch: Callable[[str], object], kind: str = 'frame') -> None:
+    """
+    Registers a resource that can be snapshotted, fetch(region) returns its live state.
+    """
+    _resources[name] = (fetch, kind)
+
+def _serialize(value, kind: str) -> str:
+    return value.to_json(orient='table', date_format='iso') if kind == 'frame' else json.dumps(value)
+
+def _deserialize(payload: str, kind: str):
+    return pd.read_json(io.StringIO(payload), orient='table') if kind == 'frame' else json.loads(payload)
+
+class InventoryStore:
+    """
+    Stores the latest snapshot per resource and region in a SQLite file together with the time it was taken.
+    """
+
+    def __init__(self, path: str):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                " resource TEXT NOT NULL, region TEXT NOT NULL, kind TEXT NOT NULL,"
+                " taken_at REAL NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (resource, region))"
+            )
+
+    def save(self, resource: str, region: str, value, kind: str = 'frame', taken_at: Optional[float] = None) -> None:
+        payload = _serialize(value, kind)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO snapshots (resource, region, kind, taken_at, payload) VALUES (?, ?, ?, ?, ?)",
+                (resource, region, kind, taken_at if taken_at is not None else time.time(), payload),
+            )
+
+    def load(self, resource: str, region: str):
+        """
+        Returns the snapshot and its age in seconds, or None when there is no snapshot.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT kind, taken_at, payload FROM snapshots WHERE resource = ? AND region = ?", (resource, region)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, taken_at, payload = row
+        return _deserialize(payload, kind), time.time() - taken_at
+
+    def staleness(self) -> list:
+        """
+        Returns (resource, region, age in seconds) of all snapshots.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT resource, region, taken_at FROM snapshots ORDER BY resource, region").fetchall()
+        now = time.time()
+        return [(resource, region, now - taken_at) for resource, region, taken_at in rows]
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> Optional[InventoryStore]:
+    """
+    Returns the inventory store, or None when INVENTORY_DB_PATH is not set.
+    """
+    global _store
+    if INVENTORY_DB_PATH is None:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = InventoryStore(INVENTORY_DB_PATH)
+        return _store
+
+def snapshot_or_live(resource: str, region: str, max_age: float = None, store: InventoryStore = None):
+    """
+    Returns the snapshot of the resource when it is younger than max_age, otherwise fetches the live
+    state and stores it as the new snapshot. Asking for fresh data always fetches the live state.
+
+    Returns:
+        tuple: the value and the age of the snapshot in seconds, the age is None for a live fetch
+    """
+    fetch, kind = _resources[resource]
+    store = store if store is not None else get_store()
+    max_age = max_age if max_age is not None else INVENTORY_MAX_AGE
+    if store is not None and not refresh_requested():
+        snapshot = store.load(resource, region)
+        if snapshot is not None and snapshot[1] <= max_age:
+            return snapshot
+    value = fetch(region)
+    if store is not None:
+        store.save(resource, region, value, kind)
+    return value, None
+
+def snapshot_fetcher(resource: str, ages: dict) -> Callable[[str], object]:
+    """
+    Returns fetch(region) for fan_out that answers from the snapshot and records the snapshot age per region in ages.
+    """
+    def fetch(region: str):
+        value, age = snapshot_or_live(resource, region)
+        ages[region] = age
+        return value
+    return fetch
+
+def format_snapshot_ages(ages: dict) -> str:
+    served = {region: age for region, age in ages.items() if age is not None}
+    if not served:
+        return ""
+    return "\n\nServed from the inventory snapshot: " + ", ".join(
+        f"{region} ({age / 60:.0f} min old)" for region, age in sorted(served.items()))
+
+class InventoryRefresher(threading.Thread):
+    """
+    Periodically snapshots all registered resources of the regions into the store.
+    """
+
+    def __init__(self, store: InventoryStore, regions: list, interval: float = INVENTORY_REFRESH_INTERVAL,
+                 resources: Optional[dict] = None):
+        super().__init__(name="inventory-refresher", daemon=True)
+        self.store = store
+        self.regions = regions
+        self.interval = interval
+        self.resources = resources if resources is not None else _resources
+        self.stopped = threading.Event()
+
+    def refresh(self) -> None:
+        for resource, (fetch, kind) in self.resources.items():
+            for region in self.regions:
+                if self.stopped.is_set():
+                    return
+                try:
+                    self.store.save(resource, region, fetch(region), kind)
+                except Exception as e:
+                    print(f"inventory refresh of {resource} in {region} failed: {e}")
+
+    def run(self) -> None:
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.interval)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+_refresher = None
+
+def start_refresher() -> Optional[InventoryRefresher]:
+    """
+    Starts the background refresher once per process when the inventory is enabled.
+    """
+    global _refresher
+    store = get_store()
+    if store is None:
+        return None
+    with _store_lock:
+        if _refresher is None:
+            _refresher = InventoryRefresher(store, resolve_regions(INVENTORY_REGIONS))
+            _refresher.start()
+        return _refresher
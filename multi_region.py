@@ -0,0 +1,132 @@
+import boto3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from functools import lru_cache
+from typing import Callable, List, Optional, Union
+import pandas as pd
+from cache import LRUCache
+
+REGION_TIMEOUT = 30
+# Seconds a region may wait for a thread of the pool, its REGION_TIMEOUT only starts once it runs
+REGION_QUEUE_TIMEOUT = 60
+MULTI_REGION_MAX_WORKERS = 32
+ENABLED_REGIONS_TTL = 60 * 60
+
+_enabled_regions = LRUCache(max_entries=1, ttl=ENABLED_REGIONS_TTL)
+
+# Regions of all sessions share one pool, a region that does not answer in time keeps its thread until the
+# call returns, so at most MULTI_REGION_MAX_WORKERS threads are ever left behind
+_region_pool = ThreadPoolExecutor(max_workers=MULTI_REGION_MAX_WORKERS, thread_name_prefix="region")
+
+_client_lock = threading.Lock()
+
+@lru_cache(maxsize=256)
+def _regional_client_unlocked(service: str, region: Optional[str], endpoint_url: Optional[str],
+                              configure: Optional[Callable]):
+    client = boto3.client(service, region, endpoint_url=endpoint_url)
+    if configure is not None:
+        configure(client)
+    return client
+
+def regional_client(service: str, region: Optional[str] = None, endpoint_url: Optional[str] = None,
+                    configure: Optional[Callable] = None):
+    """
+    Returns the boto3 client of a service in a region. boto3 clients are thread-safe, but creating them
+    from the shared default session is not, so every client is built once and shared by all threads.
+    configure(client) is called once on a new client, eg. to register event hooks, and every configure
+    function gets clients of its own.
+    """
+    with _client_lock:
+        return _regional_client_unlocked(service, region, endpoint_url, configure)
+
+def enabled_regions() -> list:
+    """
+    Returns the regions that are enabled for the account, falls back to the regions known to boto3.
+    """
+    regions = _enabled_regions.get('regions')
+    if regions is None:
+        try:
+            response = regional_client('ec2').describe_regions(
+                Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}]
+            )
+            regions = sorted(region['RegionName'] for region in response['Regions'])
+        except Exception:
+            regions = boto3.session.Session().get_available_regions('ec2')
+        _enabled_regions.put('regions', regions)
+    return regions
+
+def resolve_regions(regions: Union[str, List[str]]) -> list:
+    """
+    Resolves a region, a comma separated string or a list of regions, '*' selects all enabled regions.
+    """
+    if isinstance(regions, str):
+        regions = regions.split(',')
+    regions = [region.strip() for region in regions if region and region.strip()]
+    if '*' in regions:
+        return enabled_regions()
+    return list(dict.fromkeys(regions))
+
+def fan_out(fetch: Callable[[str], pd.DataFrame], regions: Union[str, List[str]], timeout: float = REGION_TIMEOUT):
+    """
+    Runs fetch(region) concurrently for every region and merges the results into one table with a
+    region column in front. Regions that fail or do not answer within the timeout are reported as errors,
+    the timeout of a region starts when it runs, not while it waits for a thread of the shared pool.
+
+    Returns:
+        tuple: the merged DataFrame and a dict of region to error message
+    """
+    regions = resolve_regions(regions)
+    started = {}
+
+    def run(region: str) -> pd.DataFrame:
+        started[region] = time.monotonic()
+        return fetch(region)
+
+    # Each region runs in a copy of the caller's context, so context variables like the data store session follow
+    submitted = time.monotonic()
+    futures = {_region_pool.submit(copy_context().run, run, region): region for region in regions}
+    pending = set(futures)
+    timeouts = {}
+    while pending:
+        now = time.monotonic()
+        deadlines = {}
+        for future in pending:
+            region = futures[future]
+            if region in started:
+                deadline, error = started[region] + timeout, f"no answer within {timeout} seconds"
+            else:
+                deadline, error = submitted + REGION_QUEUE_TIMEOUT, f"did not start within {REGION_QUEUE_TIMEOUT} seconds"
+            if deadline > now:
+                deadlines[future] = deadline
+            elif region in started or future.cancel():
+                # Running regions that do not answer in time finish on the pool
+                timeouts[future] = error
+            else:
+                # The region started while it was cancelled
+                deadlines[future] = now + timeout
+        pending = set(deadlines)
+        if pending:
+            done, _ = wait(pending, timeout=min(deadlines.values()) - now, return_when=FIRST_COMPLETED)
+            pending -= done
+
+    frames = []
+    errors = {}
+    for future, region in futures.items():
+        if future in timeouts:
+            errors[region] = timeouts[future]
+        elif future.exception() is not None:
+            errors[region] = str(future.exception())
+        else:
+            df = future.result()
+            frames.append(df.assign(region=region)[['region'] + [column for column in df.columns if column != 'region']])
+
+    frames = [frame for frame in frames if not frame.empty]
+    merged = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['region'])
+    return merged, errors
+
+def format_region_errors(errors: dict) -> str:
+    if not errors:
+        return ""
+    return "\n\nRegions that failed:\n" + "\n".join(f"  {region}: {error}" for region, error in errors.items())
@@ -0,0 +1,50 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+class ToolProgress:
+    """
+    Shows one progress line per running task of the tools of a turn, like the batches of a Logs Insights
+    query, in a Streamlit placeholder. Tools report from their own threads, the lines render into the
+    session that created the placeholder.
+    """
+
+    def __init__(self, container):
+        self.placeholder = container.empty()
+        self.lines = {}
+        self._script_run_ctx = get_script_run_ctx(suppress_warning=True)
+        self._lock = threading.Lock()
+
+    def update(self, key: str, text: str) -> None:
+        with self._lock:
+            self.lines[key] = text
+            if self._script_run_ctx is not None:
+                add_script_run_ctx(threading.current_thread(), self._script_run_ctx)
+            self.placeholder.caption("  \n".join(self.lines.values()))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.lines = {}
+            self.placeholder.empty()
+
+_progress: ContextVar[Optional[ToolProgress]] = ContextVar("tool_progress", default=None)
+
+@contextmanager
+def bind_tool_progress(progress: ToolProgress):
+    """
+    Makes the tools that run in the current context report their progress to the placeholder.
+    """
+    token = _progress.set(progress)
+    try:
+        yield progress
+    finally:
+        _progress.reset(token)
+        progress.clear()
+
+def current_tool_progress() -> Optional[ToolProgress]:
+    """
+    Returns the progress of the current turn, tools read it before they start threads of their own.
+    """
+    return _progress.get()
@@ -1,3 +1,4 @@
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts.chat import ChatPromptTemplate
 
 SYSTEM_PROMPT="""
@@ -20,36 +21,38 @@ def foo():
 
 <data_visualization_capabilities>
 You have the ability to create various types of graphs and tables to visualize data. When appropriate, 
-you can generate these visualizations using the following XML format:
-
-<visualization type="visualization_type">
-  <data>
-    <item>
-      <column1>value1</column1>
-      <column2>value2</column2>
-      ...
-    </item>
-    <item>
-      <column1>value3</column1>
-      <column2>value4</column2>
-      ...
-    </item>
-    ...
-  </data>
+you can generate these visualizations using the following XML format with the data in a compact CSV body. 
+The first line of the CSV is the header with the column names, every following line is one row:
+
+<visualization type="visualization_type" format="csv">
+  <data><![CDATA[
+column1,column2
+value1,value2
+value3,value4
+]]></data>
   <options>
     <!-- Optional configuration parameters -->
   </options>
 </visualization>
 
 IMPORTANT: 
+- Always wrap the CSV in <![CDATA[ and ]]> so that characters like < and & in values are allowed.
+- Quote values that contain a comma, a double quote or a line break with double quotes, eg. "eu-west-1, eu-central-1".
+- Every row must have the same number of values as the header.
 - Ensure all opening tags have a matching closing tag.
-- Use consistent naming for tags (e.g., always use camelCase or snake_case, but don't mix).
-- Double-check that closing tags match opening tags exactly.
-- Avoid common errors like using </column> instead of </column1>.
 
-Before providing your response, validate your XML structure to ensure all tags are properly closed and matched.
+Alternatively you can use format="json-columns" with a JSON object that maps every column name to the list of its values:
+
+<visualization type="bar" format="json-columns">
+  <data><![CDATA[{"x": ["Category A", "Category B"], "y": [10, 15]}]]></data>
+  <options>
+    <title>Sample Bar Chart</title>
+  </options>
+</visualization>
+
+Prefer format="csv", especially for tables and long lists, it uses the fewest tokens per row.
 
-Example of correct structure:
+Only when a compact format cannot be used, you can omit the format attribute and write every row as an item element:
 
 <visualization type="bar">
   <data>
@@ -67,6 +70,10 @@ Example of correct structure:
   </options>
 </visualization>
 
+When using the item format, use consistent naming for tags and double-check that closing tags match opening tags exactly.
+
+Before providing your response, validate your XML structure to ensure all tags are properly closed and matched.
+
 Remember: Consistency and accuracy in XML structure are crucial for proper visualization rendering.
 
 Supported visualization types are:
@@ -91,21 +98,13 @@ Some chart types may require specific column names or additional data points.
 When presenting any kind of list or tabular data, such as log groups, AWS resources, or any other list-like information, 
 automatically render it as an interactive table. For example:
 
-<visualization type="interactive_table">
-  <data>
-    <item>
-      <LogGroupName>/aws/lambda/function1</LogGroupName>
-      <LastEventTimestamp>2023-04-01T12:00:00Z</LastEventTimestamp>
-    </item>
-    <item>
-      <LogGroupName>/aws/lambda/function2</LogGroupName>
-      <LastEventTimestamp>2023-04-02T14:30:00Z</LastEventTimestamp>
-    </item>
-    <item>
-      <LogGroupName>/aws/ec2/instance1</LogGroupName>
-      <LastEventTimestamp>2023-04-03T09:15:00Z</LastEventTimestamp>
-    </item>
-  </data>
+<visualization type="interactive_table" format="csv">
+  <data><![CDATA[
+LogGroupName,LastEventTimestamp
+/aws/lambda/function1,2023-04-01T12:00:00Z
+/aws/lambda/function2,2023-04-02T14:30:00Z
+/aws/ec2/instance1,2023-04-03T09:15:00Z
+]]></data>
   <options>
     <title>AWS CloudWatch Log Groups</title>
     <sortable>true</sortable>
@@ -116,69 +115,52 @@ automatically render it as an interactive table. For example:
 Always use this table format for presenting lists or tabular data, regardless of the specific content.
 </auto_table_rendering>
 
+<data_handles>
+Some tools do not return their rows but register them as a data handle like df-0123456789ab and return the handle, 
+the columns and a small sample. To visualize that data, reference the handle with the source attribute and leave out 
+the data element, the rows are loaded from the handle:
+
+<visualization type="interactive_table" source="df-0123456789ab">
+  <options>
+    <title>Athena Query Results</title>
+  </options>
+</visualization>
+
+Charts work the same way, the columns of the handle are used in order, so <visualization type="bar" source="df-0123456789ab"> 
+uses the first column for x and the second column for y. Never copy the rows of a data handle into the visualization yourself.
+</data_handles>
+
 Examples of other visualizations:
 
 1. Bar Chart:
-<visualization type="bar">
-  <data>
-    <item>
-      <x>Category A</x>
-      <y>10</y>
-    </item>
-    <item>
-      <x>Category B</x>
-      <y>15</y>
-    </item>
-    <item>
-      <x>Category C</x>
-      <y>7</y>
-    </item>
-  </data>
+<visualization type="bar" format="csv">
+  <data><![CDATA[
+x,y
+Category A,10
+Category B,15
+Category C,7
+]]></data>
   <options>
     <title>Sample Bar Chart</title>
   </options>
 </visualization>
 
 2. Scatter 3D:
-<visualization type="scatter_3d">
-  <data>
-    <item>
-      <x>1</x>
-      <y>2</y>
-      <z>3</z>
-    </item>
-    <item>
-      <x>4</x>
-      <y>5</y>
-      <z>6</z>
-    </item>
-    <item>
-      <x>7</x>
-      <y>8</y>
-      <z>9</z>
-    </item>
-  </data>
+<visualization type="scatter_3d" format="csv">
+  <data><![CDATA[
+x,y,z
+1,2,3
+4,5,6
+7,8,9
+]]></data>
   <options>
     <title>3D Scatter Plot</title>
   </options>
 </visualization>
 
 3. Pie Chart:
-<visualization type="pie">
-  <data>
-    <item>
-      <name>Category A</name>
-      <value>30</value>
-    </item>
-    <item>
-      <name>Category B</name>
-      <value>20</value>
-    </item>
-    <item>
-      <name>Category C</name>
-      <value>50</value>
-    </item>
-  </data>
+<visualization type="pie" format="json-columns">
+  <data><![CDATA[{"name": ["Category A", "Category B", "Category C"], "value": [30, 20, 50]}]]></data>
   <options>
     <title>Sample Pie Chart</title>
   </options>
@@ -195,12 +177,25 @@ Remember: Consistency and accuracy in XML structure are crucial for proper visua
 </rendering_capabilities>
 <tool_usage>
 You will never, ever use the python REPL tool unless you are explicitly asked by the user to do so. 
+Before writing an Athena query, use find_relevant_glue_tables to get the schemas of the tables that are relevant to the 
+question. Only list the whole catalog with list_glue_databases_and_tables when the user asks for it.
+For questions about what happened in the logs, eg. errors in the last hour, use run_logs_insights_query with an 
+aggregating query instead of reading raw log events.
+The inventory tools accept a list of regions. When a question covers several regions, pass all of them in a single 
+call, or ['*'] for all enabled regions, instead of calling the tool once per region.
+For CloudTrail questions, narrow list_cloudtrail_events down with hours and an attribute filter, eg. 
+attribute_key='EventName' and attribute_value='DeleteBucket', instead of reading all recent events.
+When a question needs several independent tool calls, eg. the RDS instances and the ECR repositories, make them all 
+in one message, they are executed concurrently.
 </tool_usage>
 """
 
 def prompt_template():
+    # The static parts come first and the history before the new input, so that the prompt cache
+    # checkpoints after the system prompt and after the history match across steps and turns
     return ChatPromptTemplate.from_messages([
-        ("system", SYSTEM_PROMPT),
+        # The system prompt contains JSON examples, so it is passed as a message instead of a template
+        SystemMessage(content=SYSTEM_PROMPT),
         ("placeholder", "{chat_history}"),
         ("human", "{input}"),
         ("placeholder", "{agent_scratchpad}"),
@@ -0,0 +1,128 @@
+import io
+import json
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from botocore.response import StreamingBody
+
+# Anthropic models cache the prompt prefix up to a checkpoint, the prefix is ordered tools, system, messages.
+# Checkpoints are placed after the tools, after the system prompt and after the last message, so the next
+# step of the agent loop and the next turn read the static part and the history so far from the cache.
+# langchain_aws drops cache_control from the system prompt and text blocks, so the checkpoints are added
+# to the InvokeModel request body by a botocore hook on the client.
+#
+# The tools come first in the prefix, so a cached prefix is only read again when the next request exposes
+# the same tool schemas. Tool routing changes the schemas from turn to turn, the app therefore turns
+# routing off while prompt caching is on: every request pays for all schemas, but reads them from the cache.
+CACHE_CONTROL = {"type": "ephemeral"}
+
+def _with_cache_control(block: dict) -> dict:
+    return {**block, "cache_control": CACHE_CONTROL}
+
+def add_cache_checkpoints(body: dict) -> dict:
+    """
+    Adds cache checkpoints to an Anthropic messages request body.
+    """
+    if "messages" not in body:
+        return body
+    if body.get("tools"):
+        body["tools"] = body["tools"][:-1] + [_with_cache_control(body["tools"][-1])]
+    if isinstance(body.get("system"), str) and body["system"]:
+        body["system"] = [_with_cache_control({"type": "text", "text": body["system"]})]
+    if body["messages"]:
+        message = body["messages"][-1]
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        if content:
+            body["messages"][-1] = {**message, "content": content[:-1] + [_with_cache_control(content[-1])]}
+    return body
+
+class PromptCacheUsage:
+    """
+    Sums the cache read and cache write input tokens of the model calls of a turn.
+    """
+
+    def __init__(self):
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self._lock = threading.Lock()
+
+    def add(self, usage: dict) -> None:
+        with self._lock:
+            self.cache_read_tokens += usage.get("cache_read_input_tokens") or 0
+            self.cache_write_tokens += usage.get("cache_creation_input_tokens") or 0
+
+_usage: ContextVar[Optional[PromptCacheUsage]] = ContextVar("prompt_cache_usage", default=None)
+
+@contextmanager
+def track_prompt_cache_usage():
+    """
+    Collects the cache token counts of the model calls made in the current context, like get_openai_callback.
+    """
+    usage = PromptCacheUsage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+def _add_checkpoints_to_request(params: dict, **kwargs) -> None:
+    body = params.get("body")
+    if body is None:
+        return
+    params["body"] = json.dumps(add_cache_checkpoints(json.loads(body)))
+
+def _record_usage(parsed: dict, **kwargs) -> None:
+    usage = _usage.get()
+    if usage is None or "body" not in parsed:
+        return
+    # The body is a stream, it is read here and replaced by a copy for langchain
+    data = parsed["body"].read()
+    parsed["body"] = StreamingBody(io.BytesIO(data), len(data))
+    try:
+        usage.add(json.loads(data).get("usage", {}))
+    except ValueError:
+        pass
+
+class _UsageRecordingStream:
+    """
+    Passes the events of a response stream through and records the usage of its message_start event.
+    """
+
+    def __init__(self, stream, usage: PromptCacheUsage):
+        self._stream = stream
+        self._usage = usage
+
+    def __iter__(self):
+        for event in self._stream:
+            chunk = event.get("chunk")
+            if chunk:
+                try:
+                    data = json.loads(chunk["bytes"])
+                except ValueError:
+                    data = {}
+                if data.get("type") == "message_start":
+                    self._usage.add(data["message"].get("usage", {}))
+            yield event
+
+    def close(self) -> None:
+        self._stream.close()
+
+def _record_stream_usage(parsed: dict, **kwargs) -> None:
+    usage = _usage.get()
+    if usage is None or "body" not in parsed:
+        return
+    # The usage arrives with the first event, the stream is read by langchain as it arrives
+    parsed["body"] = _UsageRecordingStream(parsed["body"], usage)
+
+def register_prompt_caching(bedrock_client) -> None:
+    """
+    Makes every Anthropic request of the bedrock-runtime client use prompt caching and report its usage.
+    """
+    events = bedrock_client.meta.events
+    for operation in ("InvokeModel", "InvokeModelWithResponseStream"):
+        events.register(f"before-parameter-build.bedrock-runtime.{operation}", _add_checkpoints_to_request)
+    events.register("after-call.bedrock-runtime.InvokeModel", _record_usage)
+    events.register("after-call.bedrock-runtime.InvokeModelWithResponseStream", _record_stream_usage)
@@ -1,147 +1,299 @@
+import hashlib
+import io
+import json
 import pandas as pd
 import os
 import plotly.express as px
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
 import xml.etree.ElementTree as ET
+from cache import LRUCache
+from datastore import get_frame
 
-def render_visualization(content):
-    try:
-        root = ET.fromstring(content)
-        viz_type = root.get('type', '').lower()
-
-        if viz_type == 'file':
-            options = root.find('options')
-            if options is not None:
-                filename = options.find('filename').text
-                if filename and os.path.exists(filename):
-                    with open(filename, 'r') as file:
-                        content = file.read()
-                    return render_visualization(content)
-                else:
-                    st.warning(f"File not found: {filename}")
-                    return
+# Figures are cached as plotly JSON keyed by the hash of the visualization XML, so
+# reruns re-emit the figures of past turns instead of parsing and building them again
+FIGURE_CACHE_MAX_ENTRIES = 512
+FIGURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+figure_cache = LRUCache(max_entries=FIGURE_CACHE_MAX_ENTRIES, max_bytes=FIGURE_CACHE_MAX_BYTES,
+                        sizeof=lambda entry: len(entry[1]))
 
-        # Rest of the rendering logic remains the same
-        data_element = root.find('data')
-        if data_element is None or len(data_element) == 0:
-            st.warning("No data provided for visualization.")
-            return
+class VisualizationWarning(Exception):
+    """
+    Raised when a visualization cannot be built from well-formed XML.
+    """
 
-        data = []
-        for item in data_element:
-            data.append({child.tag: child.text for child in item})
+def _parse_xml_data(data_element):
+    if len(data_element) == 0:
+        raise VisualizationWarning("No data provided for visualization.")
+    data = []
+    for item in data_element:
+        data.append({child.tag: child.text for child in item})
+    return pd.DataFrame(data)
 
-        df = pd.DataFrame(data)
+def _parse_csv_data(data_element):
+    text = (data_element.text or '').strip()
+    if not text:
+        raise VisualizationWarning("No data provided for visualization.")
+    return pd.read_csv(io.StringIO(text), skipinitialspace=True)
 
-        if df.empty:
-            st.warning("Data frame is empty. Cannot render visualization.")
-            return
+def _parse_json_columns_data(data_element):
+    text = (data_element.text or '').strip()
+    if not text:
+        raise VisualizationWarning("No data provided for visualization.")
+    columns = json.loads(text)
+    if not isinstance(columns, dict):
+        raise VisualizationWarning("json-columns data must be an object of column name to list of values.")
+    return pd.DataFrame(columns)
 
-        options_element = root.find('options')
-        options = {}
-        if options_element is not None:
-            options = {child.tag: child.text for child in options_element}
-        title = options.get('title', '')
-
-        fig = None
-
-        # Basics
-        if viz_type in ['scatter', 'line', 'area', 'bar', 'funnel', 'timeline']:
-            fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], title=title)
-
-        # Part-of-Whole
-        elif viz_type in ['pie', 'sunburst', 'treemap', 'icicle', 'funnel_area']:
-            fig = getattr(px, viz_type)(df, values=df.columns[1], names=df.columns[0], title=title)
-
-        # 1D Distributions
-        elif viz_type in ['histogram', 'box', 'violin', 'strip', 'ecdf']:
-            fig = getattr(px, viz_type)(df, x=df.columns[0], title=title)
-
-        # 2D Distributions
-        elif viz_type in ['density_heatmap', 'density_contour']:
-            fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], title=title)
-
-        # Matrix or Image Input
-        elif viz_type == 'imshow':
-            fig = px.imshow(df, title=title)
-
-        # 3-Dimensional
-        elif viz_type in ['scatter_3d', 'line_3d']:
-            fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], z=df.columns[2], title=title)
-
-        # Multidimensional
-        elif viz_type == 'scatter_matrix':
-            fig = px.scatter_matrix(df, dimensions=df.columns, title=title)
-        elif viz_type in ['parallel_coordinates', 'parallel_categories']:
-            fig = getattr(px, viz_type)(df, title=title)
-
-        # Tile Maps
-        elif viz_type in ['scatter_mapbox', 'line_mapbox', 'choropleth_mapbox', 'density_mapbox']:
-            fig = getattr(px, viz_type)(df, lat='latitude', lon='longitude', title=title)
-            fig.update_layout(mapbox_style="open-street-map")
-
-        # Outline Maps
-        elif viz_type in ['scatter_geo', 'line_geo', 'choropleth']:
-            fig = getattr(px, viz_type)(df, locations='iso_alpha', color=df.columns[1], title=title)
-
-        # Polar Charts
-        elif viz_type in ['scatter_polar', 'line_polar', 'bar_polar']:
-            fig = getattr(px, viz_type)(df, r=df.columns[1], theta=df.columns[0], title=title)
-
-        # Ternary Charts
-        elif viz_type in ['scatter_ternary', 'line_ternary']:
-            fig = getattr(px, viz_type)(df, a=df.columns[0], b=df.columns[1], c=df.columns[2], title=title)
-
-        # Tables
-        elif viz_type in ['table', 'interactive_table']:
-            fig = go.Figure(data=[go.Table(
-                header=dict(values=list(df.columns),
-                            fill_color='paleturquoise',
-                            align='left'),
-                cells=dict(values=[df[col] for col in df.columns],
-                           fill_color='lavender',
-                           align='left'))
-            ])
-            fig.update_layout(title=title)
-
-        if fig:
-            fig.update_layout(
-                title={
-                    'text': title,
-                    'y':0.9,
-                    'x':0.5,
-                    'xanchor': 'center',
-                    'yanchor': 'top'
-                }
-            )
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.warning(f"Unsupported visualization type: {viz_type}")
+DATA_PARSERS = {
+    'xml': _parse_xml_data,
+    'csv': _parse_csv_data,
+    'json-columns': _parse_json_columns_data,
+}
+
+def parse_data(root):
+    """
+    Parses the data element of a visualization into a DataFrame. The source attribute resolves a
+    data handle registered by a tool, otherwise the format attribute selects the compact 'csv' or
+    'json-columns' bodies, per-item 'xml' is the default.
+    """
+    source = root.get('source')
+    if source:
+        df = get_frame(source)
+        if df is None:
+            raise VisualizationWarning(f"Data handle not found or expired: {source}")
+        return df
+    data_format = root.get('format', 'xml').lower()
+    parser = DATA_PARSERS.get(data_format)
+    if parser is None:
+        raise VisualizationWarning(f"Unsupported data format: {data_format}")
+    data_element = root.find('data')
+    if data_element is None:
+        raise VisualizationWarning("No data provided for visualization.")
+    return parser(data_element)
+
+def build_figure(root):
+    """
+    Builds the plotly figure of a parsed visualization element.
+    """
+    viz_type = root.get('type', '').lower()
+
+    df = parse_data(root)
+
+    if df.empty:
+        raise VisualizationWarning("Data frame is empty. Cannot render visualization.")
+
+    options_element = root.find('options')
+    options = {}
+    if options_element is not None:
+        options = {child.tag: child.text for child in options_element}
+    title = options.get('title', '')
+
+    fig = None
+
+    # Basics
+    if viz_type in ['scatter', 'line', 'area', 'bar', 'funnel', 'timeline']:
+        fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], title=title)
+
+    # Part-of-Whole
+    elif viz_type in ['pie', 'sunburst', 'treemap', 'icicle', 'funnel_area']:
+        fig = getattr(px, viz_type)(df, values=df.columns[1], names=df.columns[0], title=title)
+
+    # 1D Distributions
+    elif viz_type in ['histogram', 'box', 'violin', 'strip', 'ecdf']:
+        fig = getattr(px, viz_type)(df, x=df.columns[0], title=title)
+
+    # 2D Distributions
+    elif viz_type in ['density_heatmap', 'density_contour']:
+        fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], title=title)
+
+    # Matrix or Image Input
+    elif viz_type == 'imshow':
+        fig = px.imshow(df, title=title)
+
+    # 3-Dimensional
+    elif viz_type in ['scatter_3d', 'line_3d']:
+        fig = getattr(px, viz_type)(df, x=df.columns[0], y=df.columns[1], z=df.columns[2], title=title)
+
+    # Multidimensional
+    elif viz_type == 'scatter_matrix':
+        fig = px.scatter_matrix(df, dimensions=df.columns, title=title)
+    elif viz_type in ['parallel_coordinates', 'parallel_categories']:
+        fig = getattr(px, viz_type)(df, title=title)
+
+    # Tile Maps
+    elif viz_type in ['scatter_mapbox', 'line_mapbox', 'choropleth_mapbox', 'density_mapbox']:
+        fig = getattr(px, viz_type)(df, lat='latitude', lon='longitude', title=title)
+        fig.update_layout(mapbox_style="open-street-map")
+
+    # Outline Maps
+    elif viz_type in ['scatter_geo', 'line_geo', 'choropleth']:
+        fig = getattr(px, viz_type)(df, locations='iso_alpha', color=df.columns[1], title=title)
+
+    # Polar Charts
+    elif viz_type in ['scatter_polar', 'line_polar', 'bar_polar']:
+        fig = getattr(px, viz_type)(df, r=df.columns[1], theta=df.columns[0], title=title)
+
+    # Ternary Charts
+    elif viz_type in ['scatter_ternary', 'line_ternary']:
+        fig = getattr(px, viz_type)(df, a=df.columns[0], b=df.columns[1], c=df.columns[2], title=title)
+
+    # Tables
+    elif viz_type in ['table', 'interactive_table']:
+        fig = go.Figure(data=[go.Table(
+            header=dict(values=list(df.columns),
+                        fill_color='paleturquoise',
+                        align='left'),
+            cells=dict(values=[df[col] for col in df.columns],
+                       fill_color='lavender',
+                       align='left'))
+        ])
+        fig.update_layout(title=title)
+
+    if fig is None:
+        raise VisualizationWarning(f"Unsupported visualization type: {viz_type}")
+
+    fig.update_layout(
+        title={
+            'text': title,
+            'y':0.9,
+            'x':0.5,
+            'xanchor': 'center',
+            'yanchor': 'top'
+        }
+    )
+    return fig
+
+def _load_visualization_file(root):
+    options = root.find('options')
+    if options is None:
+        return None
+    filename = options.find('filename').text
+    if filename and os.path.exists(filename):
+        with open(filename, 'r') as file:
+            return file.read()
+    raise VisualizationWarning(f"File not found: {filename}")
+
+def _build_cache_entry(content):
+    """
+    Returns the cache entry of a visualization: ('figure', json), ('warning', message), ('error', message)
+    or ('file', content) for visualizations that are loaded from a file.
+    """
+    try:
+        root = ET.fromstring(content)
+        if root.get('type', '').lower() == 'file':
+            file_content = _load_visualization_file(root)
+            if file_content is not None:
+                return ('file', file_content)
+        return ('figure', build_figure(root).to_json())
+    except VisualizationWarning as e:
+        return ('warning', str(e))
     except ET.ParseError:
-        st.warning("Invalid XML format for visualization data.")
+        return ('warning', "Invalid XML format for visualization data.")
     except Exception as e:
-        st.error(f"Error rendering visualization: {str(e)}")
+        return ('error', f"Error rendering visualization: {str(e)}")
+
+def render_visualization(content):
+    key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    entry = figure_cache.get(key)
+    if entry is None:
+        entry = _build_cache_entry(content)
+        if entry[0] == 'file':
+            # The file can change between reruns, so only its content is cached
+            return render_visualization(entry[1])
+        figure_cache.put(key, entry)
+
+    kind, value = entry
+    if kind == 'figure':
+        st.plotly_chart(pio.from_json(value), use_container_width=True)
+    elif kind == 'warning':
+        st.warning(value)
+    else:
+        st.error(value)
         st.code(content, language="xml")
 
-def process_content(content):
-    parts = content.split('<visualization')
-
-    # Process the initial non-XML content, if any
-    if parts[0].strip():
-        st.markdown(parts[0].strip())
-
-    # Process each XML block
-    for part in parts[1:]:
-        xml_parts = part.split('</visualization>', 1)
-        if len(xml_parts) == 2:
-            xml_string = '<visualization' + xml_parts[0] + '</visualization>'
-            render_visualization(xml_string)
-
-            # Process any non-XML content after the visualization block
-            if xml_parts[1].strip():
-                st.markdown(xml_parts[1].strip())
-        else:
+class StreamingContentRenderer:
+    """
+    Single-pass, resumable renderer for content that arrives in chunks.
+
+    Markdown is flushed as soon as it cannot be the start of a visualization tag, only the
+    currently open visualization block is buffered and it is rendered the moment its closing
+    tag arrives.
+    """
+
+    OPEN_TAG = '<visualization'
+    CLOSE_TAG = '</visualization>'
+
+    def __init__(self, container=None):
+        self.container = container if container is not None else st.container()
+        self._buffer = ''
+        self._in_visualization = False
+        self._scan_from = 0
+        self._markdown = ''
+        self._placeholder = None
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        while self._buffer:
+            if self._in_visualization:
+                end = self._buffer.find(self.CLOSE_TAG, self._scan_from)
+                if end == -1:
+                    # Resume the search where a partial closing tag could start
+                    self._scan_from = max(0, len(self._buffer) - len(self.CLOSE_TAG) + 1)
+                    return
+                end += len(self.CLOSE_TAG)
+                with self.container:
+                    render_visualization(self._buffer[:end])
+                self._buffer = self._buffer[end:]
+                self._in_visualization = False
+                self._scan_from = 0
+            else:
+                start = self._buffer.find(self.OPEN_TAG)
+                if start == -1:
+                    safe = len(self._buffer) - self._partial_open_tag_length()
+                    self._write_markdown(self._buffer[:safe])
+                    self._buffer = self._buffer[safe:]
+                    return
+                self._write_markdown(self._buffer[:start])
+                self._end_markdown_segment()
+                self._buffer = self._buffer[start:]
+                self._in_visualization = True
+                self._scan_from = len(self.OPEN_TAG)
+
+    def close(self):
+        if self._in_visualization:
             # Handle case where </visualization> tag is missing
-            st.warning("Malformed visualization XML block detected.")
-            st.code('<visualization' + part, language="xml")
\ No newline at end of file
+            with self.container:
+                st.warning("Malformed visualization XML block detected.")
+                st.code(self._buffer, language="xml")
+        else:
+            self._write_markdown(self._buffer)
+        self._buffer = ''
+        self._in_visualization = False
+        self._scan_from = 0
+        self._end_markdown_segment()
+
+    def _partial_open_tag_length(self):
+        for length in range(min(len(self.OPEN_TAG) - 1, len(self._buffer)), 0, -1):
+            if self._buffer.endswith(self.OPEN_TAG[:length]):
+                return length
+        return 0
+
+    def _write_markdown(self, text):
+        if not text:
+            return
+        self._markdown += text
+        if self._markdown.strip():
+            if self._placeholder is None:
+                self._placeholder = self.container.empty()
+            self._placeholder.markdown(self._markdown.strip())
+
+    def _end_markdown_segment(self):
+        self._markdown = ''
+        self._placeholder = None
+
+def process_content(content):
+    renderer = StreamingContentRenderer()
+    renderer.feed(content)
+    renderer.close()
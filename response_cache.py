@@ -0,0 +1,179 @@
+import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, List, Optional
+import pandas as pd
+from langchain_core.messages import BaseMessage
+from datastore import HANDLE_PATTERN, get_frame, put_frame
+from prompt import SYSTEM_PROMPT
+from toolset import list_of_tools
+
+# Answers are cached on disk and shared by all sessions of the host, keyed by the normalized question, the
+# model and its sampling settings, the tool set version and a digest of the history the question depends on. A question that stands
+# on its own does not depend on the history, so repeated dashboard questions hit across sessions. The data
+# frames an answer refers to are stored with it and restored under the same handles. The answers hold account
+# data, so the file is only readable by the user that runs the app.
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH",
+                                        os.path.join(os.path.expanduser("~"), ".aws-bedrock-chat", "responses.db"))
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+RESPONSE_CACHE_MAX_FRAME_BYTES = 16 * 1024 * 1024
+FOLLOW_UP_MESSAGES = 4
+
+# Seconds an answer stays valid per intent, the intent of an answer comes from the tools it used and the
+# shortest TTL of those wins. Answers that depend on the current time or on Python are never cached.
+INTENT_TTLS = {
+    'time': 0,
+    'python': 0,
+    'events': 2 * 60,
+    'inventory': 15 * 60,
+    'athena': 15 * 60,
+    'usage': 60 * 60,
+    'catalog': 60 * 60,
+    'general': 24 * 60 * 60,
+}
+TOOL_INTENTS = {
+    'get_current_time': 'time',
+    'Python_REPL': 'python',
+    'list_cloudtrail_events': 'events',
+    'run_logs_insights_query': 'events',
+    'list_all_log_groups_as_table': 'inventory',
+    'list_rds_instances': 'inventory',
+    'list_ecr_repositories_and_versions': 'inventory',
+    'execute_athena_query': 'athena',
+    'bedrock_token_counts_tool': 'usage',
+    'list_glue_databases_and_tables': 'catalog',
+    'find_relevant_glue_tables': 'catalog',
+}
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|its|that|those|these|them|they|same|again|above|previous|before|instead|also|more|what about)\b|^(and|but|or|now)\b",
+    re.IGNORECASE)
+
+def _digest(*parts: str) -> str:
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()
+
+# The answers of a changed tool set or system prompt are different answers
+TOOLSET_VERSION = _digest(SYSTEM_PROMPT, *(json.dumps([tool.name, tool.description, tool.args], sort_keys=True)
+                                           for tool in list_of_tools))[:16]
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().rstrip("?!. ").lower()
+
+def relevant_history(query: str, messages: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Returns the part of the history that the answer to the question depends on, the last turns for a
+    follow-up question and nothing for a question that stands on its own.
+    """
+    if FOLLOW_UP_PATTERN.search(query) or len(query.split()) < 4:
+        return messages[-FOLLOW_UP_MESSAGES:]
+    return []
+
+def cache_key(query: str, model: str, messages: List[BaseMessage], temperature: float, max_tokens: int) -> str:
+    history = [f"{message.type}:{message.content}" for message in relevant_history(query, messages)]
+    return _digest(normalize_query(query), model, f"{float(temperature)}", f"{int(max_tokens)}", TOOLSET_VERSION, *history)
+
+def answer_ttl(used_tools: Iterable[str]) -> int:
+    intents = {TOOL_INTENTS.get(tool, 'general') for tool in used_tools} or {'general'}
+    return min(INTENT_TTLS[intent] for intent in intents)
+
+def describe_age(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f}s"
+    if seconds < 60 * 60:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+class CachedResponse:
+    def __init__(self, key: str, answer: str, model: str, age: float):
+        self.key = key
+        self.answer = answer
+        self.model = model
+        self.age = age
+
+class ResponseCache:
+    """
+    Stores answers with their data frames in a SQLite file, entries expire after the TTL of their intent.
+    """
+
+    def __init__(self, path: str):
+        # SQLite creates the journal files with the permissions of the database file
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, query TEXT NOT NULL, model TEXT NOT NULL, created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL, answer TEXT NOT NULL, frames TEXT NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Returns the cached answer and registers its data frames in the current session, or None when
+        there is no valid entry.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT model, created_at, answer, frames FROM responses WHERE key = ? AND expires_at > ?",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        model, created_at, answer, frames = row
+        for handle, payload in json.loads(frames).items():
+            put_frame(pd.read_json(io.StringIO(payload), orient='table'), handle=handle)
+        return CachedResponse(key, answer, model, time.time() - created_at)
+
+    def put(self, key: str, query: str, model: str, answer: str, ttl: float) -> bool:
+        """
+        Stores the answer with the data frames it refers to, returns whether it was stored.
+        """
+        frames = {}
+        for handle in dict.fromkeys(HANDLE_PATTERN.findall(answer)):
+            df = get_frame(handle)
+            if df is None:
+                return False
+            frames[handle] = df.to_json(orient='table', date_format='iso')
+        if ttl <= 0 or sum(len(payload) for payload in frames.values()) > RESPONSE_CACHE_MAX_FRAME_BYTES:
+            return False
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, query, model, created_at, expires_at, answer, frames)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, query, model, now, now + ttl, answer, json.dumps(frames)),
+            )
+            self._connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            self._connection.execute(
+                "DELETE FROM responses WHERE key NOT IN"
+                " (SELECT key FROM responses ORDER BY created_at DESC LIMIT ?)", (RESPONSE_CACHE_MAX_ENTRIES,)
+            )
+        return True
+
+    def invalidate(self, key: str) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM responses WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(RESPONSE_CACHE_DB_PATH)
+        return _cache
@@ -0,0 +1,58 @@
+import time
+from typing import Any, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from renderer import StreamingContentRenderer
+
+class StreamingResponseHandler(BaseCallbackHandler):
+    """
+    Renders the tokens of the final answer progressively into a Streamlit container
+    and measures the time-to-first-token of the turn.
+
+    Every LLM call of the agent loop starts a fresh answer, so text that precedes a
+    tool call is replaced by the text of the next call and only the final answer remains.
+    """
+
+    # Tokens are rendered in order on the thread of the event loop when the agent runs async
+    run_inline = True
+
+    def __init__(self, container):
+        self.placeholder = container.empty()
+        self.renderer = StreamingContentRenderer(self.placeholder.container())
+        self.text = ""
+        self.start_time = time.perf_counter()
+        self.first_token_time: Optional[float] = None
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_time is None:
+            return None
+        return self.first_token_time - self.start_time
+
+    @property
+    def has_content(self) -> bool:
+        return bool(self.text.strip())
+
+    def _reset(self):
+        self.text = ""
+        self.placeholder.empty()
+        self.renderer = StreamingContentRenderer(self.placeholder.container())
+
+    def on_llm_start(self, serialized: dict, prompts: list, **kwargs: Any) -> None:
+        self._reset()
+
+    def on_chat_model_start(self, serialized: dict, messages: list, **kwargs: Any) -> None:
+        self._reset()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if isinstance(token, list):
+            # Anthropic chunks can arrive as content blocks, only the text blocks are rendered
+            token = "".join(block.get("text", "") for block in token if isinstance(block, dict))
+        if not token:
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.text += token
+        self.renderer.feed(token)
+
+    def finish(self):
+        self.renderer.close()
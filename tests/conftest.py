@@ -0,0 +1,9 @@
+import pytest
+
+@pytest.fixture(autouse=True)
+def aws_credentials(monkeypatch):
+    # Tests never reach AWS, clients are stubbed or served by moto
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
@@ -0,0 +1,82 @@
+import threading
+import time
+from langchain.agents.agent import RunnableMultiActionAgent
+from langchain_core.agents import AgentAction, AgentFinish
+from langchain_core.runnables import RunnableLambda
+from langchain_core.tools import StructuredTool
+from agent import ParallelAgentExecutor, serial_tool
+from async_runtime import ASYNC_MAX_WORKERS, offload, run_async
+from toolset import python_repl_tool
+
+def test_serial_tool_calls_do_not_exhaust_the_shared_pool():
+    # More turns wait for the serial tool than the shared pool has threads, and the holder of the lock
+    # needs a thread of the pool for its own work, like the Python REPL tool does
+    turns = ASYNC_MAX_WORKERS + 8
+    active = []
+    overlaps = []
+    done = []
+
+    async def turn():
+        async with serial_tool():
+            active.append(1)
+            overlaps.append(len(active))
+            await offload(time.sleep, 0.001)
+            active.pop()
+        done.append(1)
+
+    threads = [threading.Thread(target=run_async, args=(turn(),)) for _ in range(turns)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert len(done) == turns
+    assert max(overlaps) == 1
+
+def _recording_tool(name: str, log: list, seconds: float):
+    def run(query: str = "") -> str:
+        log.append(('start', name, time.perf_counter()))
+        time.sleep(seconds)
+        log.append(('end', name, time.perf_counter()))
+        return f"{name} done"
+    return StructuredTool.from_function(func=run, name=name, description=f"Runs {name}")
+
+def _executor(actions: list, tools: list) -> ParallelAgentExecutor:
+    # One model turn calls all the actions, the next one answers
+    def plan(inputs):
+        if inputs['intermediate_steps']:
+            return AgentFinish({'output': "done"}, log="")
+        return [AgentAction(tool=tool, tool_input={'query': ""}, log="") for tool in actions]
+    return ParallelAgentExecutor(agent=RunnableMultiActionAgent(runnable=RunnableLambda(plan)), tools=tools,
+                                 return_intermediate_steps=True)
+
+def test_parallel_calls_run_once_and_concurrently_and_the_repl_stays_serial():
+    log = []
+    tools = [_recording_tool('a', log, 0.2), _recording_tool('b', log, 0.1),
+             _recording_tool(python_repl_tool.name, log, 0.05)]
+    executor = _executor(['a', python_repl_tool.name, 'b', python_repl_tool.name], tools)
+
+    result = executor.invoke({'input': "go"})
+
+    steps = [action.tool for action, _ in result['intermediate_steps']]
+    assert steps == ['a', python_repl_tool.name, 'b', python_repl_tool.name]
+    assert [observation for _, observation in result['intermediate_steps']] == [f"{tool} done" for tool in steps]
+    starts = [name for event, name, _ in log if event == 'start']
+    assert sorted(starts) == sorted(steps)
+    times = {(event, name): at for event, name, at in log if name != python_repl_tool.name}
+    # a and b overlap
+    assert times[('start', 'b')] < times[('end', 'a')]
+    # The REPL calls never overlap each other
+    repl = [(event, at) for event, name, at in log if name == python_repl_tool.name]
+    assert [event for event, _ in repl] == ['start', 'end', 'start', 'end']
+
+def test_async_path_runs_every_call_once():
+    log = []
+    tools = [_recording_tool('a', log, 0.05), _recording_tool('b', log, 0.05),
+             _recording_tool(python_repl_tool.name, log, 0.01)]
+    executor = _executor(['a', 'b', python_repl_tool.name], tools)
+
+    result = run_async(executor.ainvoke({'input': "go"}))
+
+    assert [action.tool for action, _ in result['intermediate_steps']] == ['a', 'b', python_repl_tool.name]
+    assert sorted(name for event, name, _ in log if event == 'start') == sorted(['a', 'b', python_repl_tool.name])
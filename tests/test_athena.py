@@ -0,0 +1,131 @@
+import boto3
+import botocore.session
+import pandas as pd
+import pytest
+from botocore.stub import Stubber
+from moto import mock_aws
+import tool_aws_athena_execute_query as athena
+from datastore import HANDLE_PATTERN, bind_session, get_frame
+from tool_aws_athena_execute_query import fetch_query_results, read_query_results_from_s3, wait_for_query
+
+BUCKET = "athena-results"
+COLUMN_INFO = [
+    {'Name': 'id', 'Label': 'id', 'Type': 'bigint'},
+    {'Name': 'price', 'Label': 'price', 'Type': 'decimal(10,2)'},
+    {'Name': 'name', 'Label': 'name', 'Type': 'varchar'},
+    {'Name': 'active', 'Label': 'active', 'Type': 'boolean'},
+    {'Name': 'created', 'Label': 'created', 'Type': 'timestamp'},
+]
+
+def _result_csv(rows: int) -> str:
+    # Athena quotes every value and writes NULL as an empty unquoted field
+    lines = ['"id","price","name","active","created"']
+    for index in range(rows):
+        price = "" if index == 1 else f'"{index}.50"'
+        lines.append(f'"{index}",{price},"item {index}","{"true" if index % 2 else "false"}",'
+                     f'"2024-01-01 00:00:{index % 60:02d}.000"')
+    return "\n".join(lines) + "\n"
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+def _athena_client():
+    return botocore.session.get_session().create_client('athena', 'us-east-1')
+
+def test_s3_results_are_read_in_chunks_into_typed_columns(s3, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key="results/q1.csv", Body=_result_csv(25).encode())
+    monkeypatch.setattr(athena, "S3_CHUNK_ROWS", 4)
+
+    df, total_rows, tail = read_query_results_from_s3(s3, f"s3://{BUCKET}/results/q1.csv", COLUMN_INFO, max_rows=10)
+
+    assert total_rows == 25
+    assert len(df) == 10
+    assert df.dtypes.drop('created').astype(str).to_dict() == {'id': 'Int64', 'price': 'float64', 'name': 'string',
+                                                               'active': 'boolean'}
+    assert pd.api.types.is_datetime64_dtype(df['created'])
+    assert pd.isna(df['price'][1]) and df['price'][2] == 2.5
+    assert df['active'].tolist()[:3] == [False, True, False]
+    assert df['created'][3] == pd.Timestamp("2024-01-01 00:00:03")
+    # The last rows come from the chunks after max_rows
+    assert tail['id'].tolist() == [20, 21, 22, 23, 24]
+
+def test_empty_s3_result_keeps_the_columns(s3):
+    s3.put_object(Bucket=BUCKET, Key="results/empty.csv", Body=_result_csv(0).encode())
+
+    df, total_rows, tail = read_query_results_from_s3(s3, f"s3://{BUCKET}/results/empty.csv", COLUMN_INFO, max_rows=10)
+
+    assert total_rows == 0
+    assert list(df.columns) == ['id', 'price', 'name', 'active', 'created']
+    assert tail.empty
+
+def test_wait_for_query_backs_off_longer_while_queued(monkeypatch):
+    client = _athena_client()
+    stubber = Stubber(client)
+    for state in ['QUEUED', 'QUEUED', 'QUEUED', 'QUEUED', 'RUNNING', 'RUNNING', 'RUNNING', 'SUCCEEDED']:
+        stubber.add_response('get_query_execution', {'QueryExecution': {'QueryExecutionId': 'q1', 'Status': {'State': state}}},
+                             {'QueryExecutionId': 'q1'})
+    sleeps = []
+    monkeypatch.setattr(athena.time, "sleep", sleeps.append)
+
+    with stubber:
+        execution = wait_for_query(client, 'q1')
+
+    assert execution['Status']['State'] == 'SUCCEEDED'
+    # Queued polls back off up to 5 seconds, running polls are capped at 2 seconds
+    assert sleeps == [0.25, 0.5, 1.0, 2.0, 4.0, 2.0, 2.0]
+
+def _results_page(rows: list, header: bool = False, next_token: str = None) -> dict:
+    data = ([['id', 'name']] if header else []) + rows
+    page = {'ResultSet': {
+        'Rows': [{'Data': [{'VarCharValue': value} for value in row]} for row in data],
+        'ResultSetMetadata': {'ColumnInfo': [{'Name': 'id', 'Label': 'id', 'Type': 'bigint'},
+                                             {'Name': 'name', 'Label': 'name', 'Type': 'varchar'}]},
+    }}
+    if next_token:
+        page['NextToken'] = next_token
+    return page
+
+def test_fetch_query_results_pages_until_the_row_budget_is_spent():
+    client = _athena_client()
+    stubber = Stubber(client)
+    stubber.add_response('get_query_results', _results_page([['1', 'a'], ['2', 'b']], header=True, next_token='t1'),
+                         {'QueryExecutionId': 'q1', 'MaxResults': athena.ATHENA_PAGE_SIZE})
+    stubber.add_response('get_query_results', _results_page([['3', 'c'], ['4', 'd']], next_token='t2'),
+                         {'QueryExecutionId': 'q1', 'MaxResults': athena.ATHENA_PAGE_SIZE, 'NextToken': 't1'})
+
+    with stubber:
+        df, truncated = fetch_query_results(client, 'q1', max_rows=3)
+
+    assert truncated
+    assert df.values.tolist() == [['1', 'a'], ['2', 'b'], ['3', 'c']]
+
+def test_large_results_are_streamed_from_the_output_location(s3, monkeypatch):
+    s3.put_object(Bucket=BUCKET, Key="results/q2.csv", Body=_result_csv(30).encode())
+    client = _athena_client()
+    stubber = Stubber(client)
+    output_location = f"s3://{BUCKET}/results/q2.csv"
+    stubber.add_response('start_query_execution', {'QueryExecutionId': 'q2'})
+    stubber.add_response('get_query_execution', {'QueryExecution': {
+        'QueryExecutionId': 'q2', 'Status': {'State': 'SUCCEEDED'},
+        'ResultConfiguration': {'OutputLocation': output_location}}}, {'QueryExecutionId': 'q2'})
+    stubber.add_response('get_query_results', {'ResultSet': {'Rows': [], 'ResultSetMetadata': {'ColumnInfo': COLUMN_INFO}}},
+                         {'QueryExecutionId': 'q2', 'MaxResults': 1})
+    clients = {'athena': client, 's3': s3}
+    monkeypatch.setattr(athena, "regional_client", lambda service, region, endpoint_url=None: clients[service])
+    monkeypatch.setattr(athena, "S3_AUTO_THRESHOLD_BYTES", 100)
+    bind_session("athena-test")
+
+    with stubber:
+        output = athena.execute_athena_query.invoke({
+            'database': 'sales', 'query': "SELECT * FROM items", 's3_output_location': f"s3://{BUCKET}/results/",
+            'region': 'us-east-1', 'max_rows': 20, 'use_cache': False})
+    stubber.assert_no_pending_responses()
+
+    assert "truncated to the first 20 of 30 rows" in output
+    assert "Last 5 rows of the full result" in output
+    df = get_frame(HANDLE_PATTERN.search(output).group(0))
+    assert len(df) == 20 and str(df['id'].dtype) == 'Int64'
@@ -0,0 +1,90 @@
+import json
+from langchain.agents import AgentExecutor, create_tool_calling_agent
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langchain_core.tools import tool
+from bedrock import ToolStreamingChatBedrock
+from prompt import prompt_template
+
+@tool
+def list_rds_instances(region: str) -> str:
+    """Lists the RDS instances of a region."""
+    return f"db-1 in {region}"
+
+def _stream(*events):
+    return {"body": [{"chunk": {"bytes": json.dumps(event).encode()}} for event in events]}
+
+def _tool_use_stream():
+    return _stream(
+        {"type": "message_start", "message": {"usage": {"input_tokens": 100, "output_tokens": 1}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Let me check."}},
+        {"type": "content_block_stop", "index": 0},
+        {"type": "content_block_start", "index": 1,
+         "content_block": {"type": "tool_use", "id": "call-1", "name": "list_rds_instances", "input": {}}},
+        {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": '{"region": '}},
+        {"type": "content_block_delta", "index": 1, "delta": {"type": "input_json_delta", "partial_json": '"eu-west-1"}'}},
+        {"type": "content_block_stop", "index": 1},
+        {"type": "message_delta", "delta": {"stop_reason": "tool_use"}, "usage": {"output_tokens": 20}},
+        {"type": "message_stop"},
+    )
+
+def _text_stream(text):
+    return _stream(
+        {"type": "message_start", "message": {"usage": {"input_tokens": 150, "output_tokens": 1}}},
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        *({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text[start:start + 8]}}
+          for start in range(0, len(text), 8)),
+        {"type": "content_block_stop", "index": 0},
+        {"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": 5}},
+        {"type": "message_stop"},
+    )
+
+class TokenCollector(BaseCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.tokens.append(token)
+
+class FakeBedrockClient:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def invoke_model_with_response_stream(self, **request):
+        self.requests.append(json.loads(request["body"]))
+        return self.responses.pop(0)
+
+    def invoke_model(self, **request):
+        raise AssertionError("a streaming model must not fall back to InvokeModel")
+
+def _model(client):
+    return ToolStreamingChatBedrock(model_id="anthropic.claude-3-haiku-20240307-v1:0", client=client,
+                                    streaming=True, model_kwargs={"max_tokens": 100})
+
+def test_invoke_with_tools_streams_tool_calls():
+    client = FakeBedrockClient(_tool_use_stream())
+
+    message = _model(client).bind_tools([list_rds_instances]).invoke([HumanMessage(content="rds?")])
+
+    assert message.content == "Let me check."
+    assert message.tool_calls == [{"name": "list_rds_instances", "args": {"region": "eu-west-1"}, "id": "call-1"}]
+    assert message.usage_metadata == {"input_tokens": 100, "output_tokens": 20, "total_tokens": 120}
+    assert client.requests[0]["tools"][0]["name"] == "list_rds_instances"
+
+def test_agent_turn_with_tool_call_and_streamed_answer():
+    client = FakeBedrockClient(_tool_use_stream(), _text_stream("There is one instance, db-1."))
+    agent = create_tool_calling_agent(_model(client), [list_rds_instances], prompt_template())
+    executor = AgentExecutor(agent=agent, tools=[list_rds_instances], return_intermediate_steps=True)
+    collector = TokenCollector()
+
+    response = executor.invoke({"input": "list rds instances in eu-west-1", "chat_history": []},
+                               config={"callbacks": [collector]})
+
+    assert response["output"] == "There is one instance, db-1."
+    assert response["intermediate_steps"][0][1] == "db-1 in eu-west-1"
+    assert "".join(collector.tokens).endswith("There is one instance, db-1.")
+    # The tool result is sent back as a tool_result block of the second request
+    tool_result = client.requests[1]["messages"][-1]["content"][0]
+    assert tool_result["type"] == "tool_result" and tool_result["tool_use_id"] == "call-1"
@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+import botocore.session
+from botocore.stub import ANY, Stubber
+import tool_aws_bedrock_get_token_usage as usage
+from tool_aws_bedrock_get_token_usage import fetch_token_counts, get_token_counts
+
+MODEL = "anthropic.claude-3-haiku-20240307-v1:0"
+
+def _at(hour: int, minute: int = 0) -> datetime:
+    return datetime(2024, 1, 1, hour, minute, tzinfo=timezone.utc)
+
+def _metric_data(start_hour: int, end_hour: int, input_tokens: dict, next_token: str = None) -> dict:
+    hours = [hour for hour in range(start_hour, end_hour) if hour in input_tokens]
+    response = {'MetricDataResults': [
+        {'Id': 'm0_0', 'Timestamps': [_at(hour) for hour in hours], 'Values': [input_tokens[hour] for hour in hours]},
+        {'Id': 'm0_1', 'Timestamps': [_at(hour) for hour in hours], 'Values': [1.0 for _ in hours]},
+    ]}
+    if next_token:
+        response['NextToken'] = next_token
+    return response
+
+def _client():
+    return botocore.session.get_session().create_client('cloudwatch', 'us-east-1')
+
+def test_fetch_follows_next_token_and_joins_on_timestamps():
+    client = _client()
+    stubber = Stubber(client)
+    stubber.add_response('get_metric_data', _metric_data(0, 1, {0: 10.0}, next_token='page-2'))
+    stubber.add_response('get_metric_data', {'MetricDataResults': [
+        {'Id': 'm0_0', 'Timestamps': [_at(1)], 'Values': [20.0]},
+        {'Id': 'm0_1', 'Timestamps': [], 'Values': []},
+    ]}, {'MetricDataQueries': ANY, 'StartTime': ANY, 'EndTime': ANY, 'NextToken': 'page-2'})
+
+    with stubber:
+        df = fetch_token_counts(client, [MODEL], _at(0), _at(2))
+
+    assert df[['InputTokenCount', 'OutputTokenCount']].values.tolist() == [[10.0, 1.0], [20.0, 0.0]]
+
+def test_recent_hours_are_not_cached_and_the_last_closed_hour_is_fetched_again(monkeypatch):
+    client = _client()
+    stubber = Stubber(client)
+    monkeypatch.setattr(usage, "regional_client", lambda service, region: client)
+    monkeypatch.setattr(usage, "_bucket_cache", {})
+    # At 10:10 the 09:00 bucket ended ten minutes ago, CloudWatch may still add data points to it
+    stubber.add_response('get_metric_data', _metric_data(0, 10, {0: 1.0, 8: 5.0, 9: 3.0}),
+                         {'MetricDataQueries': ANY, 'StartTime': _at(0), 'EndTime': _at(10, 10)})
+    # At 12:40 the cache covers the hours before 09:00, the 08:00 bucket is fetched again and got late data
+    stubber.add_response('get_metric_data', _metric_data(8, 13, {8: 6.0, 9: 4.0, 12: 2.0}),
+                         {'MetricDataQueries': ANY, 'StartTime': _at(8), 'EndTime': _at(12, 40)})
+
+    with stubber:
+        first = get_token_counts([MODEL], _at(0, 10), _at(10, 10), 'us-east-1')
+        assert usage._bucket_cache[('us-east-1', MODEL)][1] == _at(9)
+        second = get_token_counts([MODEL], _at(0, 40), _at(12, 40), 'us-east-1')
+    stubber.assert_no_pending_responses()
+
+    assert first.set_index('timestamp')['InputTokenCount'].to_dict() == {_at(0): 1.0, _at(8): 5.0, _at(9): 3.0}
+    assert second.sort_values('timestamp').set_index('timestamp')['InputTokenCount'].to_dict() == {
+        _at(0): 1.0, _at(8): 6.0, _at(9): 4.0, _at(12): 2.0}
+    assert usage._bucket_cache[('us-east-1', MODEL)][1] == _at(12)
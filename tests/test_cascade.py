@@ -0,0 +1,68 @@
+from langchain_core.agents import AgentAction
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from streamlit.testing.v1 import AppTest
+import agent
+from cascade import escalation_reason, side_effect_calls
+
+def _athena(query: str):
+    return AgentAction(tool='execute_athena_query', tool_input={'database': 'sales', 'query': query}, log="")
+
+def test_read_only_queries_have_no_side_effects():
+    steps = [(_athena("SELECT count(*) FROM orders"), "Rows: 1"),
+             (_athena("-- last week\nWITH recent AS (SELECT * FROM orders) SELECT * FROM recent"), "Rows: 10"),
+             (_athena("SHOW TABLES"), "Rows: 3"),
+             (AgentAction(tool='list_rds_instances', tool_input={'regions': ['eu-west-1']}, log=""), "db-1")]
+
+    assert side_effect_calls(steps) == []
+
+def test_writes_and_python_are_side_effects():
+    steps = [(_athena("CREATE TABLE daily AS SELECT * FROM orders"), "Rows: 0"),
+             (_athena("insert into daily select * from orders"), "Query execution failed: ..."),
+             (AgentAction(tool='Python_REPL', tool_input={'query': "open('out.csv', 'w')"}, log=""), ""),
+             (AgentAction(tool='Python_REPL', tool_input={'query': "print(1)"}, log=""), "1")]
+
+    assert side_effect_calls(steps) == ['execute_athena_query (CREATE)', 'execute_athena_query (INSERT)', 'Python_REPL']
+
+def test_tool_errors_are_escalated():
+    steps = [(_athena("SELECT * FROM missing"), "Query execution failed: TABLE_NOT_FOUND")]
+
+    assert escalation_reason("The table does not exist.", steps) == "tool error in execute_athena_query"
+
+class ScriptedModel(FakeMessagesListChatModel):
+    """
+    Runs Python and then answers unsure, and records the models that were asked.
+    """
+    model_selections: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        return FakeMessagesListChatModel(responses=[
+            AIMessage(content="", tool_calls=[{'name': 'Python_REPL', 'args': {'query': "print(6 * 7)"}, 'id': "call-1"}]),
+            AIMessage(content="I'm not sure the file was written."),
+        ])
+
+def test_app_does_not_escalate_a_turn_with_side_effects(monkeypatch):
+    ScriptedModel.model_selections = []
+
+    def get_llm(model_selection, *args, **kwargs):
+        ScriptedModel.model_selections.append(model_selection)
+        return ScriptedModel(responses=[AIMessage(content="")])
+
+    monkeypatch.setattr(agent, "get_llm_for_model_selection", get_llm)
+    agent.get_agent.clear()
+    app = AppTest.from_file("../app.py", default_timeout=60)
+    app.session_state["selected_model"] = "Auto"
+    app.run()
+    for toggle in app.sidebar.toggle:
+        if toggle.label in ("Summarize Old Turns", "Tool Routing"):
+            toggle.set_value(False)
+    app.run()
+
+    app.chat_input[0].set_value("write the numbers to a file").run()
+
+    assert not app.exception
+    assert ScriptedModel.model_selections == ["Haiku 3"]
+    assert any("Not escalated to Sonnet 3.5" in caption.value and "Python_REPL" in caption.value
+               for caption in app.caption)
+    assert app.session_state["messages"][-1].content == "I'm not sure the file was written."
+    agent.get_agent.clear()
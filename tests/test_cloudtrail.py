@@ -0,0 +1,54 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone
+import botocore.session
+from botocore.stub import Stubber
+import tool_cloudtrail_list as cloudtrail
+from tool_cloudtrail_list import RateLimiter, lookup_events_frame
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+END = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+def _event(name: str, error_code: str = None) -> dict:
+    details = {'sourceIPAddress': '10.0.0.1', **({'errorCode': error_code} if error_code else {})}
+    return {'EventId': name, 'EventName': name, 'EventTime': START, 'Username': 'alice',
+            'EventSource': 's3.amazonaws.com', 'CloudTrailEvent': json.dumps(details),
+            'Resources': [{'ResourceType': 'AWS::S3::Bucket', 'ResourceName': 'logs'}]}
+
+def test_lookup_pages_with_the_filter_until_max_events(monkeypatch):
+    client = botocore.session.get_session().create_client('cloudtrail', 'us-east-1')
+    stubber = Stubber(client)
+    request = {'StartTime': START, 'EndTime': END,
+               'LookupAttributes': [{'AttributeKey': 'EventSource', 'AttributeValue': 's3.amazonaws.com'}]}
+    stubber.add_response('lookup_events', {'Events': [_event('PutObject'), _event('GetObject')], 'NextToken': 't1'},
+                         {**request, 'MaxResults': 3})
+    # The last page only asks for the events that are still missing
+    stubber.add_response('lookup_events', {'Events': [_event('DeleteBucket', 'AccessDenied')], 'NextToken': 't2'},
+                         {**request, 'MaxResults': 1, 'NextToken': 't1'})
+    monkeypatch.setattr(cloudtrail, "regional_client", lambda service, region: client)
+    monkeypatch.setattr(cloudtrail, "LOOKUP_EVENTS_PAGE_SIZE", 3)
+    monkeypatch.setattr(cloudtrail, "_rate_limiters", {})
+
+    with stubber:
+        df = lookup_events_frame('us-east-1', START, END, max_events=3,
+                                 attribute_key='EventSource', attribute_value='s3.amazonaws.com')
+    stubber.assert_no_pending_responses()
+
+    assert list(df['EventName']) == ['PutObject', 'GetObject', 'DeleteBucket']
+    assert df.iloc[2][['ResourceType', 'ResourceName', 'ErrorCode', 'SourceIPAddress']].tolist() == [
+        'AWS::S3::Bucket', 'logs', 'AccessDenied', '10.0.0.1']
+    assert df['EventTime'][0] == "2024-01-01T00:00:00+00:00"
+
+def test_rate_limiter_spaces_calls_across_threads():
+    limiter = RateLimiter(rate=20)
+    threads = [threading.Thread(target=limiter.acquire) for _ in range(5)]
+
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Five calls take at least four intervals of 50 ms, a slow scheduler only makes it take longer
+    assert time.monotonic() - start >= 4 * 0.05
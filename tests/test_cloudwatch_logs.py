@@ -0,0 +1,67 @@
+import time
+import boto3
+import botocore.session
+import pytest
+from botocore.stub import ANY, Stubber
+from moto import mock_aws
+import tool_aws_list_cloudwatch_logs as cloudwatch_logs
+from tool_aws_list_cloudwatch_logs import _Budget, _summarize_log_group, list_log_groups_with_content
+
+@pytest.fixture
+def logs():
+    with mock_aws():
+        client = boto3.client('logs', region_name='us-east-1')
+        yield client
+
+def _put_events(client, group: str, messages: list, minutes_ago: int = 5) -> None:
+    client.create_log_group(logGroupName=group)
+    client.create_log_stream(logGroupName=group, logStreamName='stream')
+    timestamp = int((time.time() - minutes_ago * 60) * 1000)
+    client.put_log_events(logGroupName=group, logStreamName='stream', logEvents=[
+        {'timestamp': timestamp + index, 'message': message} for index, message in enumerate(messages)])
+
+def test_summary_pages_through_a_group_and_stops_when_the_budget_is_spent():
+    client = botocore.session.get_session().create_client('logs', 'us-east-1')
+    stubber = Stubber(client)
+    request = {'logGroupName': '/app', 'startTime': 0, 'endTime': 10_000}
+    stubber.add_response('filter_log_events', {'events': [{'timestamp': 1000, 'message': 'request 17 failed'},
+                                                          {'timestamp': 2000, 'message': 'request 18 failed'}],
+                                               'nextToken': 'p2'}, request)
+    stubber.add_response('filter_log_events', {'events': [{'timestamp': 3000, 'message': 'done'},
+                                                          {'timestamp': 4000, 'message': 'not counted'}]},
+                         {**request, 'nextToken': ANY})
+    budget = _Budget(max_events=3, max_bytes=1024)
+
+    with stubber:
+        summary = _summarize_log_group(client, '/app', 0, 10_000, budget)
+
+    assert budget.exhausted.is_set()
+    assert summary['events'] == 3
+    assert (summary['first'], summary['last']) == (1000, 3000)
+    assert summary['messages'].most_common(1) == [('request # failed', 2)]
+
+def test_tool_summarizes_recent_events_per_group(logs, monkeypatch):
+    _put_events(logs, '/app/api', ['GET /orders 200', 'GET /orders 500', 'upstream timed out'])
+    _put_events(logs, '/app/worker', ['job 41 done'])
+    _put_events(logs, '/app/old', ['outside of the time range'], minutes_ago=180)
+    _put_events(logs, '/other', ['not under the prefix'])
+    monkeypatch.setattr(cloudwatch_logs, "regional_client", lambda service, region: logs)
+
+    output = list_log_groups_with_content.invoke({'until_hours_ago': 1, 'region': 'us-east-1', 'log_group_prefix': '/app'})
+
+    assert output.startswith("CloudWatch logs of the last 1 hours in us-east-1: 4 events in 3 of 3 log groups")
+    assert "Log Group: /app/api\n  Events: 3" in output
+    assert "  2x GET /orders #" in output
+    assert "1 log groups had no events." in output
+    assert "/other" not in output and "budget" not in output
+
+def test_tool_stops_early_at_the_event_budget(logs, monkeypatch):
+    for index in range(4):
+        _put_events(logs, f"/app/service-{index}", [f"message {n}" for n in range(5)])
+    monkeypatch.setattr(cloudwatch_logs, "regional_client", lambda service, region: logs)
+    monkeypatch.setattr(cloudwatch_logs, "LOG_MAX_EVENTS", 7)
+
+    output = list_log_groups_with_content.invoke({'until_hours_ago': 1, 'region': 'us-east-1'})
+
+    assert ": 7 events in " in output
+    assert "The budget of 7 events" in output
@@ -0,0 +1,80 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from conversation_memory import TokenBudgetMemory, compact_visualizations, estimate_tokens
+
+class Summarizer:
+    def __init__(self, summary: str):
+        self.summary = summary
+        self.calls = []
+
+    def invoke(self, prompt):
+        self.calls.append(prompt)
+        return AIMessage(content=self.summary)
+
+def _memory(max_token_limit: int, summarizer=None) -> TokenBudgetMemory:
+    memory = TokenBudgetMemory(max_token_limit=max_token_limit)
+    # Assigned like the app does, the summarizer only needs invoke
+    memory.summarizer = summarizer
+    return memory
+
+def _save(memory: TokenBudgetMemory, question: str, answer: str) -> None:
+    memory.save_context({"input": question}, {"output": answer})
+
+def _history(memory: TokenBudgetMemory) -> list:
+    return memory.load_memory_variables({})["chat_history"]
+
+def test_visualizations_are_stored_as_placeholders():
+    answer = ('Here: <visualization type="bar" source="df-0123456789ab"><options><title>Counts</title></options>'
+              '</visualization>')
+
+    assert compact_visualizations(answer) == 'Here: (A bar "Counts" of df-0123456789ab was shown to the user here.)'
+
+def test_oldest_turns_are_rolled_up_into_the_summary():
+    summarizer = Summarizer("They asked about buckets.")
+    memory = _memory(60, summarizer)
+    _save(memory, "q1 " + "x" * 200, "a1 " + "y" * 200)
+    _save(memory, "q2", "a2")
+    _save(memory, "q3", "a3")
+
+    history = _history(memory)
+    assert len(summarizer.calls) == 1 and "q1" in summarizer.calls[0]
+    assert "They asked about buckets." in history[0].content
+    assert [message.content for message in history[2:]] == ["q2", "a2", "q3", "a3"]
+    assert estimate_tokens(history) <= 60
+
+def test_lowering_the_budget_prunes_on_load():
+    memory = _memory(1000)
+    for i in range(5):
+        _save(memory, f"q{i} " + "x" * 40, f"a{i} " + "y" * 40)
+    assert len(_history(memory)) == 10
+
+    memory.max_token_limit = 50
+    history = _history(memory)
+    assert estimate_tokens(history) <= 50
+    assert history[0].content.startswith("q") and history[-1].content.startswith("a4")
+    assert len(memory.chat_memory.messages) == len(history)
+
+def test_latest_turn_is_kept_and_truncated_when_it_does_not_fit():
+    memory = _memory(50)
+    _save(memory, "q1", "a1")
+    _save(memory, "what is in the bucket?", "z" * 1000)
+
+    history = _history(memory)
+    assert [type(message) for message in history] == [HumanMessage, AIMessage]
+    assert history[0].content == "what is in the bucket?"
+    assert history[1].content.startswith("zzz") and history[1].content.endswith("(truncated)")
+    assert estimate_tokens(history) <= 50
+    # The stored turn stays whole, it is only truncated in the prompt
+    assert memory.chat_memory.messages[1].content == "z" * 1000
+
+def test_summary_counts_against_the_budget():
+    memory = _memory(100, Summarizer("s" * 1000))
+    _save(memory, "q1 " + "x" * 400, "a1")
+    _save(memory, "q2 " + "x" * 80, "a2 " + "y" * 80)
+
+    history = _history(memory)
+    assert history[0].content.startswith("Summary of our earlier conversation:")
+    assert history[0].content.endswith("(truncated)")
+    # The latest turn fits in half of the budget and is kept whole
+    assert [message.content[:2] for message in history[2:]] == ["q2", "a2"]
+    assert not history[-1].content.endswith("(truncated)")
+    assert estimate_tokens(history) <= 100
@@ -0,0 +1,75 @@
+import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import botocore.session
+from botocore.stub import Stubber
+import tool_ecr_repositories as ecr
+from multi_region import fan_out
+from tool_ecr_repositories import latest_image_tags, list_repositories_frame
+
+def _pushed(day: int) -> datetime.datetime:
+    return datetime.datetime(2024, 1, day, tzinfo=datetime.timezone.utc)
+
+def _images(*days: int) -> list:
+    return [{'imageTags': [f"v{day}"], 'imagePushedAt': _pushed(day)} for day in days]
+
+def _ecr_client():
+    return botocore.session.get_session().create_client('ecr', 'us-east-1')
+
+def test_latest_tags_are_picked_by_push_date_across_pages():
+    client = _ecr_client()
+    stubber = Stubber(client)
+    request = {'repositoryName': 'api', 'filter': {'tagStatus': 'TAGGED'}}
+    stubber.add_response('describe_images', {'imageDetails': _images(3, 9, 1), 'nextToken': 'p2'}, request)
+    stubber.add_response('describe_images', {'imageDetails': _images(7, 2, 8)}, {**request, 'nextToken': 'p2'})
+
+    with stubber:
+        tags = latest_image_tags(client, 'api', count=3)
+
+    assert tags == ['v9', 'v8', 'v7']
+
+def test_repositories_are_listed_with_timing_and_per_repository_errors(monkeypatch):
+    client = _ecr_client()
+    stubber = Stubber(client)
+    stubber.add_response('describe_repositories', {'repositories': [{'repositoryName': 'api'}], 'nextToken': 'r2'}, {})
+    stubber.add_response('describe_repositories', {'repositories': [{'repositoryName': 'worker'}]}, {'nextToken': 'r2'})
+    stubber.add_response('describe_images', {'imageDetails': _images(4, 5)},
+                         {'repositoryName': 'api', 'filter': {'tagStatus': 'TAGGED'}})
+    stubber.add_client_error('describe_images', 'RepositoryNotFoundException', "The repository was deleted")
+    # The repositories are described one after the other so that the stubbed responses arrive in order
+    monkeypatch.setattr(ecr, "_repository_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(ecr, "regional_client", lambda service, region: client)
+
+    with stubber:
+        df = list_repositories_frame('us-east-1')
+    stubber.assert_no_pending_responses()
+
+    api, worker = df.to_dict('records')
+    assert api['repository'] == 'api' and api['versions'] == ['v5', 'v4'] and pd.isna(api['error'])
+    assert worker['versions'] is None and "The repository was deleted" in worker['error']
+    assert df['elapsed_ms'].ge(0).all()
+
+def test_all_regions_share_one_bounded_repository_pool(monkeypatch):
+    threads = set()
+
+    class Paginator:
+        def paginate(self):
+            return [{'repositories': [{'repositoryName': f"repo-{index}"} for index in range(20)]}]
+
+    class Client:
+        def get_paginator(self, operation):
+            return Paginator()
+
+    def describe(ecr_client, repo_name):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.001)
+        return {'repository': repo_name, 'versions': ['v1'], 'error': None, 'elapsed_ms': 1}
+    monkeypatch.setattr(ecr, "regional_client", lambda service, region: Client())
+    monkeypatch.setattr(ecr, "_describe_repository", describe)
+
+    df, errors = fan_out(list_repositories_frame, [f"region-{index}" for index in range(17)])
+
+    assert errors == {} and len(df) == 17 * 20
+    assert len(threads) <= ecr.ECR_MAX_WORKERS
@@ -0,0 +1,66 @@
+import datetime
+import botocore.session
+from botocore.stub import Stubber
+import tool_aws_glue_list_databases_and_tables as glue
+from cache import LRUCache
+from tool_aws_glue_list_databases_and_tables import build_catalog_index, list_glue_databases_and_tables, query_catalog
+
+CRAWLED_AT = datetime.datetime(2024, 3, 1, 6, 0, tzinfo=datetime.timezone.utc)
+
+def _table(name: str, columns: list, **extra) -> dict:
+    return {'Name': name, 'StorageDescriptor': {
+        'Location': f"s3://lake/{name}/", 'Columns': [{'Name': column, 'Type': 'string'} for column in columns]}, **extra}
+
+def _stub_catalog(client) -> Stubber:
+    stubber = Stubber(client)
+    stubber.add_response('get_databases', {'DatabaseList': [{'Name': 'sales'}], 'NextToken': 'd1'}, {})
+    stubber.add_response('get_databases', {'DatabaseList': [{'Name': 'logs'}]}, {'NextToken': 'd1'})
+    # One pass over the crawlers for the whole catalog
+    stubber.add_response('get_crawlers', {'Crawlers': [
+        {'Name': 'orders-crawler', 'LastCrawl': {'StartTime': CRAWLED_AT}},
+        {'Name': 'lake-crawler', 'Targets': {'S3Targets': [{'Path': 's3://lake/access'}]},
+         'LastCrawl': {'StartTime': CRAWLED_AT + datetime.timedelta(hours=1)}},
+    ]}, {})
+    stubber.add_response('get_tables', {'TableList': [
+        _table('orders', ['order_id', 'customer_id'], Parameters={'UPDATED_BY_CRAWLER': 'orders-crawler'})],
+        'NextToken': 't1'}, {'DatabaseName': 'sales'})
+    stubber.add_response('get_tables', {'TableList': [_table('customers', ['customer_id', 'name'])]},
+                         {'DatabaseName': 'sales', 'NextToken': 't1'})
+    stubber.add_response('get_tables', {'TableList': [_table('access', ['path'])]}, {'DatabaseName': 'logs'})
+    return stubber
+
+def _glue_client():
+    return botocore.session.get_session().create_client('glue', 'us-east-1')
+
+def test_index_follows_pagination_and_maps_tables_to_crawlers(monkeypatch):
+    client = _glue_client()
+    stubber = _stub_catalog(client)
+    # The databases are fetched one after the other so that the stubbed responses arrive in order
+    monkeypatch.setattr(glue, "GLUE_MAX_WORKERS", 1)
+
+    with stubber:
+        index = build_catalog_index(client)
+    stubber.assert_no_pending_responses()
+
+    assert index['databases'] == ['sales', 'logs']
+    assert {table['name']: table['last_crawl'] for table in index['tables']} == {
+        'orders': '2024-03-01T06:00:00+00:00', 'customers': 'N/A', 'access': '2024-03-01T07:00:00+00:00'}
+    assert [table['name'] for table in query_catalog(index, column='CUSTOMER_ID')] == ['orders', 'customers']
+    assert [table['name'] for table in query_catalog(index, database='sales', table_pattern='cust*')] == ['customers']
+
+def test_tool_answers_filtered_queries_from_the_cached_index(monkeypatch):
+    client = _glue_client()
+    stubber = _stub_catalog(client)
+    monkeypatch.setattr(glue, "GLUE_MAX_WORKERS", 1)
+    monkeypatch.setattr(glue, "catalog_cache", LRUCache(max_entries=16, ttl=glue.CATALOG_TTL))
+    monkeypatch.setattr(glue, "regional_client", lambda service, region: client)
+
+    with stubber:
+        everything = list_glue_databases_and_tables.invoke({'region': 'us-east-1'})
+        # The second question is answered without calling Glue again
+        filtered = list_glue_databases_and_tables.invoke({'region': 'us-east-1', 'column': 'path'})
+    stubber.assert_no_pending_responses()
+
+    assert "Table: orders" in everything and "Table: access" in everything
+    assert "Database: logs" in filtered and "Table: access" in filtered
+    assert "Database: sales" not in filtered
@@ -0,0 +1,83 @@
+import time
+import botocore.session
+import pandas as pd
+import pytest
+from botocore.stub import Stubber
+import inventory
+import tool_aws_list_rds_instances as rds_tool
+from inventory import InventoryRefresher, InventoryStore, snapshot_or_live
+from tool_aws_list_rds_instances import list_rds_instances, list_rds_instances_frame
+
+def _instance(identifier: str) -> dict:
+    return {'DBInstanceIdentifier': identifier, 'Engine': 'postgres', 'DBInstanceStatus': 'available',
+            'DBInstanceClass': 'db.t3.micro', 'Endpoint': {'Address': f"{identifier}.rds.amazonaws.com"}}
+
+@pytest.fixture
+def store(tmp_path):
+    return InventoryStore(str(tmp_path / "inventory.db"))
+
+@pytest.fixture
+def rds(monkeypatch):
+    client = botocore.session.get_session().create_client('rds', 'us-east-1')
+    monkeypatch.setattr(rds_tool, "regional_client", lambda service, region: client)
+    return Stubber(client)
+
+def test_store_round_trips_frames_and_documents(store):
+    store.save('rds', 'us-east-1', pd.DataFrame({'name': ['a', 'b'], 'size': [1, 2]}))
+    store.save('glue', 'us-east-1', {'databases': ['sales']}, kind='json', taken_at=time.time() - 60)
+
+    frame, frame_age = store.load('rds', 'us-east-1')
+    document, document_age = store.load('glue', 'us-east-1')
+
+    assert frame.to_dict('list') == {'name': ['a', 'b'], 'size': [1, 2]}
+    assert document == {'databases': ['sales']}
+    assert frame_age < 5 and 59 < document_age < 65
+    assert store.load('rds', 'eu-west-1') is None
+    assert [(resource, region) for resource, region, _ in store.staleness()] == [('glue', 'us-east-1'), ('rds', 'us-east-1')]
+
+def test_fresh_snapshots_are_served_and_stale_ones_refetched(store, rds):
+    rds.add_response('describe_db_instances', {'DBInstances': [_instance('orders')]}, {})
+    store.save('rds', 'us-east-1', pd.DataFrame([{'DBInstanceIdentifier': 'cached'}]), taken_at=time.time() - 120)
+
+    with rds:
+        fresh, fresh_age = snapshot_or_live('rds', 'us-east-1', max_age=300, store=store)
+        live, live_age = snapshot_or_live('rds', 'us-east-1', max_age=60, store=store)
+    rds.assert_no_pending_responses()
+
+    assert list(fresh['DBInstanceIdentifier']) == ['cached'] and fresh_age >= 120
+    assert list(live['DBInstanceIdentifier']) == ['orders'] and live_age is None
+    # The live result replaced the stale snapshot
+    assert list(store.load('rds', 'us-east-1')[0]['DBInstanceIdentifier']) == ['orders']
+
+def test_refresher_snapshots_in_the_background_and_survives_failures(store, rds, capsys):
+    rds.add_response('describe_db_instances', {'DBInstances': [_instance('orders')], 'Marker': 'm1'}, {})
+    rds.add_response('describe_db_instances', {'DBInstances': [_instance('billing')]}, {'Marker': 'm1'})
+
+    def failing_fetch(region):
+        raise RuntimeError("AccessDenied")
+
+    refresher = InventoryRefresher(store, ['us-east-1'], interval=60,
+                                   resources={'broken': (failing_fetch, 'frame'), 'rds': (list_rds_instances_frame, 'frame')})
+    with rds:
+        refresher.start()
+        deadline = time.monotonic() + 5
+        while store.load('rds', 'us-east-1') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        refresher.stop()
+        refresher.join(timeout=5)
+
+    assert not refresher.is_alive()
+    assert list(store.load('rds', 'us-east-1')[0]['DBInstanceIdentifier']) == ['orders', 'billing']
+    assert "inventory refresh of broken in us-east-1 failed: AccessDenied" in capsys.readouterr().out
+
+def test_tool_answers_from_the_snapshot_without_calling_aws(store, rds, monkeypatch):
+    store.save('rds', 'us-east-1', pd.DataFrame([{'DBInstanceIdentifier': 'orders', 'Engine': 'postgres'}]),
+               taken_at=time.time() - 10 * 60)
+    monkeypatch.setattr(inventory, "get_store", lambda: store)
+
+    with rds:
+        output = list_rds_instances.invoke({'regions': ['us-east-1']})
+    rds.assert_no_pending_responses()
+
+    assert "orders" in output
+    assert "Served from the inventory snapshot: us-east-1 (10 min old)" in output
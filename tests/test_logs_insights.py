@@ -0,0 +1,87 @@
+import botocore.session
+import pytest
+from botocore.stub import ANY, Stubber
+import tool_aws_cloudwatch_logs_insights as insights
+from datastore import HANDLE_PATTERN, bind_session, get_frame
+from progress import bind_tool_progress
+from tool_aws_cloudwatch_logs_insights import merge_batch_rows, plan_batched_query, run_logs_insights_query
+
+def _result(**fields):
+    return [{'field': field, 'value': value} for field, value in fields.items()] + [{'field': '@ptr', 'value': 'x'}]
+
+def test_plan_strips_sort_and_limit_from_batched_stats():
+    batch_query, plan = plan_batched_query(
+        "filter @message like /(ERROR|WARN)/ | stats count(*) as errors, max(@timestamp) as last by bin(5m)"
+        " | sort errors desc | limit 3")
+
+    assert batch_query == "filter @message like /(ERROR|WARN)/ | stats count(*) as errors, max(@timestamp) as last by bin(5m)"
+    assert plan == {'groups': ['bin(5m)'], 'aggregates': [('errors', 'sum'), ('last', 'max')],
+                    'sort': [('errors', False)], 'limit': 3}
+
+def test_plan_refuses_aggregates_that_do_not_combine():
+    with pytest.raises(ValueError, match="avg"):
+        plan_batched_query("stats avg(@duration) by @log")
+    with pytest.raises(ValueError, match="filter"):
+        plan_batched_query("stats count(*) as n by @log | filter n > 5")
+
+def test_merge_aggregates_groups_of_all_batches_then_sorts_and_limits():
+    _, plan = plan_batched_query("stats count(*) as n by bin(1h) | sort n desc | limit 2")
+
+    df = merge_batch_rows([[{'bin(1h)': '10:00', 'n': '3'}, {'bin(1h)': '11:00', 'n': '1'}],
+                           [{'bin(1h)': '11:00', 'n': '9'}, {'bin(1h)': '12:00', 'n': '2'}]], plan, limit=100)
+
+    assert df.to_dict('records') == [{'bin(1h)': '11:00', 'n': 10}, {'bin(1h)': '10:00', 'n': 3}]
+
+def test_merge_raw_rows_keeps_the_top_rows_over_all_batches():
+    batch_query, plan = plan_batched_query("fields @timestamp, @message | sort @timestamp desc | limit 2")
+
+    df = merge_batch_rows([[{'@timestamp': '2024-01-01 10:00', '@message': 'a'}],
+                           [{'@timestamp': '2024-01-01 12:00', '@message': 'b'},
+                            {'@timestamp': '2024-01-01 11:00', '@message': 'c'}]], plan, limit=100)
+
+    assert batch_query == "fields @timestamp, @message | sort @timestamp desc"
+    assert list(df['@message']) == ['b', 'c']
+
+class RecordingProgress:
+    def __init__(self):
+        self.lines = {}
+
+    def update(self, key, text):
+        self.lines[key] = text
+
+    def clear(self):
+        pass
+
+def test_tool_merges_batches_and_reports_progress(monkeypatch):
+    client = botocore.session.get_session().create_client('logs', 'eu-west-1')
+    stubber = Stubber(client)
+    groups = [f"/aws/lambda/function-{index}" for index in range(60)]
+    # The batches run one after the other so that the stubbed responses arrive in order
+    monkeypatch.setattr(insights, "INSIGHTS_MAX_CONCURRENT_QUERIES", 1)
+    monkeypatch.setattr(insights, "POLL_INITIAL_DELAY", 0)
+    monkeypatch.setattr(insights, "regional_client", lambda service, region: client)
+    for batch, (query_id, results) in enumerate([
+        ('q1', [_result(**{'bin(1h)': '10:00', 'errors': '5'}), _result(**{'bin(1h)': '11:00', 'errors': '1'})]),
+        ('q2', [_result(**{'bin(1h)': '11:00', 'errors': '7'})]),
+    ]):
+        stubber.add_response('start_query', {'queryId': query_id}, {
+            'logGroupNames': groups[batch * 50:(batch + 1) * 50], 'startTime': ANY, 'endTime': ANY,
+            'queryString': "stats count(*) as errors by bin(1h)",
+            'limit': insights.INSIGHTS_MAX_LIMIT})
+        stubber.add_response('get_query_results', {'status': 'Running', 'results': results[:1],
+                                                   'statistics': {'recordsScanned': 100.0}}, {'queryId': query_id})
+        stubber.add_response('get_query_results', {'status': 'Complete', 'results': results,
+                                                   'statistics': {'recordsScanned': 200.0}}, {'queryId': query_id})
+    progress = RecordingProgress()
+    bind_session("insights-test")
+
+    with stubber, bind_tool_progress(progress):
+        output = run_logs_insights_query.invoke({
+            'query': "stats count(*) as errors by bin(1h) | sort errors desc", 'log_group_names': groups,
+            'region': 'eu-west-1', 'hours': 2})
+
+    df = get_frame(HANDLE_PATTERN.search(output).group(0))
+    assert df.to_dict('records') == [{'bin(1h)': '11:00', 'errors': 8}, {'bin(1h)': '10:00', 'errors': 5}]
+    assert "400 records scanned" in output
+    assert progress.lines == {'insights-0': "Logs Insights batch 1/2: Complete, 2 rows, 200 records scanned",
+                              'insights-1': "Logs Insights batch 2/2: Complete, 1 rows, 200 records scanned"}
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import multi_region
+from bedrock import get_bedrock_client
+from multi_region import fan_out, regional_client
+
+def test_fan_out_merges_regions_and_reports_failures():
+    def fetch(region):
+        if region == 'eu-west-1':
+            raise RuntimeError("AccessDenied")
+        return pd.DataFrame({'name': [f"db-{region}"]})
+
+    merged, errors = fan_out(fetch, "us-east-1, eu-west-1,us-west-2")
+
+    assert list(merged.columns) == ['region', 'name']
+    assert set(merged['region']) == {'us-east-1', 'us-west-2'}
+    assert errors == {'eu-west-1': "AccessDenied"}
+
+def test_fan_out_reports_slow_regions_without_waiting_for_them():
+    release = threading.Event()
+
+    def fetch(region):
+        if region == 'ap-south-1':
+            release.wait(5)
+        return pd.DataFrame({'name': ["x"]})
+
+    start = time.perf_counter()
+    merged, errors = fan_out(fetch, ['us-east-1', 'ap-south-1'], timeout=0.2)
+    release.set()
+
+    assert time.perf_counter() - start < 2
+    assert list(merged['region']) == ['us-east-1']
+    assert errors == {'ap-south-1': "no answer within 0.2 seconds"}
+
+def test_fan_out_reuses_one_bounded_pool():
+    threads = set()
+
+    def fetch(region):
+        threads.add(threading.current_thread().name)
+        return pd.DataFrame()
+
+    for _ in range(5):
+        fan_out(fetch, [f"region-{index}" for index in range(10)])
+
+    assert len(threads) <= multi_region.MULTI_REGION_MAX_WORKERS
+    assert all(name.startswith("region") for name in threads)
+
+def test_regional_client_is_built_once_across_threads():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: regional_client('rds', 'eu-central-1'), range(32)))
+
+    assert all(client is clients[0] for client in clients)
+    assert regional_client('rds', 'eu-west-1') is not clients[0]
+
+def test_configured_clients_are_separate_and_configured_once():
+    configured = []
+
+    def configure(client):
+        configured.append(client)
+
+    clients = [regional_client('sqs', 'eu-central-1', configure=configure) for _ in range(3)]
+
+    assert configured == [clients[0]] and all(client is clients[0] for client in clients)
+    assert regional_client('sqs', 'eu-central-1') is not clients[0]
+    assert get_bedrock_client('eu-central-1', prompt_caching=True) is get_bedrock_client('eu-central-1', prompt_caching=True)
+    assert get_bedrock_client('eu-central-1', prompt_caching=True) is not get_bedrock_client('eu-central-1')
+
+def test_fan_out_timeout_starts_when_the_region_runs(monkeypatch):
+    # One thread, so the second region waits for the first one to finish
+    monkeypatch.setattr(multi_region, "_region_pool", ThreadPoolExecutor(max_workers=1))
+
+    def fetch(region):
+        time.sleep(0.3)
+        return pd.DataFrame({'name': ["x"]})
+
+    merged, errors = fan_out(fetch, ['us-east-1', 'eu-west-1'], timeout=0.5)
+
+    assert errors == {}
+    assert list(merged['region']) == ['us-east-1', 'eu-west-1']
+
+def test_fan_out_drops_regions_that_never_get_a_thread(monkeypatch):
+    monkeypatch.setattr(multi_region, "_region_pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(multi_region, "REGION_QUEUE_TIMEOUT", 0.2)
+    release = threading.Event()
+    fetched = []
+
+    def fetch(region):
+        fetched.append(region)
+        release.wait(5)
+        return pd.DataFrame({'name': ["x"]})
+
+    merged, errors = fan_out(fetch, ['us-east-1', 'eu-west-1'], timeout=0.4)
+    release.set()
+
+    assert fetched == ['us-east-1']
+    assert errors == {'us-east-1': "no answer within 0.4 seconds", 'eu-west-1': "did not start within 0.2 seconds"}
@@ -0,0 +1,63 @@
+import json
+from bedrock import MODEL_IDS, calculate_token_cost, get_llm_for_model_selection, supports_prompt_caching
+from prompt_cache import _record_stream_usage, _record_usage, add_cache_checkpoints, track_prompt_cache_usage
+from botocore.response import StreamingBody
+import io
+
+class EventStream(list):
+    def close(self):
+        pass
+
+def _event(data: dict) -> dict:
+    return {"chunk": {"bytes": json.dumps(data).encode()}}
+
+def test_checkpoints_after_tools_system_and_last_message():
+    body = add_cache_checkpoints({
+        "system": "You are a bot",
+        "tools": [{"name": "a"}, {"name": "b"}],
+        "messages": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"},
+                     {"role": "user", "content": [{"type": "text", "text": "rds?"}]}],
+    })
+
+    assert "cache_control" not in body["tools"][0] and body["tools"][1]["cache_control"] == {"type": "ephemeral"}
+    assert body["system"] == [{"type": "text", "text": "You are a bot", "cache_control": {"type": "ephemeral"}}]
+    assert body["messages"][0]["content"] == "hi"
+    assert body["messages"][-1]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
+def test_usage_of_invoke_model():
+    data = json.dumps({"usage": {"input_tokens": 5, "cache_read_input_tokens": 300,
+                                 "cache_creation_input_tokens": 20}}).encode()
+    parsed = {"body": StreamingBody(io.BytesIO(data), len(data))}
+    with track_prompt_cache_usage() as usage:
+        _record_usage(parsed)
+
+    assert (usage.cache_read_tokens, usage.cache_write_tokens) == (300, 20)
+    assert parsed["body"].read() == data
+
+def test_usage_of_invoke_model_with_response_stream():
+    events = EventStream([
+        _event({"type": "message_start", "message": {"usage": {"input_tokens": 5, "cache_read_input_tokens": 300,
+                                                               "cache_creation_input_tokens": 20}}}),
+        _event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "hi"}}),
+        _event({"type": "message_stop"}),
+    ])
+    parsed = {"body": events}
+    with track_prompt_cache_usage() as usage:
+        _record_stream_usage(parsed)
+        # Usage is recorded while the stream is consumed
+        assert list(parsed["body"]) == events
+
+    assert (usage.cache_read_tokens, usage.cache_write_tokens) == (300, 20)
+
+def test_prompt_caching_only_for_supported_models():
+    assert [model for model in MODEL_IDS if supports_prompt_caching(model)] == ["Sonnet 3.7", "Haiku 3.5"]
+    assert not supports_prompt_caching("Sonnet 3.5")
+
+def test_prompt_caching_models_use_the_inference_profile_of_the_region():
+    llm = get_llm_for_model_selection("Sonnet 3.7", max_tokens=10, region="eu-west-1", prompt_caching=True)
+    assert llm.model_id == "eu.anthropic.claude-3-7-sonnet-20250219-v1:0"
+    assert (llm._get_provider(), llm._get_model()) == ("anthropic", "claude-3-7-sonnet-20250219-v1:0")
+    assert get_llm_for_model_selection("Haiku 3.5", max_tokens=10, region="ap-southeast-2").model_id == \
+        "apac.anthropic.claude-3-5-haiku-20241022-v1:0"
+    assert get_llm_for_model_selection("Sonnet 3.5", max_tokens=10, region="eu-west-1").model_id == MODEL_IDS["Sonnet 3.5"]
+    assert calculate_token_cost("Haiku 3.5", 1000, 1000)["total_cost"] > 0
@@ -0,0 +1,114 @@
+import xml.etree.ElementTree as ET
+import pandas as pd
+import pytest
+import renderer
+from datastore import bind_session, put_frame
+from renderer import StreamingContentRenderer, VisualizationWarning, parse_data
+
+VISUALIZATION = '<visualization type="bar"><data><item><x>a</x><y>1</y></item></data></visualization>'
+
+class Placeholder:
+    def __init__(self, output):
+        self.output = output
+        self.index = None
+
+    def markdown(self, text):
+        # A placeholder replaces what it showed before
+        if self.index is None:
+            self.index = len(self.output)
+            self.output.append(None)
+        self.output[self.index] = ('markdown', text)
+
+class Container:
+    def __init__(self):
+        self.output = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def empty(self):
+        return Placeholder(self.output)
+
+class Streamlit:
+    def __init__(self, output):
+        self.output = output
+
+    def warning(self, text):
+        self.output.append(('warning', text))
+
+    def code(self, text, language=None):
+        self.output.append(('code', text))
+
+@pytest.fixture
+def container(monkeypatch):
+    container = Container()
+    monkeypatch.setattr(renderer, "render_visualization", lambda content: container.output.append(('visualization', content)))
+    monkeypatch.setattr(renderer, "st", Streamlit(container.output))
+    return container
+
+def _render(container, chunks):
+    content_renderer = StreamingContentRenderer(container)
+    for chunk in chunks:
+        content_renderer.feed(chunk)
+    content_renderer.close()
+    return container.output
+
+def test_tags_split_across_chunks(container):
+    content = f"Before {VISUALIZATION} after"
+    # Every split point, including inside the opening and the closing tag
+    for split in range(1, len(content)):
+        container.output.clear()
+        assert _render(container, [content[:split], content[split:]]) == [
+            ('markdown', "Before"), ('visualization', VISUALIZATION), ('markdown', "after")]
+
+def test_markdown_is_flushed_before_the_block_is_complete(container):
+    content_renderer = StreamingContentRenderer(container)
+    content_renderer.feed("Counts: <vis")
+    assert container.output == [('markdown', "Counts:")]
+    content_renderer.feed("ualization type=\"bar\">")
+    content_renderer.feed("<data></data>")
+    assert container.output == [('markdown', "Counts:")]
+
+def test_lone_angle_bracket_is_markdown(container):
+    assert _render(container, ["a <", " b and x < y"]) == [('markdown', "a < b and x < y")]
+    container.output.clear()
+    assert _render(container, ["trailing <"]) == [('markdown', "trailing <")]
+
+def test_unclosed_block_is_shown_on_close(container):
+    output = _render(container, ["Here ", '<visualization type="bar"><data>'])
+
+    assert output == [('markdown', "Here"), ('warning', "Malformed visualization XML block detected."),
+                      ('code', '<visualization type="bar"><data>')]
+
+def test_csv_and_json_columns_data_build_the_same_frame():
+    csv = ET.fromstring('<visualization type="bar" format="csv"><data>\nname, count\nlogs, 3\n"a, b", 4\n</data></visualization>')
+    columns = ET.fromstring('<visualization type="bar" format="json-columns"><data>'
+                            '{"name": ["logs", "a, b"], "count": [3, 4]}</data></visualization>')
+
+    expected = pd.DataFrame({'name': ['logs', 'a, b'], 'count': [3, 4]})
+    pd.testing.assert_frame_equal(parse_data(csv), expected)
+    pd.testing.assert_frame_equal(parse_data(columns), expected)
+
+@pytest.mark.parametrize("content, warning", [
+    ('<visualization type="bar" format="csv"><data> </data></visualization>', "No data provided for visualization."),
+    ('<visualization type="bar" format="json-columns"><data>[1, 2]</data></visualization>',
+     "json-columns data must be an object of column name to list of values."),
+    ('<visualization type="bar" format="yaml"><data>a: 1</data></visualization>', "Unsupported data format: yaml"),
+])
+def test_invalid_compact_data_is_a_warning(content, warning):
+    with pytest.raises(VisualizationWarning, match=warning):
+        parse_data(ET.fromstring(content))
+
+def test_source_resolves_the_data_handle_of_the_session():
+    bind_session("renderer-test")
+    handle = put_frame(pd.DataFrame({'name': ['logs'], 'count': [3]}))
+    root = ET.fromstring(f'<visualization type="bar" source="{handle}"><data><item><x>ignored</x></item></data></visualization>')
+
+    assert parse_data(root).to_dict('list') == {'name': ['logs'], 'count': [3]}
+    # Another session cannot resolve the handle
+    bind_session("another-session")
+    with pytest.raises(VisualizationWarning, match=f"Data handle not found or expired: {handle}"):
+        parse_data(root)
@@ -0,0 +1,55 @@
+import os
+import stat
+import pandas as pd
+from langchain_core.messages import AIMessage, HumanMessage
+from datastore import bind_session, describe_frame, get_frame
+from response_cache import INTENT_TTLS, ResponseCache, answer_ttl, cache_key, relevant_history
+
+HISTORY = [HumanMessage(content="list my buckets"), AIMessage(content="logs, assets"),
+           HumanMessage(content="list the rds instances"), AIMessage(content="orders-db")]
+
+def test_follow_up_questions_depend_on_the_last_turns():
+    assert relevant_history("how many tables are in the sales database?", HISTORY) == []
+    assert relevant_history("and what about eu-west-1?", HISTORY) == HISTORY[-4:]
+    assert relevant_history("show them", HISTORY) == HISTORY[-4:]
+
+def test_cache_key():
+    key = cache_key("How many tables are in the sales database?", "Sonnet 3.5", HISTORY, 0.0, 1000)
+
+    # Stand-alone questions hit across sessions and spellings
+    assert key == cache_key("how many tables are in the  sales database", "Sonnet 3.5", [], 0, 1000)
+    assert key != cache_key("How many tables are in the sales database?", "Haiku 3", HISTORY, 0.0, 1000)
+    assert key != cache_key("How many tables are in the sales database?", "Sonnet 3.5", HISTORY, 0.5, 1000)
+    assert key != cache_key("How many tables are in the sales database?", "Sonnet 3.5", HISTORY, 0.0, 2000)
+    assert cache_key("show them", "Sonnet 3.5", HISTORY, 0, 1000) != cache_key("show them", "Sonnet 3.5", HISTORY[:2], 0, 1000)
+
+def test_the_shortest_ttl_of_the_tools_wins():
+    assert answer_ttl([]) == INTENT_TTLS['general']
+    assert answer_ttl(['list_rds_instances', 'list_glue_databases_and_tables']) == INTENT_TTLS['inventory']
+    assert answer_ttl(['list_rds_instances', 'get_current_time']) == 0
+    assert answer_ttl(['a_new_tool']) == INTENT_TTLS['general']
+
+def test_answers_are_stored_with_their_frames(tmp_path):
+    path = str(tmp_path / "cache" / "responses.db")
+    cache = ResponseCache(path)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    bind_session("writer")
+    df = pd.DataFrame({'name': ['logs', 'assets'], 'created': pd.to_datetime(['2024-01-01', '2024-02-01'])})
+    answer = describe_frame(df, "Buckets")
+    handle = answer.split("df-", 1)[1][:12]
+    assert cache.put("k", "list my buckets", "Sonnet 3.5", f"See df-{handle}", ttl=60)
+    assert not cache.put("uncached", "what time is it", "Sonnet 3.5", "12:00", ttl=0)
+
+    # Another session gets the answer and the frame under the same handle
+    bind_session("reader")
+    assert get_frame(f"df-{handle}") is None
+    cached = cache.get("k")
+    assert (cached.answer, cached.model) == (f"See df-{handle}", "Sonnet 3.5")
+    restored = get_frame(f"df-{handle}")
+    assert restored['name'].tolist() == ['logs', 'assets']
+    assert restored['created'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-01', '2024-02-01']
+    assert cache.get("uncached") is None and len(cache) == 1
+
+    cache.invalidate("k")
+    assert cache.get("k") is None
@@ -0,0 +1,115 @@
+import inspect
+import time
+from typing import List
+import pandas as pd
+import pytest
+from langchain_core.tools import StructuredTool
+import inventory
+import toolcache
+import tool_aws_athena_execute_query as athena
+import tool_aws_glue_list_databases_and_tables as glue
+from cache import LRUCache
+from datastore import bind_session, describe_frame
+from inventory import InventoryStore, snapshot_or_live
+from toolcache import bind_refresh_intent, cache_key, cached_tool
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    toolcache.clear()
+    bind_refresh_intent("")
+    bind_session("toolcache-test")
+    yield
+    bind_refresh_intent("")
+    toolcache.clear()
+
+def _counting_tool(name: str, results: list, ttl: float = 60):
+    calls = []
+
+    def run(regions: List[str], query: str = "", hours: int = 24) -> str:
+        calls.append((regions, query, hours))
+        return results[min(len(calls), len(results)) - 1]
+    return cached_tool(StructuredTool.from_function(func=run, name=name, description=name), ttl), calls
+
+def test_cache_key_ignores_whitespace_list_order_and_explicit_defaults():
+    def lookup(regions: List[str], query: str = "", hours: int = 24):
+        pass
+    signature = inspect.signature(lookup)
+
+    assert cache_key('t', signature, (), {'regions': ['us-east-1', 'eu-west-1'], 'query': " x "}) == \
+        cache_key('t', signature, (), {'regions': ['eu-west-1', 'us-east-1', 'eu-west-1'], 'query': "x", 'hours': 24})
+    assert cache_key('t', signature, (), {'regions': ['eu-west-1'], 'hours': 1}) != \
+        cache_key('t', signature, (), {'regions': ['eu-west-1'], 'hours': 2})
+
+def test_results_expire_after_the_ttl():
+    tool, calls = _counting_tool('list_things', ["first", "second"], ttl=0.05)
+
+    assert tool.invoke({'regions': ['eu-west-1']}) == "first"
+    assert tool.invoke({'regions': ['eu-west-1']}) == "first"
+    time.sleep(0.1)
+    assert tool.invoke({'regions': ['eu-west-1']}) == "second"
+    assert len(calls) == 2
+
+def test_results_whose_data_handles_do_not_resolve_are_not_served():
+    results = []
+
+    def run(regions: List[str]) -> str:
+        results.append(describe_frame(pd.DataFrame({'name': ['db-1']}), "Databases"))
+        return results[-1]
+    tool = cached_tool(StructuredTool.from_function(func=run, name="list_frames", description="list_frames"), 60)
+
+    first = tool.invoke({'regions': ['eu-west-1']})
+    assert tool.invoke({'regions': ['eu-west-1']}) == first
+    # Another session cannot resolve the handles of the cached result
+    bind_session("another-session")
+    assert tool.invoke({'regions': ['eu-west-1']}) != first
+    assert len(results) == 2
+
+@pytest.mark.parametrize("error", ["Error: AccessDenied", "Query execution failed: TABLE_NOT_FOUND",
+                                   "Query was cancelled", "An unexpected error occurred: throttled"])
+def test_errors_are_not_cached(error):
+    tool, calls = _counting_tool('list_things', [error, "ok"])
+
+    assert tool.invoke({'regions': ['eu-west-1']}) == error
+    assert tool.invoke({'regions': ['eu-west-1']}) == "ok"
+
+def test_only_reading_athena_queries_are_cached():
+    tool, calls = _counting_tool('execute_athena_query', ["done"])
+
+    for query in ["INSERT INTO daily SELECT * FROM orders", "INSERT INTO daily SELECT * FROM orders",
+                  "SELECT count(*) FROM orders", "SELECT count(*) FROM orders"]:
+        tool.invoke({'regions': ['eu-west-1'], 'query': query})
+
+    assert [query for _, query, _ in calls] == ["INSERT INTO daily SELECT * FROM orders"] * 2 + ["SELECT count(*) FROM orders"]
+
+def test_refresh_intent_bypasses_the_cache_and_replaces_the_result():
+    tool, calls = _counting_tool('list_things', ["old", "new"])
+    tool.invoke({'regions': ['eu-west-1']})
+
+    assert bind_refresh_intent("refresh the list of things")
+    assert tool.invoke({'regions': ['eu-west-1']}) == "new"
+    bind_refresh_intent("list the things")
+    assert tool.invoke({'regions': ['eu-west-1']}) == "new"
+    assert len(calls) == 2
+
+def test_refresh_intent_reaches_the_caches_inside_the_tools(tmp_path, monkeypatch):
+    # Athena results
+    key, _, _ = athena._cached_results('eu-west-1', 'sales', "SELECT 1", 10, True)
+    athena.result_cache.put(key, (pd.DataFrame({'x': [1]}), False))
+    assert athena._cached_results('eu-west-1', 'sales', "SELECT 1", 10, True)[2] is not None
+
+    # Glue catalog
+    monkeypatch.setattr(glue, "catalog_cache", LRUCache(max_entries=4))
+    glue.catalog_cache.put('eu-west-1', {'databases': ['stale'], 'tables': []})
+    monkeypatch.setattr(glue, "snapshot_or_live", lambda resource, region: ({'databases': ['live'], 'tables': []}, None))
+
+    # Inventory snapshot
+    store = InventoryStore(str(tmp_path / "inventory.db"))
+    monkeypatch.setitem(inventory._resources, 'things', (lambda region: {'state': 'live'}, 'json'))
+    store.save('things', 'eu-west-1', {'state': 'snapshot'}, kind='json')
+    assert snapshot_or_live('things', 'eu-west-1', store=store)[0] == {'state': 'snapshot'}
+
+    bind_refresh_intent("refresh it")
+    assert athena._cached_results('eu-west-1', 'sales', "SELECT 1", 10, True)[2] is None
+    assert glue.get_catalog_index('eu-west-1')['databases'] == ['live']
+    assert snapshot_or_live('things', 'eu-west-1', store=store) == ({'state': 'live'}, None)
+    athena.result_cache.pop(key)
@@ -0,0 +1,97 @@
+from langchain_core.agents import AgentAction
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from streamlit.testing.v1 import AppTest
+import agent
+from toolrouter import route_tools, widen_reason
+from toolset import list_of_tools
+
+def test_databases_route_to_rds_and_glue():
+    tools, _ = route_tools("list our databases in eu-west-1")
+
+    assert {'list_rds_instances', 'list_glue_databases_and_tables'} <= set(tools)
+
+def test_follow_up_keeps_previous_tools():
+    tools, reason = route_tools("and in us-east-1?", ['list_rds_instances'])
+
+    assert tools == ['list_rds_instances'] and "follow-up" in reason
+
+def test_widen_when_the_answer_says_it_cannot_answer():
+    reason = widen_reason("show the docker images", ['list_ecr_repositories_and_versions'],
+                          "I don't have a tool to look up CloudTrail events.", [])
+
+    assert reason is not None and "cannot answer" in reason
+
+def test_widen_when_no_routed_tool_was_called():
+    assert widen_reason("list the rds instances", ['list_rds_instances'], "There are none.", []) is not None
+
+def test_no_widening_after_a_tool_call_follow_up_or_all_tools():
+    steps = [(AgentAction(tool='list_rds_instances', tool_input={}, log=""), "db-1")]
+    all_tools = [tool.name for tool in list_of_tools]
+
+    assert widen_reason("list the rds instances", ['list_rds_instances'], "There is db-1.", steps) is None
+    assert widen_reason("and the second one?", ['list_rds_instances'], "It is db-2.", []) is None
+    assert widen_reason("list the rds instances", None, "I am unable to do that.", []) is None
+    assert widen_reason("list the rds instances", all_tools, "I am unable to do that.", []) is None
+
+class ToolAwareModel(FakeMessagesListChatModel):
+    """
+    Answers that it cannot help unless the CloudTrail tool is bound, and records the bound tools.
+    """
+    bound_tools: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        names = [tool.name for tool in tools]
+        ToolAwareModel.bound_tools.append(names)
+        text = ("Nobody deleted an image yesterday." if 'list_cloudtrail_events' in names
+                else "I don't have a tool to look up who deleted images.")
+        return FakeMessagesListChatModel(responses=[AIMessage(content=text)])
+
+def test_app_widens_a_turn_the_routed_tools_cannot_answer(monkeypatch):
+    ToolAwareModel.bound_tools = []
+    monkeypatch.setattr(agent, "get_llm_for_model_selection",
+                        lambda *args, **kwargs: ToolAwareModel(responses=[AIMessage(content="")]))
+    agent.get_agent.clear()
+    app = AppTest.from_file("../app.py", default_timeout=60)
+    app.session_state["selected_model"] = "Haiku 3"
+    app.run()
+    next(toggle for toggle in app.sidebar.toggle if toggle.label == "Summarize Old Turns").set_value(False)
+    app.run()
+
+    app.chat_input[0].set_value("which docker images are in the payments repository").run()
+
+    assert not app.exception
+    assert 'list_cloudtrail_events' not in ToolAwareModel.bound_tools[0]
+    assert len(ToolAwareModel.bound_tools[1]) == len(list_of_tools)
+    assert app.session_state["messages"][-1].content == "Nobody deleted an image yesterday."
+    agent.get_agent.clear()
+
+class PythonFirstModel(ToolAwareModel):
+    """
+    Runs Python with the routed tools and then answers that it cannot help.
+    """
+
+    def bind_tools(self, tools, **kwargs):
+        ToolAwareModel.bound_tools.append([tool.name for tool in tools])
+        return FakeMessagesListChatModel(responses=[
+            AIMessage(content="", tool_calls=[{'name': 'Python_REPL', 'args': {'query': "print(1)"}, 'id': "call-1"}]),
+            AIMessage(content="I don't have a tool to look up who deleted images."),
+        ])
+
+def test_app_does_not_widen_a_turn_with_side_effects(monkeypatch):
+    ToolAwareModel.bound_tools = []
+    monkeypatch.setattr(agent, "get_llm_for_model_selection",
+                        lambda *args, **kwargs: PythonFirstModel(responses=[AIMessage(content="")]))
+    agent.get_agent.clear()
+    app = AppTest.from_file("../app.py", default_timeout=60)
+    app.session_state["selected_model"] = "Haiku 3"
+    app.run()
+    next(toggle for toggle in app.sidebar.toggle if toggle.label == "Summarize Old Turns").set_value(False)
+    app.run()
+
+    app.chat_input[0].set_value("use python to check who deleted docker images").run()
+
+    assert not app.exception
+    assert len(ToolAwareModel.bound_tools) == 1 and 'Python_REPL' in ToolAwareModel.bound_tools[0]
+    assert app.session_state["messages"][-1].content == "I don't have a tool to look up who deleted images."
+    agent.get_agent.clear()
@@ -1,64 +1,286 @@
-import boto3
+import asyncio
+import os
 import pandas as pd
+import re
 import time
-from langchain.tools import tool
+from urllib.parse import urlparse
+from langchain_core.tools import StructuredTool
+from async_runtime import offload
+from cache import LRUCache
+from datastore import describe_frame
+from multi_region import regional_client
+from toolcache import refresh_requested
 
-@tool
-def execute_athena_query(database: str, query: str, s3_output_location: str, region: str = 'eu-west-1') -> str:
+ATHENA_MAX_ROWS = 10000
+ATHENA_PAGE_SIZE = 1000
+# Queued queries wait for capacity and are polled less often than running ones
+POLL_INITIAL_DELAY = 0.25
+POLL_MAX_DELAY_RUNNING = 2.0
+POLL_MAX_DELAY_QUEUED = 5.0
+# Minutes Athena may reuse the results of an identical query, 0 disables it (requires engine version 3)
+ATHENA_RESULT_REUSE_MINUTES = int(os.environ.get("ATHENA_RESULT_REUSE_MINUTES", "0"))
+
+# Results are read from the CSV that Athena writes to the output location when it is larger than
+# the threshold, AWS_S3_ENDPOINT_URL points the reader at a local S3 stand-in like moto or LocalStack
+S3_AUTO_THRESHOLD_BYTES = 1024 * 1024
+S3_CHUNK_ROWS = 50000
+S3_ENDPOINT_URL = os.environ.get("AWS_S3_ENDPOINT_URL")
+SUMMARY_ROWS = 5
+
+# Athena column types mapped to pandas dtypes, date and timestamp columns are parsed as dates
+ATHENA_DTYPES = {
+    'boolean': 'boolean',
+    'tinyint': 'Int8',
+    'smallint': 'Int16',
+    'integer': 'Int32',
+    'int': 'Int32',
+    'bigint': 'Int64',
+    'float': 'float32',
+    'real': 'float32',
+    'double': 'float64',
+    'decimal': 'float64',
+    'char': 'string',
+    'varchar': 'string',
+    'string': 'string',
+}
+ATHENA_DATE_TYPES = ('date', 'timestamp')
+
+RESULT_CACHE_TTL = 15 * 60
+result_cache = LRUCache(max_entries=64, max_bytes=256 * 1024 * 1024, ttl=RESULT_CACHE_TTL,
+                        sizeof=lambda entry: int(entry[0].memory_usage(index=True, deep=True).sum()))
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_WHITESPACE = re.compile(r"\s+")
+_CACHEABLE_STATEMENTS = ('select', 'with', 'show', 'describe')
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes whitespace, case and a trailing semicolon outside of string literals.
+    """
+    parts = _STRING_LITERAL.split(query.strip().rstrip(';'))
+    return ''.join(part if i % 2 else _WHITESPACE.sub(' ', part).lower() for i, part in enumerate(parts)).strip()
+
+def _next_poll_delay(delay: float, state: str) -> float:
+    max_delay = POLL_MAX_DELAY_QUEUED if state == 'QUEUED' else POLL_MAX_DELAY_RUNNING
+    return min(delay * 2, max_delay)
+
+def wait_for_query(athena_client, query_execution_id: str) -> dict:
+    """
+    Polls the query execution with a backoff that depends on the reported state until it finishes.
+    """
+    delay = POLL_INITIAL_DELAY
+    while True:
+        execution = athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        state = execution['Status']['State']
+        if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+            return execution
+        time.sleep(delay)
+        delay = _next_poll_delay(delay, state)
+
+async def await_query(athena_client, query_execution_id: str) -> dict:
+    """
+    Polls like wait_for_query, but the event loop and the shared pool are free while the query runs.
+    """
+    delay = POLL_INITIAL_DELAY
+    while True:
+        response = await offload(athena_client.get_query_execution, QueryExecutionId=query_execution_id)
+        execution = response['QueryExecution']
+        state = execution['Status']['State']
+        if state in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+            return execution
+        await asyncio.sleep(delay)
+        delay = _next_poll_delay(delay, state)
+
+def fetch_query_results(athena_client, query_execution_id: str, max_rows: int):
+    """
+    Pages through the query results until the row budget is spent.
+
+    Returns:
+        tuple: the DataFrame and whether the results were truncated
+    """
+    paginator = athena_client.get_paginator('get_query_results')
+    pages = paginator.paginate(QueryExecutionId=query_execution_id, PaginationConfig={'PageSize': ATHENA_PAGE_SIZE})
+
+    columns = None
+    rows = []
+    for page in pages:
+        result_set = page['ResultSet']
+        page_rows = result_set['Rows']
+        if columns is None:
+            columns = [col['Label'] for col in result_set['ResultSetMetadata']['ColumnInfo']]
+            page_rows = page_rows[1:]  # Skip the header row
+        for row in page_rows:
+            if len(rows) >= max_rows:
+                return pd.DataFrame(rows, columns=columns), True
+            rows.append([field.get('VarCharValue', '') for field in row['Data']])
+
+    return pd.DataFrame(rows, columns=columns or []), False
+
+def read_query_results_from_s3(s3_client, output_location: str, column_info: list, max_rows: int):
+    """
+    Streams the result CSV of a query from S3 in chunks into typed columns. At most max_rows rows are kept,
+    the remaining chunks are only counted and their last rows are kept for the summary.
+
+    Returns:
+        tuple: the DataFrame of the kept rows, the total number of rows and the DataFrame of the last rows
+    """
+    location = urlparse(output_location)
+    body = s3_client.get_object(Bucket=location.netloc, Key=location.path.lstrip('/'))['Body']
+
+    dtype = {}
+    parse_dates = []
+    for column in column_info:
+        column_type = column['Type'].lower().split('(')[0]
+        if column_type in ATHENA_DATE_TYPES:
+            parse_dates.append(column['Name'])
+        else:
+            dtype[column['Name']] = ATHENA_DTYPES.get(column_type, 'string')
+
+    kept = []
+    kept_rows = 0
+    total_rows = 0
+    tail = None
+    for chunk in pd.read_csv(body, dtype=dtype, parse_dates=parse_dates, chunksize=S3_CHUNK_ROWS):
+        total_rows += len(chunk)
+        if kept_rows < max_rows:
+            part = chunk.head(max_rows - kept_rows)
+            kept.append(part)
+            kept_rows += len(part)
+        tail = chunk.tail(SUMMARY_ROWS) if tail is None else pd.concat([tail, chunk.tail(SUMMARY_ROWS)]).tail(SUMMARY_ROWS)
+
+    columns = [column['Name'] for column in column_info]
+    df = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame(columns=columns)
+    return df, total_rows, tail if tail is not None else df
+
+def _use_s3_results(s3_client, output_location: str, result_source: str) -> bool:
+    if result_source == 's3':
+        return True
+    if result_source != 'auto' or not output_location.endswith('.csv'):
+        return False
+    location = urlparse(output_location)
+    size = s3_client.head_object(Bucket=location.netloc, Key=location.path.lstrip('/'))['ContentLength']
+    return size > S3_AUTO_THRESHOLD_BYTES
+
+def _cached_results(region: str, database: str, query: str, max_rows: int, use_cache: bool):
+    """
+    Returns the cache key, whether the query is cacheable and the description of a cached result or None.
+    """
+    normalized_query = normalize_query(query)
+    cache_key = (region, database, normalized_query)
+    cacheable = normalized_query.startswith(_CACHEABLE_STATEMENTS)
+
+    # Asking for fresh data skips the lookup, the new result replaces the cached one
+    if use_cache and cacheable and not refresh_requested():
+        cached = result_cache.get(cache_key)
+        # A truncated result only answers queries that do not need more rows
+        if cached is not None and (not cached[1] or len(cached[0]) >= max_rows):
+            df, truncated = cached[0].head(max_rows), cached[1] or len(cached[0]) > max_rows
+            return cache_key, cacheable, _describe_results(df, database, truncated, cached=True)
+    return cache_key, cacheable, None
+
+def _query_request(database: str, query: str, s3_output_location: str, cacheable: bool) -> dict:
+    request = {
+        'QueryString': query,
+        'QueryExecutionContext': {'Database': database},
+        'ResultConfiguration': {'OutputLocation': s3_output_location},
+    }
+    if ATHENA_RESULT_REUSE_MINUTES > 0 and cacheable:
+        request['ResultReuseConfiguration'] = {
+            'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': ATHENA_RESULT_REUSE_MINUTES}
+        }
+    return request
+
+def _collect_results(athena_client, execution: dict, region: str, database: str, max_rows: int, result_source: str,
+                     cache_key: tuple, cacheable: bool) -> str:
+    """
+    Reads the results of a finished query execution and registers them as a data handle.
+    """
+    status = execution['Status']['State']
+    if status == 'FAILED':
+        error_message = execution['Status'].get('StateChangeReason', 'Unknown error')
+        return f"Query execution failed: {error_message}"
+    elif status == 'CANCELLED':
+        return "Query was cancelled"
+
+    query_execution_id = execution['QueryExecutionId']
+    output_location = execution.get('ResultConfiguration', {}).get('OutputLocation', '')
+    s3_client = regional_client('s3', region, endpoint_url=S3_ENDPOINT_URL)
+    if output_location and _use_s3_results(s3_client, output_location, result_source):
+        metadata = athena_client.get_query_results(QueryExecutionId=query_execution_id, MaxResults=1)
+        column_info = metadata['ResultSet']['ResultSetMetadata']['ColumnInfo']
+        df, total_rows, tail = read_query_results_from_s3(s3_client, output_location, column_info, max_rows)
+        truncated = total_rows > len(df)
+    else:
+        df, truncated = fetch_query_results(athena_client, query_execution_id, max_rows)
+        total_rows, tail = None, None
+
+    if cacheable:
+        result_cache.put(cache_key, (df, truncated))
+
+    return _describe_results(df, database, truncated, total_rows=total_rows, tail=tail)
+
+def _execute_athena_query(database: str, query: str, s3_output_location: str, region: str = 'eu-west-1',
+                          max_rows: int = ATHENA_MAX_ROWS, use_cache: bool = True, result_source: str = 'auto') -> str:
     """
-    Execute an Athena query on AWS Glue tables and format the results as a markdown table.
+    Execute an Athena query on AWS Glue tables and register the results as a data handle.
 
     Args:
         database (str): the name of the database eg. my-database
         query (str): the SQL query to execute
         s3_output_location (str): The S3 location where the query results should be stored in format s3://<bucket>/<path>
         region (str): the AWS region where the Athena query should be executed defaults to 'eu-west-1'
+        max_rows (int): the maximum number of result rows to fetch, defaults to 10000
+        use_cache (bool): reuse the results of the same query from the last 15 minutes, set to False to force a new run
+        result_source (str): 'api' pages through the Athena API, 's3' streams the result file from S3,
+            'auto' (default) uses S3 for large results
 
     Returns:
-        str: A markdown-formatted table containing the query results, or an error message
+        str: The data handle, schema and a sample of the query results, or an error message
 """
     try:
-        athena_client = boto3.client('athena', region)
-        s3_client = boto3.client('s3', region)
-
-        # Start the query execution
-        response = athena_client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={'Database': database},
-            ResultConfiguration={'OutputLocation': s3_output_location}
-        )
-        query_execution_id = response['QueryExecutionId']
-
-        # Wait for the query to complete
-        while True:
-            query_status = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-            status = query_status['QueryExecution']['Status']['State']
-            if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-                break
-            time.sleep(1)
-
-        if status == 'FAILED':
-            error_message = query_status['QueryExecution']['Status'].get('StateChangeReason', 'Unknown error')
-            return f"Query execution failed: {error_message}"
-        elif status == 'CANCELLED':
-            return "Query was cancelled"
-
-        # Get the results
-        results = athena_client.get_query_results(QueryExecutionId=query_execution_id)
-
-        # Process the results
-        columns = [col['Label'] for col in results['ResultSet']['ResultSetMetadata']['ColumnInfo']]
-        rows = []
-        for row in results['ResultSet']['Rows'][1:]:  # Skip the header row
-            rows.append([field.get('VarCharValue', '') for field in row['Data']])
+        cache_key, cacheable, cached = _cached_results(region, database, query, max_rows, use_cache)
+        if cached is not None:
+            return cached
 
-        # Create a pandas DataFrame
-        df = pd.DataFrame(rows, columns=columns)
+        athena_client = regional_client('athena', region)
+        response = athena_client.start_query_execution(**_query_request(database, query, s3_output_location, cacheable))
+        execution = wait_for_query(athena_client, response['QueryExecutionId'])
+        return _collect_results(athena_client, execution, region, database, max_rows, result_source, cache_key, cacheable)
+    except Exception as e:
+        return f"An unexpected error occurred: {str(e)}"
 
-        # Convert DataFrame to markdown
-        markdown_table = df.to_markdown(index=False)
+async def _aexecute_athena_query(database: str, query: str, s3_output_location: str, region: str = 'eu-west-1',
+                                 max_rows: int = ATHENA_MAX_ROWS, use_cache: bool = True, result_source: str = 'auto') -> str:
+    # The async path offloads every boto3 call and waits for the query without holding a thread
+    try:
+        cache_key, cacheable, cached = _cached_results(region, database, query, max_rows, use_cache)
+        if cached is not None:
+            return cached
 
-        return markdown_table
+        athena_client = await offload(regional_client, 'athena', region)
+        response = await offload(athena_client.start_query_execution,
+                                 **_query_request(database, query, s3_output_location, cacheable))
+        execution = await await_query(athena_client, response['QueryExecutionId'])
+        return await offload(_collect_results, athena_client, execution, region, database, max_rows, result_source,
+                             cache_key, cacheable)
     except Exception as e:
         return f"An unexpected error occurred: {str(e)}"
 
+execute_athena_query = StructuredTool.from_function(
+    func=_execute_athena_query,
+    coroutine=_aexecute_athena_query,
+    name="execute_athena_query",
+)
+
+def _describe_results(df: pd.DataFrame, database: str, truncated: bool, cached: bool = False,
+                      total_rows: int = None, tail: pd.DataFrame = None) -> str:
+    title = f"Athena query results of database {database}"
+    if cached:
+        title += " (cached result of an identical query)"
+    if truncated:
+        of_total = f" of {total_rows}" if total_rows is not None else ""
+        title += f" (truncated to the first {len(df)}{of_total} rows, increase max_rows or aggregate in SQL for more)"
+    description = describe_frame(df, title, sample_rows=SUMMARY_ROWS, tail_rows=0 if truncated else SUMMARY_ROWS)
+    if truncated and tail is not None:
+        description += f"\n\nLast {len(tail)} rows of the full result, not part of the data handle:\n{tail.to_markdown(index=False)}"
+    return description
@@ -1,97 +1,160 @@
-import boto3
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List
 import pandas as pd
 from langchain.tools import tool
+from datastore import describe_frame
+from multi_region import regional_client
 
-def get_bedrock_token_counts(start_time, end_time, model_id, region: str):
-    cloudwatch = boto3.client('cloudwatch', region)
+PERIOD = 3600
+# CloudWatch metrics arrive minutes late, an hour is only treated as closed this long after it ended
+CLOSED_BUCKET_GRACE = timedelta(minutes=30)
+METRICS = ['InputTokenCount', 'OutputTokenCount']
 
-    metrics = [
-        {'Name': 'InputTokenCount', 'Stat': 'Sum'},
-        {'Name': 'OutputTokenCount', 'Stat': 'Sum'}
-    ]
+# Price in USD per million input and output tokens
+MODEL_PRICES = {
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": (3.0, 15.0),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (3.0, 15.0),
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.25, 1.25),
+    "amazon.titan-embed-text-v2:0": (0.02, 0.0),
+}
 
-    response = cloudwatch.get_metric_data(
-        MetricDataQueries=[
-            {
-                'Id': f'm{i}',
+# Closed hourly buckets do not change anymore, they are cached per (region, model_id) as
+# (covered_from, covered_until, DataFrame) so a report only fetches the hours after covered_until
+_bucket_cache = {}
+_bucket_lock = threading.Lock()
+
+def _empty_counts() -> pd.DataFrame:
+    return pd.DataFrame({
+        'model_id': pd.Series(dtype='string'),
+        'timestamp': pd.Series(dtype='datetime64[ns, UTC]'),
+        'InputTokenCount': pd.Series(dtype='float64'),
+        'OutputTokenCount': pd.Series(dtype='float64'),
+    })
+
+def fetch_token_counts(cloudwatch, model_ids: list, start_time: datetime, end_time: datetime) -> pd.DataFrame:
+    """
+    Fetches the hourly input and output token counts of all models with one batched get_metric_data
+    request, following NextToken, and joins the metrics on their timestamps.
+    """
+    queries = []
+    query_ids = {}
+    for i, model_id in enumerate(model_ids):
+        for j, metric in enumerate(METRICS):
+            query_id = f'm{i}_{j}'
+            query_ids[query_id] = (model_id, metric)
+            queries.append({
+                'Id': query_id,
                 'MetricStat': {
                     'Metric': {
                         'Namespace': 'AWS/Bedrock',
-                        'MetricName': metric['Name'],
+                        'MetricName': metric,
                         'Dimensions': [
                             {'Name': 'ModelId', 'Value': model_id}
                         ]
                     },
-                    'Period': 3600,
-                    'Stat': metric['Stat']
+                    'Period': PERIOD,
+                    'Stat': 'Sum'
                 }
-            } for i, metric in enumerate(metrics)
-        ],
-        StartTime=start_time,
-        EndTime=end_time
-    )
-
-    results = []
-    timestamps = response['MetricDataResults'][0]['Timestamps']
-    for i in range(len(timestamps)):
-        results.append({
-            'timestamp': timestamps[i],
-            'InputTokenCount': response['MetricDataResults'][0]['Values'][i],
-            'OutputTokenCount': response['MetricDataResults'][1]['Values'][i]
-        })
-
-    return results
-
-def calculate_cost(input_tokens, output_tokens):
-    input_cost = (input_tokens / 1_000_000) * 3
-    output_cost = (output_tokens / 1_000_000) * 15
-    total_cost = input_cost + output_cost
-    return input_cost, output_cost, total_cost
-
-def generate_report(days, model_id, region: str):
-    end_time = datetime.utcnow()
+            })
+
+    records = []
+    paginator = cloudwatch.get_paginator('get_metric_data')
+    for page in paginator.paginate(MetricDataQueries=queries, StartTime=start_time, EndTime=end_time):
+        for result in page['MetricDataResults']:
+            model_id, metric = query_ids[result['Id']]
+            records.extend((model_id, metric, timestamp, value)
+                           for timestamp, value in zip(result['Timestamps'], result['Values']))
+
+    if not records:
+        return _empty_counts()
+
+    long_df = pd.DataFrame.from_records(records, columns=['model_id', 'metric', 'timestamp', 'value'])
+    long_df['timestamp'] = pd.to_datetime(long_df['timestamp'], utc=True)
+    df = long_df.pivot_table(index=['model_id', 'timestamp'], columns='metric', values='value', aggfunc='sum', fill_value=0)
+    df = df.reindex(columns=METRICS, fill_value=0).reset_index()
+    df.columns.name = None
+    return df
+
+def get_token_counts(model_ids: list, start_time: datetime, end_time: datetime, region: str) -> pd.DataFrame:
+    """
+    Returns the hourly token counts of the models, closed hours are served from the bucket cache. The most
+    recent cached hour is fetched again, late data points of it replace the cached bucket.
+    """
+    start_time = start_time.replace(minute=0, second=0, microsecond=0)
+    closed_until = (end_time - CLOSED_BUCKET_GRACE).replace(minute=0, second=0, microsecond=0)
+
+    with _bucket_lock:
+        cached = {model_id: _bucket_cache.get((region, model_id)) for model_id in model_ids}
+
+    incremental = all(entry is not None and entry[0] <= start_time for entry in cached.values())
+    fetch_start = start_time
+    if incremental:
+        fetch_start = max(start_time, min(entry[1] for entry in cached.values()) - timedelta(seconds=PERIOD))
+    fetched = fetch_token_counts(regional_client('cloudwatch', region), model_ids, fetch_start, end_time)
+
+    frames = [fetched]
+    with _bucket_lock:
+        for model_id in model_ids:
+            model_rows = fetched[(fetched['model_id'] == model_id) & (fetched['timestamp'] < closed_until)]
+            if incremental:
+                covered_from, covered_until, cached_df = cached[model_id]
+                frames.append(cached_df[(cached_df['timestamp'] >= start_time) & (cached_df['timestamp'] < fetch_start)])
+                cached_df = pd.concat([cached_df[cached_df['timestamp'] < fetch_start], model_rows], ignore_index=True)
+                _bucket_cache[(region, model_id)] = (covered_from, closed_until, cached_df)
+            else:
+                _bucket_cache[(region, model_id)] = (start_time, closed_until, model_rows)
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return _empty_counts()
+    return pd.concat(frames, ignore_index=True)
+
+def generate_report(days: int, model_ids: list, region: str) -> pd.DataFrame:
+    end_time = datetime.now(timezone.utc)
     start_time = end_time - timedelta(days=days)
 
-    token_counts = get_bedrock_token_counts(start_time, end_time, model_id, region)
+    df = get_token_counts(model_ids, start_time, end_time, region)
 
-    df = pd.DataFrame(token_counts)
-    df['input_cost'], df['output_cost'], df['total_cost'] = zip(*df.apply(lambda row: calculate_cost(row['InputTokenCount'], row['OutputTokenCount']), axis=1))
+    input_price = df['model_id'].map(lambda model_id: MODEL_PRICES[model_id][0]).astype('float64')
+    output_price = df['model_id'].map(lambda model_id: MODEL_PRICES[model_id][1]).astype('float64')
+    df['input_cost'] = df['InputTokenCount'] / 1_000_000 * input_price
+    df['output_cost'] = df['OutputTokenCount'] / 1_000_000 * output_price
+    df['total_cost'] = df['input_cost'] + df['output_cost']
 
-    df = df.sort_values('timestamp')
+    df = df.sort_values(['timestamp', 'model_id'])
     df['timestamp'] = df['timestamp'].dt.tz_localize(None)
-    df.set_index('timestamp', inplace=True)
 
-    return df
+    return df.reset_index(drop=True)
 
 @tool
-def bedrock_token_counts_tool(days: int, model_id: str, region: str) -> str:
+def bedrock_token_counts_tool(days: int, model_ids: List[str], region: str) -> str:
     """
-    Generates an Amazon Bedrock token usage and cost report for the last N days for the given model.
+    Generates an Amazon Bedrock token usage and cost report for the last N days for the given models.
 
     Args:
         days (int): Number of days (integer)
-        model_id (str): Model ID choice from the list of valid models 'anthropic.claude-3-sonnet-20240229-v1:0', 'anthropic.claude-3-5-sonnet-20240620-v1:0' or 'amazon.titan-embed-text-v2:0'
+        model_ids (list): Model IDs chosen from the list of valid models 'anthropic.claude-3-sonnet-20240229-v1:0',
+            'anthropic.claude-3-5-sonnet-20240620-v1:0', 'anthropic.claude-3-haiku-20240307-v1:0' or 'amazon.titan-embed-text-v2:0'
         region (str): The AWS region of Bedrock.
 
     Returns:
-        str: A summary report of the token usage and cost.
+        str: A summary report of the token usage and cost per model and a data handle of the hourly usage.
     """
     try:
-        # Validate model_id
-        valid_models = [
-            "anthropic.claude-3-5-sonnet-20240620-v1:0",
-            "anthropic.claude-3-sonnet-20240229-v1:0",
-            "amazon.titan-embed-text-v2:0"
-        ]
-        if model_id not in valid_models:
-            return f"Error: Invalid model_id. Please use one of: {', '.join(valid_models)}"
-
-        report = generate_report(days, model_id, region)
-        return f"""Token usage and cost for model {model_id} for the last {days} days.
-        {report}
-        Total cost for the last {days} days: ${report["total_cost"].sum():.2f}
-        """
+        # Validate model_ids
+        invalid_models = [model_id for model_id in model_ids if model_id not in MODEL_PRICES]
+        if invalid_models or not model_ids:
+            return f"Error: Invalid model_ids {', '.join(invalid_models)}. Please use one or more of: {', '.join(MODEL_PRICES)}"
+
+        report = generate_report(days, model_ids, region)
+        totals = report.groupby('model_id')[['InputTokenCount', 'OutputTokenCount', 'total_cost']].sum()
+        totals = totals.reindex(model_ids, fill_value=0)
+        return f"""Token usage and cost per model for the last {days} days.
+{totals.to_markdown()}
+Total cost for the last {days} days: ${report["total_cost"].sum():.2f}
+
+{describe_frame(report, "Hourly token usage and cost per model")}"""
     except ValueError:
         return "Error: Days must be an integer."
     except Exception as e:
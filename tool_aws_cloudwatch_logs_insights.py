@@ -0,0 +1,263 @@
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+import pandas as pd
+import pytz
+from langchain.tools import tool
+from datastore import describe_frame
+from multi_region import regional_client
+from progress import current_tool_progress
+
+# Logs Insights accepts at most 50 log groups per query, larger selections run as concurrent batches
+INSIGHTS_MAX_GROUPS_PER_QUERY = 50
+INSIGHTS_MAX_CONCURRENT_QUERIES = 4
+INSIGHTS_MAX_LIMIT = 10000
+INSIGHTS_TIMEOUT = 120
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 4.0
+
+DEFAULT_QUERY = (
+    "filter @message like /(?i)(error|exception|fail|timeout)/"
+    " | stats count(*) as events, earliest(@timestamp) as first, latest(@timestamp) as last by @log"
+    " | sort events desc"
+)
+
+# Aggregates whose batch results combine into the result over all log groups, and how they combine
+ADDITIVE_AGGREGATES = {'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max', 'earliest': 'min', 'latest': 'max'}
+_AGGREGATE_PATTERN = re.compile(r"^(\w+)\s*\((.*)\)(?:\s+as\s+(\S+))?$", re.IGNORECASE | re.DOTALL)
+_ALIAS_PATTERN = re.compile(r"^(.*?)\s+as\s+(\S+)$", re.IGNORECASE | re.DOTALL)
+_BY_PATTERN = re.compile(r"\sby\s", re.IGNORECASE)
+
+def _split_outside(text: str, separator: str) -> list:
+    """
+    Splits text at the separator outside of quotes, /regular expressions/ and parentheses.
+    """
+    parts, current, quote, depth = [], "", None, 0
+    for char in text:
+        if quote:
+            if char == quote and not current.endswith("\\"):
+                quote = None
+        elif char in "\"'`/":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += char
+    parts.append(current.strip())
+    return parts
+
+def _column_name(expression: str) -> str:
+    # Insights names a result column after its alias, or after the expression as written
+    alias = _ALIAS_PATTERN.match(expression)
+    return alias.group(2) if alias else expression.strip()
+
+def plan_batched_query(query: str):
+    """
+    Splits a query that runs over several batches of log groups into the query of a batch and the plan
+    to merge the batch results: the stats of the batches are aggregated again per group, and sort and
+    limit run once on the merged rows.
+
+    Returns:
+        tuple: the query of a batch and the merge plan, a dict with groups, aggregates, sort and limit
+
+    Raises:
+        ValueError: when the results of the batches cannot be merged into the result over all log groups
+    """
+    commands = _split_outside(query, "|")
+    stats_index = max((index for index, command in enumerate(commands) if command.lower().startswith("stats ")),
+                      default=None)
+    plan = {'groups': [], 'aggregates': None, 'sort': [], 'limit': None}
+    tail = commands if stats_index is None else commands[stats_index + 1:]
+    batch_commands = [] if stats_index is None else commands[:stats_index + 1]
+
+    if stats_index is not None:
+        body = commands[stats_index][len("stats "):]
+        by = list(_BY_PATTERN.finditer(body))
+        aggregates_text, groups_text = (body[:by[-1].start()], body[by[-1].end():]) if by else (body, "")
+        plan['groups'] = [_column_name(group) for group in _split_outside(groups_text, ",") if group]
+        plan['aggregates'] = []
+        for aggregate in _split_outside(aggregates_text, ","):
+            match = _AGGREGATE_PATTERN.match(aggregate)
+            function = match.group(1).lower() if match else aggregate
+            if function not in ADDITIVE_AGGREGATES:
+                raise ValueError(f"{function} cannot be combined across batches of {INSIGHTS_MAX_GROUPS_PER_QUERY} log groups, "
+                                 f"use count, sum, min or max, or select at most {INSIGHTS_MAX_GROUPS_PER_QUERY} log groups")
+            column = match.group(3) or f"{match.group(1)}({match.group(2)})"
+            plan['aggregates'].append((column, ADDITIVE_AGGREGATES[function]))
+
+    for command in tail:
+        name, _, arguments = command.partition(" ")
+        if name.lower() == "sort":
+            for field in _split_outside(arguments, ","):
+                column, _, direction = field.strip().partition(" ")
+                plan['sort'].append((column, direction.strip().lower() != "desc"))
+        elif name.lower() == "limit":
+            plan['limit'] = int(arguments.strip())
+        elif stats_index is not None:
+            raise ValueError(f"'{command}' after stats cannot be combined across batches of "
+                             f"{INSIGHTS_MAX_GROUPS_PER_QUERY} log groups, select at most {INSIGHTS_MAX_GROUPS_PER_QUERY} log groups")
+    if stats_index is None:
+        # Raw rows are sorted in every batch as well, the top rows of the batches contain the top rows overall
+        batch_commands = [command for command in commands if command.partition(" ")[0].lower() != "limit"]
+    return " | ".join(batch_commands), plan
+
+def _numeric(series: pd.Series) -> pd.Series:
+    converted = pd.to_numeric(series, errors='coerce')
+    return converted if converted.notna().sum() == series.notna().sum() else series
+
+def merge_batch_rows(batch_rows: List[list], plan: dict, limit: int) -> pd.DataFrame:
+    """
+    Merges the result rows of the batches following the plan of plan_batched_query.
+    """
+    df = pd.DataFrame([row for rows in batch_rows for row in rows])
+    if df.empty:
+        return df
+    if plan['aggregates'] is not None:
+        for column, _ in plan['aggregates']:
+            df[column] = _numeric(df[column])
+        aggregations = {column: how for column, how in plan['aggregates']}
+        if plan['groups']:
+            df = df.groupby(plan['groups'], as_index=False, dropna=False).agg(aggregations)
+        else:
+            df = df.agg(aggregations).to_frame().T
+    if plan['sort']:
+        columns = [column for column, _ in plan['sort'] if column in df.columns]
+        ascending = [ascending for column, ascending in plan['sort'] if column in df.columns]
+        if columns:
+            df = df.sort_values(columns, ascending=ascending, key=_numeric, kind='stable')
+    return df.head(min(limit, plan['limit'] or limit)).reset_index(drop=True)
+
+def iter_query_results(logs_client, query_id: str, timeout: float = INSIGHTS_TIMEOUT):
+    """
+    Polls a Logs Insights query with backoff and yields (status, results, statistics) every time more
+    results have arrived, the last snapshot is the final result or the partial result at the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    delay = POLL_INITIAL_DELAY
+    seen = -1
+    while True:
+        response = logs_client.get_query_results(queryId=query_id)
+        status = response['status']
+        finished = status not in ('Scheduled', 'Running')
+        if finished or len(response['results']) != seen:
+            seen = len(response['results'])
+            yield status, response['results'], response.get('statistics', {})
+        if finished:
+            return
+        if time.monotonic() >= deadline:
+            logs_client.stop_query(queryId=query_id)
+            yield 'Timeout', response['results'], response.get('statistics', {})
+            return
+        time.sleep(delay)
+        delay = min(delay * 2, POLL_MAX_DELAY)
+
+def run_insights_query(logs_client, log_group_names: list, query: str, start_time: int, end_time: int,
+                       limit: int, on_partial=None):
+    """
+    Runs a Logs Insights query over at most 50 log groups and returns the final (status, rows, statistics).
+    on_partial is called with the status, the number of rows and the statistics every time partial results arrive.
+    """
+    query_id = logs_client.start_query(
+        logGroupNames=log_group_names,
+        startTime=start_time,
+        endTime=end_time,
+        queryString=query,
+        limit=limit,
+    )['queryId']
+
+    status, results, statistics = 'Scheduled', [], {}
+    for status, results, statistics in iter_query_results(logs_client, query_id):
+        if on_partial is not None:
+            on_partial(status, len(results), statistics)
+
+    rows = [{field['field']: field['value'] for field in result if field['field'] != '@ptr'} for result in results]
+    return status, rows, statistics
+
+@tool
+def run_logs_insights_query(query: str = DEFAULT_QUERY, hours: int = 1, region: str = 'eu-west-1',
+                            log_group_prefix: str = '', log_group_names: Optional[List[str]] = None,
+                            limit: int = 100) -> str:
+    """
+    Runs a CloudWatch Logs Insights query across many log groups and returns the aggregated results as a data handle.
+    Prefer aggregating queries with stats over returning raw log lines. The default query counts the
+    error, exception, failure and timeout messages per log group.
+
+    Args:
+        query (str): the Logs Insights query, eg. 'filter @message like /ERROR/ | stats count(*) by bin(5m)'
+        hours (int): the number of hours ago to query from, defaults to 1
+        region (str): The AWS region of the log groups, defaults to 'eu-west-1'
+        log_group_prefix (str): query the log groups whose name starts with this prefix, defaults to all log groups
+        log_group_names (list): query exactly these log groups instead of using the prefix
+        limit (int): the maximum number of result rows, defaults to 100
+
+    Returns:
+        str: The data handle, schema and a sample of the query results, or an error message
+    """
+    try:
+        logs_client = regional_client('logs', region)
+
+        if not log_group_names:
+            log_group_names = []
+            arguments = {'logGroupNamePrefix': log_group_prefix} if log_group_prefix else {}
+            for page in logs_client.get_paginator('describe_log_groups').paginate(**arguments):
+                log_group_names.extend(group['logGroupName'] for group in page['logGroups'])
+        if not log_group_names:
+            return f"No log groups found in {region}."
+
+        now = datetime.now(pytz.UTC)
+        start_time = int((now - timedelta(hours=hours)).timestamp())
+        end_time = int(now.timestamp())
+        limit = max(1, min(limit, INSIGHTS_MAX_LIMIT))
+
+        batches = [log_group_names[i:i + INSIGHTS_MAX_GROUPS_PER_QUERY]
+                   for i in range(0, len(log_group_names), INSIGHTS_MAX_GROUPS_PER_QUERY)]
+        batch_query, plan = query, {'groups': [], 'aggregates': None, 'sort': [], 'limit': None}
+        batch_limit = limit
+        if len(batches) > 1:
+            try:
+                batch_query, plan = plan_batched_query(query)
+            except ValueError as e:
+                return f"Error running Logs Insights query: {str(e)}"
+            if plan['aggregates'] is not None:
+                # Every group of every batch is needed to aggregate them again
+                batch_limit = INSIGHTS_MAX_LIMIT
+
+        # The progress of the batches is shown to the user while the query runs
+        progress = current_tool_progress()
+
+        def run_batch(batch_number: int):
+            def on_partial(status: str, rows: int, statistics: dict):
+                if progress is not None:
+                    progress.update(f"insights-{batch_number}",
+                                    f"Logs Insights batch {batch_number + 1}/{len(batches)}: {status}, {rows} rows, "
+                                    f"{int(statistics.get('recordsScanned', 0)):,} records scanned")
+            return run_insights_query(logs_client, batches[batch_number], batch_query, start_time, end_time,
+                                      batch_limit, on_partial)
+
+        with ThreadPoolExecutor(max_workers=INSIGHTS_MAX_CONCURRENT_QUERIES) as executor:
+            outcomes = list(executor.map(run_batch, range(len(batches))))
+
+        batch_rows = []
+        scanned_records = 0
+        incomplete = []
+        for batch_number, (status, rows, statistics) in enumerate(outcomes):
+            batch_rows.append(rows)
+            scanned_records += int(statistics.get('recordsScanned', 0))
+            if status != 'Complete':
+                incomplete.append(f"batch {batch_number + 1} {status.lower()}")
+
+        title = (f"Logs Insights results of {len(log_group_names)} log groups in {region} for the last {hours} hours, "
+                 f"{scanned_records} records scanned")
+        if incomplete:
+            title += f" (partial results: {', '.join(incomplete)})"
+        df = merge_batch_rows(batch_rows, plan, limit) if len(batches) > 1 else pd.DataFrame(batch_rows[0])
+        return describe_frame(df, title)
+    except Exception as e:
+        return f"Error running Logs Insights query: {str(e)}"
@@ -0,0 +1,124 @@
+import math
+import re
+from collections import Counter
+from langchain.tools import tool
+from cache import LRUCache
+from tool_aws_glue_list_databases_and_tables import get_catalog_index, format_table
+
+# Fields of a table and how often their terms count in its document
+FIELD_WEIGHTS = {'name': 3, 'database': 1, 'description': 1, 'column': 2, 'comment': 1}
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+retrieval_cache = LRUCache(max_entries=16)
+
+_WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_STOPWORDS = {
+    'a', 'all', 'an', 'and', 'are', 'by', 'for', 'from', 'how', 'in', 'is', 'last', 'many', 'me', 'much', 'of',
+    'on', 'or', 'per', 'show', 'the', 'to', 'was', 'were', 'what', 'which', 'with',
+}
+
+def tokenize(text: str) -> list:
+    """
+    Splits snake_case, camelCase and free text into lowercase terms with a naive plural stemming.
+    """
+    terms = []
+    for word in _WORD.findall(text or ''):
+        word = word.lower()
+        if word in _STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+def _table_terms(table: dict) -> Counter:
+    terms = Counter()
+    for term in tokenize(table['name']):
+        terms[term] += FIELD_WEIGHTS['name']
+    for term in tokenize(table['database']):
+        terms[term] += FIELD_WEIGHTS['database']
+    for term in tokenize(table['description']):
+        terms[term] += FIELD_WEIGHTS['description']
+    for column in table['columns'] + table['partition_keys']:
+        for term in tokenize(column['name']):
+            terms[term] += FIELD_WEIGHTS['column']
+        for term in tokenize(column['comment']):
+            terms[term] += FIELD_WEIGHTS['comment']
+    return terms
+
+class SchemaIndex:
+    """
+    A BM25 index over the table names, column names and comments of a Glue catalog index.
+    """
+
+    def __init__(self, catalog_index: dict):
+        self.catalog_index = catalog_index
+        self.tables = catalog_index['tables']
+        self.documents = [_table_terms(table) for table in self.tables]
+        self.lengths = [sum(document.values()) for document in self.documents]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0
+        document_frequency = Counter(term for document in self.documents for term in document)
+        count = len(self.documents)
+        self.idf = {
+            term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def search(self, question: str, top_k: int = 5) -> list:
+        """
+        Returns the top_k (score, table) pairs for the question, tables without any matching term are left out.
+        """
+        terms = set(tokenize(question)) & self.idf.keys()
+        scores = []
+        for table, document, length in zip(self.tables, self.documents, self.lengths):
+            score = 0.0
+            for term in terms:
+                frequency = document.get(term, 0)
+                if frequency:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+                    score += self.idf[term] * frequency * (BM25_K1 + 1) / (frequency + norm)
+            if score > 0:
+                scores.append((score, table))
+        scores.sort(key=lambda entry: entry[0], reverse=True)
+        return scores[:top_k]
+
+def get_schema_index(region: str) -> SchemaIndex:
+    """
+    Returns the schema index of the region, it is rebuilt whenever the cached catalog index is rebuilt.
+    """
+    catalog_index = get_catalog_index(region)
+    schema_index = retrieval_cache.get(region)
+    if schema_index is None or schema_index.catalog_index is not catalog_index:
+        schema_index = SchemaIndex(catalog_index)
+        retrieval_cache.put(region, schema_index)
+    return schema_index
+
+@tool
+def find_relevant_glue_tables(question: str, region: str, top_k: int = 5) -> str:
+    """
+    Finds the AWS Glue tables that are most relevant to a question and returns their schemas.
+    Use this before writing an Athena query instead of listing the whole catalog.
+
+    Args:
+        question (str): the question of the user or the keywords of the data that is needed
+        region (str): The AWS region of the Glue catalog
+        top_k (int): the number of tables to return, defaults to 5
+
+    Returns:
+        str: The schemas of the most relevant tables, most relevant first.
+    """
+    try:
+        results = get_schema_index(region).search(question, top_k)
+        if not results:
+            return "No Glue tables match the question, use list_glue_databases_and_tables with filters to browse the catalog."
+
+        lines = [f'Most relevant AWS Glue tables for: {question}', '']
+        for score, table in results:
+            lines.append(f"Database: {table['database']} (relevance {score:.2f})")
+            lines.extend(format_table(table))
+            lines.append('')
+        return '\n'.join(lines)
+
+    except Exception as e:
+        return f'Error accessing AWS Glue: {str(e)}'
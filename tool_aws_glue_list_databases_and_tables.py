@@ -1,57 +1,173 @@
-import boto3
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from langchain.tools import tool
+from cache import LRUCache
+from inventory import register_resource, snapshot_or_live
+from multi_region import regional_client
+from toolcache import refresh_requested
+
+GLUE_MAX_WORKERS = 8
+CATALOG_TTL = 10 * 60
+catalog_cache = LRUCache(max_entries=16, ttl=CATALOG_TTL)
+
+def _paginate(glue_client, operation: str, result_key: str, **kwargs) -> list:
+    items = []
+    for page in glue_client.get_paginator(operation).paginate(**kwargs):
+        items.extend(page[result_key])
+    return items
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+class _CrawlerMap:
+    """
+    Maps tables to the crawler that maintains them, built from a single pass over all crawlers.
+    """
+
+    def __init__(self, crawlers: list):
+        self.by_name = {}
+        self.by_table = {}
+        self.by_database = {}
+        self.s3_paths = []
+        for crawler in crawlers:
+            last_run = _isoformat(crawler.get('LastCrawl', {}).get('StartTime', 'N/A'))
+            self.by_name[crawler['Name']] = last_run
+            targets = crawler.get('Targets', {})
+            for target in targets.get('CatalogTargets', []):
+                for table in target.get('Tables', []):
+                    self.by_table[(target['DatabaseName'], table)] = last_run
+            for target in targets.get('S3Targets', []):
+                self.s3_paths.append((target['Path'].rstrip('/'), last_run))
+            if crawler.get('DatabaseName'):
+                self.by_database.setdefault(crawler['DatabaseName'], last_run)
+        # The most specific S3 path matches first
+        self.s3_paths.sort(key=lambda entry: len(entry[0]), reverse=True)
+
+    def last_run(self, db_name: str, table: dict):
+        crawler_name = table.get('Parameters', {}).get('UPDATED_BY_CRAWLER')
+        if crawler_name in self.by_name:
+            return self.by_name[crawler_name]
+        if (db_name, table['Name']) in self.by_table:
+            return self.by_table[(db_name, table['Name'])]
+        location = table.get('StorageDescriptor', {}).get('Location', '').rstrip('/')
+        for path, last_run in self.s3_paths:
+            if location and location.startswith(path):
+                return last_run
+        return self.by_database.get(db_name, 'N/A')
+
+def build_catalog_index(glue_client) -> dict:
+    """
+    Builds an index of all databases and tables of the Glue catalog. Databases, tables and crawlers are
+    read with paginators, the tables of the databases are fetched concurrently.
+    """
+    databases = _paginate(glue_client, 'get_databases', 'DatabaseList')
+    crawler_map = _CrawlerMap(_paginate(glue_client, 'get_crawlers', 'Crawlers'))
+
+    def fetch_tables(db_name: str) -> list:
+        return _paginate(glue_client, 'get_tables', 'TableList', DatabaseName=db_name)
+
+    db_names = [db['Name'] for db in databases]
+    with ThreadPoolExecutor(max_workers=GLUE_MAX_WORKERS) as executor:
+        tables_per_database = list(executor.map(fetch_tables, db_names))
+
+    tables = []
+    for db_name, db_tables in zip(db_names, tables_per_database):
+        for table in db_tables:
+            storage = table.get('StorageDescriptor', {})
+            tables.append({
+                'database': db_name,
+                'name': table['Name'],
+                'description': table.get('Description', ''),
+                'location': storage.get('Location', ''),
+                'columns': [
+                    {'name': column['Name'], 'type': column['Type'], 'comment': column.get('Comment', '')}
+                    for column in storage.get('Columns', [])
+                ],
+                'partition_keys': [
+                    {'name': column['Name'], 'type': column['Type'], 'comment': column.get('Comment', '')}
+                    for column in table.get('PartitionKeys', [])
+                ],
+                'last_crawl': crawler_map.last_run(db_name, table),
+            })
+
+    return {'databases': db_names, 'tables': tables}
+
+register_resource('glue', lambda region: build_catalog_index(regional_client('glue', region)), kind='json')
+
+def get_catalog_index(region: str) -> dict:
+    """
+    Returns the cached catalog index of the region, it is reloaded when it is older than CATALOG_TTL,
+    from the inventory snapshot when that is fresh and from the Glue API otherwise. Asking for fresh data
+    reloads it from the Glue API.
+    """
+    index = None if refresh_requested() else catalog_cache.get(region)
+    if index is None:
+        index, _ = snapshot_or_live('glue', region)
+        catalog_cache.put(region, index)
+    return index
+
+def query_catalog(index: dict, database: str = '', table_pattern: str = '', column: str = '') -> list:
+    """
+    Returns the tables of the index that match the database, the table name pattern (eg. 'sales_*')
+    and that have a column with the given name, empty filters match everything.
+    """
+    column = column.lower()
+    tables = []
+    for table in index['tables']:
+        if database and table['database'] != database:
+            continue
+        if table_pattern and not fnmatch.fnmatch(table['name'].lower(), table_pattern.lower()):
+            continue
+        if column and not any(c['name'].lower() == column for c in table['columns'] + table['partition_keys']):
+            continue
+        tables.append(table)
+    return tables
+
+def format_table(table: dict) -> list:
+    lines = [f"  Table: {table['name']}"]
+    if table['columns']:
+        lines.append('    Schema:')
+        lines.extend(f"      {column['name']} ({column['type']})" for column in table['columns'])
+    if table['partition_keys']:
+        lines.append('    Partition keys:')
+        lines.extend(f"      {column['name']} ({column['type']})" for column in table['partition_keys'])
+    lines.append(f"    Last Crawler Run: {table['last_crawl']}")
+    return lines
 
 @tool
-def list_glue_databases_and_tables(region: str) -> str:
+def list_glue_databases_and_tables(region: str, database: str = '', table_pattern: str = '', column: str = '') -> str:
     """
-    Lists all AWS Glue databases, tables, schemas, and last crawler runs
+    Lists AWS Glue databases, tables, schemas, and last crawler runs
 
     Args:
         region (str): The AWS region to list databases and tables
+        database (str): only list the tables of this database, defaults to all databases
+        table_pattern (str): only list tables whose name matches this pattern, eg. 'sales_*', defaults to all tables
+        column (str): only list tables that have a column with this name, defaults to all tables
 
     Returns:
         str: A formatted report containing the list of databases, tables, schemas, and last crawler runs.
     """
     try:
-        glue_client = boto3.client('glue', region)
-        
-        # Get all databases
-        databases = glue_client.get_databases()['DatabaseList']
-        
-        report = f'AWS Glue Report:\n\n'
-        
-        for db in databases:
-            db_name = db['Name']
-            report += f'Database: {db_name}\n'
-            
-            # Get tables for each database
-            tables = glue_client.get_tables(DatabaseName=db_name)['TableList']
-            
-            for table in tables:
-                table_name = table['Name']
-                report += f'  Table: {table_name}\n'
-                
-                # Get schema
-                if 'StorageDescriptor' in table and 'Columns' in table['StorageDescriptor']:
-                    columns = table['StorageDescriptor']['Columns']
-                    report += '    Schema:\n'
-                    for column in columns:
-                        report += f"      {column['Name']} ({column['Type']})\n"
-                
-                # Get last crawler run
-                crawlers = glue_client.get_crawlers()['Crawlers']
-                for crawler in crawlers:
-                    if db_name in crawler['Targets'].get('CatalogTargets', []) or \
-                       table_name in crawler['Targets'].get('S3Targets', []):
-                        last_run = crawler.get('LastCrawl', {}).get('StartTime', 'N/A')
-                        report += f'    Last Crawler Run: {last_run}\n'
-                        break
-                
-                report += '\n'
-            
-            report += '\n'
-        
-        return report
-    
+        index = get_catalog_index(region)
+        tables = query_catalog(index, database, table_pattern, column)
+
+        lines = ['AWS Glue Report:', '']
+        for db_name in index['databases']:
+            db_tables = [table for table in tables if table['database'] == db_name]
+            if not db_tables and (database or table_pattern or column):
+                continue
+            lines.append(f'Database: {db_name}')
+            for table in db_tables:
+                lines.extend(format_table(table))
+                lines.append('')
+            lines.append('')
+
+        if len(lines) == 2:
+            lines.append('No tables match the filters.')
+
+        return '\n'.join(lines)
+
     except Exception as e:
         return f'Error accessing AWS Glue: {str(e)}'
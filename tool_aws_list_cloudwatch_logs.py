@@ -1,21 +1,18 @@
-import boto3
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import pytz
 from langchain.tools import tool
 import pandas as pd
+from typing import List
+from datastore import describe_frame
+from inventory import register_resource, snapshot_fetcher, format_snapshot_ages
+from multi_region import fan_out, format_region_errors, regional_client
 
-@tool
-def list_all_log_groups_as_table(region: str) -> str:
-    """
-    Lists all CloudWatch log groups and returns them as a markdown table.
-
-    Args:
-        region (str): The AWS region to list log groups in.
-
-    Returns:
-        str: A markdown table of all the log groups
-    """
-    logs_client = boto3.client('logs', region)
+def list_log_groups_frame(region: str) -> pd.DataFrame:
+    logs_client = regional_client('logs', region)
 
     # Get all log groups
     log_groups = []
@@ -46,50 +43,136 @@ def list_all_log_groups_as_table(region: str) -> str:
     if 'Stored Bytes' in df.columns:
         df['Stored Bytes'] = (df['Stored Bytes'] / (1024 * 1024)).round(2).astype(str) + ' MB'
 
-    # Convert DataFrame to markdown table
-    markdown_table = df.to_markdown(index=False)
+    return df
 
-    return markdown_table
+register_resource('log_groups', list_log_groups_frame)
 
 @tool
-def list_log_groups_with_content(until_hours_ago: int = 1) -> str:
+def list_all_log_groups_as_table(regions: List[str]) -> str:
     """
-    Lists all CloudWatch logs until n hours ago, defaults to 1 hour
+    Lists all CloudWatch log groups of one or more regions and registers them as a data handle.
 
     Args:
-        args (int): The number of hours ago to list all logs
+        regions (list): The AWS regions to list log groups in, eg. ['eu-west-1'], or ['*'] for all enabled regions.
 
     Returns:
-        str: A summary report of all CloudWatch logs of all cloudwatch log groups
+        str: The data handle, schema and a sample of the log groups, tagged with their region
+    """
+    ages = {}
+    df, errors = fan_out(snapshot_fetcher('log_groups', ages), regions)
+    return describe_frame(df, f"CloudWatch log groups in {', '.join(regions)}") + \
+        format_region_errors(errors) + format_snapshot_ages(ages)
+
+LOG_MAX_WORKERS = 8
+LOG_MAX_EVENTS = 5000
+LOG_MAX_BYTES = 1024 * 1024
+LOG_TOP_MESSAGES = 3
 
+_VARIABLE_TOKENS = re.compile(r"[0-9a-fA-F]{8,}|\d+")
+
+class _Budget:
+    """
+    A global event and byte budget shared by the log group fetchers, exhausted when either limit is reached.
     """
-    logs_client = boto3.client('logs', 'eu-west-1')
+
+    def __init__(self, max_events: int, max_bytes: int):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.events = 0
+        self.bytes = 0
+        self.exhausted = threading.Event()
+        self._lock = threading.Lock()
+
+    def take(self, size: int) -> bool:
+        with self._lock:
+            if self.exhausted.is_set():
+                return False
+            self.events += 1
+            self.bytes += size
+            if self.events >= self.max_events or self.bytes >= self.max_bytes:
+                self.exhausted.set()
+            return True
+
+def _summarize_log_group(logs_client, group_name: str, start_time: int, end_time: int, budget: _Budget) -> dict:
+    summary = {'group': group_name, 'events': 0, 'first': None, 'last': None, 'messages': Counter(), 'error': None}
+    try:
+        paginator = logs_client.get_paginator('filter_log_events')
+        for page in paginator.paginate(logGroupName=group_name, startTime=start_time, endTime=end_time):
+            for event in page['events']:
+                if not budget.take(len(event['message'])):
+                    return summary
+                summary['events'] += 1
+                summary['first'] = min(event['timestamp'], summary['first'] or event['timestamp'])
+                summary['last'] = max(event['timestamp'], summary['last'] or event['timestamp'])
+                # Messages that only differ in numbers and ids are counted as one
+                summary['messages'][_VARIABLE_TOKENS.sub('#', event['message'].strip())[:200]] += 1
+            if budget.exhausted.is_set():
+                break
+    except Exception as e:
+        summary['error'] = str(e)
+    return summary
+
+def _format_timestamp(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp / 1000, pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
+
+@tool
+def list_log_groups_with_content(until_hours_ago: int = 1, region: str = 'eu-west-1', log_group_prefix: str = '') -> str:
+    """
+    Summarizes the CloudWatch logs of all log groups of the last n hours, defaults to 1 hour
+
+    Args:
+        until_hours_ago (int): The number of hours ago to summarize the logs from
+        region (str): The AWS region of the log groups, defaults to 'eu-west-1'
+        log_group_prefix (str): only summarize log groups whose name starts with this prefix, defaults to all
+
+    Returns:
+        str: A summary per log group with the number of events, the first and last timestamp and the top messages
+
+    """
+    logs_client = regional_client('logs', region)
 
     # Get all log groups
     log_groups = []
     paginator = logs_client.get_paginator('describe_log_groups')
-    for page in paginator.paginate():
-        log_groups.extend(page['logGroups'])
+    arguments = {'logGroupNamePrefix': log_group_prefix} if log_group_prefix else {}
+    for page in paginator.paginate(**arguments):
+        log_groups.extend(group['logGroupName'] for group in page['logGroups'])
 
-    # Get current time and time an hour ago
     now = datetime.now(pytz.UTC)
-    one_hour_ago = now - timedelta(hours=1)
-
-    result = ""
-    # Fetch and print logs for each group
-    for group in log_groups:
-        result += f"Log Group: {group['logGroupName']}\n"
-        try:
-            response = logs_client.filter_log_events(
-                logGroupName=group['logGroupName'],
-                startTime=int(one_hour_ago.timestamp() * 1000),
-                endTime=int(now.timestamp() * 1000)
-            )
-            for event in response['events']:
-                result += f"  Timestamp: {datetime.fromtimestamp(event['timestamp']/1000, pytz.UTC)}\n"
-                result += f"  Message: {event['message']}\n\n"
-        except Exception as e:
-            result += f"  Error fetching logs: {str(e)}\n"
-        result += "-" * 50
-
-    return result
+    start_time = int((now - timedelta(hours=until_hours_ago)).timestamp() * 1000)
+    end_time = int(now.timestamp() * 1000)
+
+    budget = _Budget(LOG_MAX_EVENTS, LOG_MAX_BYTES)
+    with ThreadPoolExecutor(max_workers=LOG_MAX_WORKERS) as executor:
+        futures = [executor.submit(_summarize_log_group, logs_client, group, start_time, end_time, budget)
+                   for group in log_groups]
+        summaries = []
+        for future in futures:
+            if budget.exhausted.is_set():
+                # Log groups that did not start yet are skipped once the budget is spent
+                future.cancel()
+            if not future.cancelled():
+                summaries.append(future.result())
+
+    lines = [f"CloudWatch logs of the last {until_hours_ago} hours in {region}: "
+             f"{budget.events} events in {len(summaries)} of {len(log_groups)} log groups"]
+    if budget.exhausted.is_set():
+        lines.append(f"The budget of {LOG_MAX_EVENTS} events or {LOG_MAX_BYTES} bytes was reached, "
+                     "the counts are incomplete, use a log_group_prefix or a shorter time range.")
+
+    quiet_groups = 0
+    for summary in sorted(summaries, key=lambda summary: summary['events'], reverse=True):
+        if summary['error']:
+            lines.append(f"Log Group: {summary['group']}\n  Error fetching logs: {summary['error']}")
+        elif summary['events'] == 0:
+            quiet_groups += 1
+        else:
+            lines.append(f"Log Group: {summary['group']}")
+            lines.append(f"  Events: {summary['events']}, first: {_format_timestamp(summary['first'])}, "
+                         f"last: {_format_timestamp(summary['last'])}")
+            for message, count in summary['messages'].most_common(LOG_TOP_MESSAGES):
+                lines.append(f"  {count}x {message}")
+    if quiet_groups:
+        lines.append(f"{quiet_groups} log groups had no events.")
+
+    return "\n".join(lines)
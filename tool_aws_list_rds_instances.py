@@ -1,11 +1,16 @@
-import boto3
+from typing import List
+import pandas as pd
 from langchain.tools import tool
+from datastore import describe_frame
+from inventory import register_resource, snapshot_fetcher, format_snapshot_ages
+from multi_region import fan_out, format_region_errors, regional_client
 
 def do_list_rds_instances(region: str):
-    rds = boto3.client('rds', region)
+    rds = regional_client('rds', region)
 
-    response = rds.describe_db_instances()
-    instances = response['DBInstances']
+    instances = []
+    for page in rds.get_paginator('describe_db_instances').paginate():
+        instances.extend(page['DBInstances'])
 
     results = []
     for instance in instances:
@@ -19,31 +24,30 @@ def do_list_rds_instances(region: str):
 
     return results
 
+def list_rds_instances_frame(region: str) -> pd.DataFrame:
+    return pd.DataFrame.from_records(do_list_rds_instances(region),
+                                     columns=['DBInstanceIdentifier', 'Engine', 'DBInstanceStatus', 'DBInstanceClass', 'Endpoint'])
+
+register_resource('rds', list_rds_instances_frame)
+
 @tool
-def list_rds_instances(region: str) -> str:
+def list_rds_instances(regions: List[str]) -> str:
     """
-    Lists all RDS instances in a specified AWS account and region.
+    Lists all RDS instances in a specified AWS account and one or more regions.
 
     Args:
-        region (str): The AWS region to use.
+        regions (list): The AWS regions to use, eg. ['eu-west-1'], or ['*'] for all enabled regions.
 
     Returns:
-        str: A summary report of all RDS instances in the specified account and region.
+        str: A table of all RDS instances in the specified account and regions, tagged with their region.
     """
     try:
-        instances = do_list_rds_instances(region)
-        if not instances:
-            return f"No RDS instances found in the {region} region."
-        
-        report = "RDS Instances:\n"
-        for instance in instances:
-            report += f"\nIdentifier: {instance['DBInstanceIdentifier']}"
-            report += f"\n  Engine: {instance['Engine']}"
-            report += f"\n  Status: {instance['DBInstanceStatus']}"
-            report += f"\n  Instance Class: {instance['DBInstanceClass']}"
-            report += f"\n  Endpoint: {instance['Endpoint']}"
-            report += "\n"
-        
-        return report
+        ages = {}
+        df, errors = fan_out(snapshot_fetcher('rds', ages), regions)
+        if df.empty:
+            return f"No RDS instances found in the {', '.join(regions)} regions." + format_region_errors(errors)
+
+        return describe_frame(df, f"RDS instances in {', '.join(regions)}", sample_rows=25) + \
+            format_region_errors(errors) + format_snapshot_ages(ages)
     except Exception as e:
         return f"Error listing RDS instances: {e}"
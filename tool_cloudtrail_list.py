@@ -1,40 +1,125 @@
 from langchain.tools import tool
-from datetime import datetime
-import boto3
+from datetime import datetime, timedelta, timezone
+from typing import List
+import json
+import threading
+import time
+import pandas as pd
+from datastore import describe_frame
+from multi_region import fan_out, format_region_errors, regional_client
+
+# LookupEvents is limited to 2 requests per second per account and region
+LOOKUP_EVENTS_RATE = 2.0
+LOOKUP_EVENTS_PAGE_SIZE = 50
+CLOUDTRAIL_MAX_EVENTS = 1000
+LOOKUP_ATTRIBUTE_KEYS = ['EventId', 'EventName', 'ReadOnly', 'Username', 'ResourceType', 'ResourceName',
+                         'EventSource', 'AccessKeyId']
+
+class RateLimiter:
+    """
+    Spaces calls at least 1 / rate seconds apart, shared by all threads that call acquire.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def _rate_limiter(region: str) -> RateLimiter:
+    with _rate_limiters_lock:
+        if region not in _rate_limiters:
+            _rate_limiters[region] = RateLimiter(LOOKUP_EVENTS_RATE)
+        return _rate_limiters[region]
+
+def _event_record(event: dict) -> dict:
+    details = json.loads(event.get('CloudTrailEvent', '{}'))
+    resources = event.get('Resources', [])
+    event_time = event.get('EventTime', '')
+    return {
+        "EventTime": event_time.isoformat() if isinstance(event_time, datetime) else event_time,
+        "EventName": event.get('EventName', ''),
+        "Username": event.get('Username', ''),
+        "EventSource": event.get('EventSource', ''),
+        "ResourceType": ", ".join(sorted({resource.get('ResourceType', '') for resource in resources})),
+        "ResourceName": ", ".join(resource.get('ResourceName', '') for resource in resources),
+        "ErrorCode": details.get('errorCode', ''),
+        "SourceIPAddress": details.get('sourceIPAddress', ''),
+    }
+
+def lookup_events_frame(region: str, start_time: datetime, end_time: datetime, max_events: int,
+                        attribute_key: str = '', attribute_value: str = '') -> pd.DataFrame:
+    """
+    Pages through LookupEvents of the time window with an optional attribute filter, throttled per region.
+    """
+    cloudtrail = regional_client('cloudtrail', region)
+    limiter = _rate_limiter(region)
+
+    request = {'StartTime': start_time, 'EndTime': end_time}
+    if attribute_key:
+        request['LookupAttributes'] = [{'AttributeKey': attribute_key, 'AttributeValue': attribute_value}]
+
+    records = []
+    while len(records) < max_events:
+        limiter.acquire()
+        response = cloudtrail.lookup_events(MaxResults=min(LOOKUP_EVENTS_PAGE_SIZE, max_events - len(records)), **request)
+        records.extend(_event_record(event) for event in response['Events'])
+        if 'NextToken' not in response:
+            break
+        request['NextToken'] = response['NextToken']
+
+    return pd.DataFrame.from_records(records, columns=["EventTime", "EventName", "Username", "EventSource", "ResourceType",
+                                                       "ResourceName", "ErrorCode", "SourceIPAddress"])
 
 @tool
-def list_cloudtrail_events(max_events: int, region: str) -> str:
+def list_cloudtrail_events(regions: List[str], hours: int = 24, max_events: int = 100,
+                           attribute_key: str = '', attribute_value: str = '') -> str:
     """
-     Lists the last 100 of cloudtrail events
+    Looks up the CloudTrail events of the last hours in one or more regions, optionally filtered by one attribute,
+    and registers them as a data handle
 
     Args:
-        args (int): the number of events to return, defaults to 100
-        region (str): the AWS region to use
+        regions (list): the AWS regions to use, eg. ['eu-west-1'], or ['*'] for all enabled regions
+        hours (int): the number of hours ago to look up events from, defaults to 24
+        max_events (int): the maximum number of events per region, defaults to 100, at most 1000
+        attribute_key (str): filter on one attribute: EventId, EventName, ReadOnly, Username, ResourceType,
+            ResourceName, EventSource or AccessKeyId, defaults to no filter
+        attribute_value (str): the value of the attribute to filter on, eg. 'DeleteBucket' for EventName
 
     Returns:
-        str: a list of cloudwatch events
+        str: the data handle, schema and a sample of the events, and the most frequent event names
     """
-    cloudtrail = boto3.client('cloudtrail', region)
+    if attribute_key and attribute_key not in LOOKUP_ATTRIBUTE_KEYS:
+        return f"Error: Invalid attribute_key. Please use one of: {', '.join(LOOKUP_ATTRIBUTE_KEYS)}"
 
     try:
-        response = cloudtrail.lookup_events(
-            MaxResults=max_events
-        )
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(hours=hours)
+        max_events = max(1, min(max_events, CLOUDTRAIL_MAX_EVENTS))
 
-        events = response['Events']
-        event_list = []
-
-        for event in events:
-            event_info = {
-                "EventTime": event.get('EventTime', '').isoformat() if isinstance(event.get('EventTime'), datetime) else event.get('EventTime', ''),
-                "EventName": event.get('EventName', ''),
-                "Username": event.get('Username', ''),
-                "EventSource": event.get('EventSource', ''),
-                "AWSRegion": event.get('AWSRegion', '')
-            }
-            event_list.append(event_info)
+        df, errors = fan_out(
+            lambda region: lookup_events_frame(region, start_time, end_time, max_events, attribute_key, attribute_value),
+            regions,
+        )
 
-        return event_list
+        title = f"CloudTrail events of the last {hours} hours in {', '.join(regions)}"
+        if attribute_key:
+            title += f" where {attribute_key} is {attribute_value}"
+        description = describe_frame(df, title)
+        if not df.empty:
+            top = df['EventName'].value_counts().head(10)
+            description += "\n\nMost frequent events: " + ", ".join(f"{name} ({count})" for name, count in top.items())
+        return description + format_region_errors(errors)
 
     except Exception as e:
         return f"Error retrieving CloudTrail events: {str(e)}"
@@ -1,40 +1,89 @@
-import boto3
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor
 from langchain.tools import tool
 import pandas as pd
+from typing import List
+from datastore import describe_frame
+from inventory import register_resource, snapshot_fetcher, format_snapshot_ages
+from multi_region import fan_out, format_region_errors, regional_client
 
-@tool
-def list_ecr_repositories_and_versions(region: str) -> str:
-    """
-    Lists all ECR repositories and returns a short list of versions per repository
+ECR_MAX_WORKERS = 8
+ECR_VERSIONS_PER_REPOSITORY = 5
 
-    Args:
-        region (str): the AWS region to use
+# Regions already run on the pool of fan_out, the repositories of all regions and sessions share one
+# more pool, so listing every region adds at most ECR_MAX_WORKERS threads
+_repository_pool = ThreadPoolExecutor(max_workers=ECR_MAX_WORKERS, thread_name_prefix="ecr")
+
+def latest_image_tags(ecr_client, repo_name: str, count: int = ECR_VERSIONS_PER_REPOSITORY) -> list:
+    """
+    Returns the tags of the most recently pushed tagged images of a repository. The pages of
+    describe_images are streamed through a bounded heap, so the image list is never materialized.
     """
+    paginator = ecr_client.get_paginator('describe_images')
+    latest = []
+    sequence = 0
+    for page in paginator.paginate(repositoryName=repo_name, filter={'tagStatus': 'TAGGED'}):
+        for image in page['imageDetails']:
+            # The sequence number breaks ties without comparing the tag lists
+            entry = (image['imagePushedAt'], sequence, image.get('imageTags', []))
+            sequence += 1
+            if len(latest) < count:
+                heapq.heappush(latest, entry)
+            elif entry > latest[0]:
+                heapq.heapreplace(latest, entry)
+
+    tags = []
+    for _, _, image_tags in sorted(latest, reverse=True):
+        tags.extend(image_tags)
+    return tags[:count]
+
+def _describe_repository(ecr_client, repo_name: str) -> dict:
+    start = time.perf_counter()
     try:
-        ecr_client = boto3.client('ecr', region)
-        repositories = ecr_client.describe_repositories()['repositories']
+        versions = latest_image_tags(ecr_client, repo_name)
+        error = None
     except Exception as e:
-        return f"Error: {e}"
-    
-    result = []
-    
-    for repo in repositories:
-        try:
-            repo_name = repo['repositoryName']
-            images = ecr_client.describe_images(repositoryName=repo_name)['imageDetails']
-            versions = [img['imageTag'] for img in images if 'imageTag' in img]
-            result.append({
-                'repository': repo_name,
-                'versions': versions[:5] if versions else ['No versions found'],
-                'error': None,
-            })
-        except Exception as e: 
-            result.append({
-                'repository': repo_name,
-                'versions': None,
-                'error': str(e),
-            })
-
-    return pd.DataFrame.from_records(result).to_markdown(index=False)
+        versions = None
+        error = str(e)
+    return {
+        'repository': repo_name,
+        'versions': (versions or ['No versions found']) if error is None else None,
+        'error': error,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000),
+    }
+
+def list_repositories_frame(region: str) -> pd.DataFrame:
+    ecr_client = regional_client('ecr', region)
+    repo_names = []
+    for page in ecr_client.get_paginator('describe_repositories').paginate():
+        repo_names.extend(repo['repositoryName'] for repo in page['repositories'])
+
+    result = list(_repository_pool.map(lambda repo_name: _describe_repository(ecr_client, repo_name), repo_names))
 
+    return pd.DataFrame.from_records(result, columns=['repository', 'versions', 'error', 'elapsed_ms'])
+
+register_resource('ecr', list_repositories_frame)
+
+@tool
+def list_ecr_repositories_and_versions(regions: List[str]) -> str:
+    """
+    Lists all ECR repositories of one or more regions and returns the most recently pushed versions per repository as a data handle
+
+    Args:
+        regions (list): the AWS regions to use, eg. ['eu-west-1'], or ['*'] for all enabled regions
+
+    Returns:
+        str: The data handle, schema and a sample of the repositories, tagged with their region
+    """
+    ages = {}
+    df, errors = fan_out(snapshot_fetcher('ecr', ages), regions)
+    if errors and df.empty:
+        return f"Error: {format_region_errors(errors).strip()}"
 
+    description = describe_frame(df, f"ECR repositories in {', '.join(regions)}, elapsed_ms is the time to list the images of a repository")
+    if not df.empty:
+        slowest = df.nlargest(3, 'elapsed_ms')
+        description += "\n\nSlowest repositories: " + ", ".join(
+            f"{row.repository} in {row.region} ({row.elapsed_ms} ms)" for row in slowest.itertuples())
+    return description + format_region_errors(errors) + format_snapshot_ages(ages)
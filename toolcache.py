@@ -0,0 +1,162 @@
+import inspect
+import json
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from langchain_core.tools import BaseTool, StructuredTool
+from cache import LRUCache
+from cascade import READ_ONLY_QUERY_PATTERN, TOOL_ERROR_PATTERN
+from datastore import has_frames
+
+# Results of the AWS tools are cached per tool and normalized arguments, so follow-up questions that repeat
+# a tool call are answered without calling AWS again. Tools without a TTL are never cached. A user message
+# with a refresh intent bypasses the cache for that turn, the fresh results replace the cached ones.
+TOOL_CACHE_TTLS = {
+    'list_cloudtrail_events': 60,
+    'run_logs_insights_query': 60,
+    'list_all_log_groups_as_table': 5 * 60,
+    'list_rds_instances': 5 * 60,
+    'list_ecr_repositories_and_versions': 5 * 60,
+    'execute_athena_query': 5 * 60,
+    'list_glue_databases_and_tables': 10 * 60,
+    'find_relevant_glue_tables': 10 * 60,
+    'bedrock_token_counts_tool': 10 * 60,
+}
+TOOL_CACHE_MAX_ENTRIES = 512
+TOOL_CACHE_MAX_BYTES = 32 * 1024 * 1024
+REFRESH_PATTERN = re.compile(r"\b(refresh|reload|fresh|up[- ]to[- ]date|bypass (the )?cache|no cache)\b", re.IGNORECASE)
+# Calls that may change state are never answered from the cache, an Athena query only when it reads
+CACHEABLE_CALLS = {
+    'execute_athena_query': lambda arguments: bool(READ_ONLY_QUERY_PATTERN.match(arguments.get('query') or "")),
+}
+
+_results = LRUCache(max_entries=TOOL_CACHE_MAX_ENTRIES, max_bytes=TOOL_CACHE_MAX_BYTES,
+                    sizeof=lambda entry: len(entry[1].encode()))
+_hits = Counter()
+_misses = Counter()
+_counters_lock = threading.Lock()
+_bypass: ContextVar[bool] = ContextVar("tool_cache_bypass", default=False)
+
+def bind_refresh_intent(user_query: str) -> bool:
+    """
+    Bypasses the tool cache in the current context when the user asks for fresh data, returns whether it does.
+    """
+    refresh = bool(REFRESH_PATTERN.search(user_query or ""))
+    _bypass.set(refresh)
+    return refresh
+
+def refresh_requested() -> bool:
+    """
+    Returns whether the user asked for fresh data in the current context, the caches inside the tools,
+    like the Athena results, the Glue catalog and the inventory snapshot, skip their lookups as well.
+    """
+    return _bypass.get()
+
+def _normalize(value):
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, (list, tuple)):
+        values = [_normalize(item) for item in value]
+        # Lists of names, like regions or model ids, are order insensitive
+        if all(isinstance(item, str) for item in values):
+            return sorted(dict.fromkeys(values))
+        return values
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    return value
+
+def call_arguments(signature: inspect.Signature, args: tuple, kwargs: dict) -> dict:
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    return dict(bound.arguments)
+
+def cache_key(name: str, signature: inspect.Signature, args: tuple, kwargs: dict) -> tuple:
+    """
+    Returns the cache key of a call, the defaults are filled in so that omitted and explicit defaults match.
+    """
+    return name, json.dumps(_normalize(call_arguments(signature, args, kwargs)), sort_keys=True, default=str)
+
+def _cacheable(result) -> bool:
+    # Errors, the same ones that make the cascade escalate, and partial multi-region results are retried on the next call
+    return isinstance(result, str) and not TOOL_ERROR_PATTERN.match(result) and "Regions that failed" not in result
+
+def _cacheable_call(name: str, signature: inspect.Signature, args: tuple, kwargs: dict) -> bool:
+    return name not in CACHEABLE_CALLS or CACHEABLE_CALLS[name](call_arguments(signature, args, kwargs))
+
+def _lookup(name: str, key: tuple, ttl: float):
+    if not _bypass.get():
+        # Entries are (stored at, result), the TTL differs per tool
+        entry = _results.get(key)
+        # Results refer to data handles of the session that made the call, they must still resolve
+        if entry is not None and time.monotonic() - entry[0] <= ttl and has_frames(entry[1]):
+            with _counters_lock:
+                _hits[name] += 1
+            print(f"tool cache hit: {name}")
+            return entry[1]
+    with _counters_lock:
+        _misses[name] += 1
+    return None
+
+def _store(key: tuple, result) -> None:
+    if _cacheable(result):
+        _results.put(key, (time.monotonic(), result))
+
+def cached_tool(tool: BaseTool, ttl: float) -> BaseTool:
+    """
+    Returns a copy of the tool whose results are cached for ttl seconds, the async implementation
+    of the tool is kept and shares the cache.
+    """
+    func = tool.func
+    coroutine = tool.coroutine
+    signature = inspect.signature(func)
+
+    def cached_func(*args, **kwargs):
+        if not _cacheable_call(tool.name, signature, args, kwargs):
+            return func(*args, **kwargs)
+        key = cache_key(tool.name, signature, args, kwargs)
+        result = _lookup(tool.name, key, ttl)
+        if result is None:
+            result = func(*args, **kwargs)
+            _store(key, result)
+        return result
+
+    async def cached_coroutine(*args, **kwargs):
+        if not _cacheable_call(tool.name, signature, args, kwargs):
+            return await coroutine(*args, **kwargs)
+        key = cache_key(tool.name, signature, args, kwargs)
+        result = _lookup(tool.name, key, ttl)
+        if result is None:
+            result = await coroutine(*args, **kwargs)
+            _store(key, result)
+        return result
+
+    return StructuredTool.from_function(func=cached_func, coroutine=cached_coroutine if coroutine is not None else None,
+                                        name=tool.name, description=tool.description, args_schema=tool.args_schema,
+                                        return_direct=tool.return_direct, infer_schema=False)
+
+def with_result_cache(tools: list) -> list:
+    """
+    Wraps the structured tools that have a TTL in TOOL_CACHE_TTLS, the other tools are returned as they are.
+    """
+    return [
+        cached_tool(tool, TOOL_CACHE_TTLS[tool.name])
+        if isinstance(tool, StructuredTool) and tool.func is not None and tool.name in TOOL_CACHE_TTLS else tool
+        for tool in tools
+    ]
+
+def clear() -> None:
+    _results.clear()
+
+def stats() -> dict:
+    """
+    Returns the hits and misses per tool and the totals.
+    """
+    with _counters_lock:
+        return {
+            "hits": sum(_hits.values()),
+            "misses": sum(_misses.values()),
+            "entries": len(_results),
+            "tools": {name: (_hits[name], _misses[name]) for name in sorted(set(_hits) | set(_misses))},
+        }
@@ -0,0 +1,76 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+from toolset import list_of_tools
+
+# Every turn only exposes the schemas of the tools that the question is about. A tool is selected when
+# one of its patterns matches the question, the tools that were used in the previous turn stay selected
+# for follow-up questions, and a question that matches no tool and follows no tool call gets all of them.
+# The model can only call the routed tools, so a turn that the routed tools could not answer is run again
+# with all tools, see widen_reason.
+ROUTES = {
+    'Python_REPL': r"\bpython\b|\brepl\b",
+    'get_current_time': r"\btime\b|\bdate\b|\btoday\b|\bnow\b|\byesterday\b|\bago\b|\blast \d*\s*(minute|hour|day|week|month)s?\b",
+    'list_cloudtrail_events': r"cloudtrail|\btrail\b|\bevents?\b|\baudit|\bwho (created|deleted|changed|modified|stopped|started)|\bapi calls?\b",
+    'list_all_log_groups_as_table': r"\blog groups?\b|\blogs?\b|cloudwatch",
+    'run_logs_insights_query': r"\blogs?\b|cloudwatch|insights|\berrors?\b|\bexceptions?\b|\btimeouts?\b|\blambda\b",
+    'list_glue_databases_and_tables': r"\bglue\b|\bcatalog\b|\bdatabases?\b|\btables?\b|\bcrawlers?\b|\bschemas?\b|\bcolumns?\b",
+    'find_relevant_glue_tables': r"\bglue\b|\bcatalog\b|\btables?\b|\bschemas?\b|\bcolumns?\b",
+    'list_rds_instances': r"\brds\b|\baurora\b|\bmysql\b|\bpostgres|\bdb instances?\b|\bdatabases?\b|\bdatabase instances?\b",
+    'execute_athena_query': r"\bathena\b|\bsql\b|\bquery\b|\bselect\b|\bcount\b|\bsum\b|\baverage\b|\btop \d+\b|\bgroup by\b",
+    'bedrock_token_counts_tool': r"\bbedrock\b|\btokens?\b|\busage\b|\bcosts?\b|\bspend|\binvocations?\b",
+    'list_ecr_repositories_and_versions': r"\becr\b|\brepositor(y|ies)\b|\bimages?\b|\bcontainers?\b|\bdocker\b|\bversions?\b|\btags?\b",
+}
+# Tools that are only useful together with another tool, Athena queries need the table schemas
+ROUTE_DEPENDENCIES = {
+    'execute_athena_query': ['find_relevant_glue_tables'],
+}
+
+CANNOT_ANSWER_PATTERN = re.compile(
+    r"\b(I (don't|do not) have (access to )?(a |the |any )?(tools?|functions?|way)|no (available )?tools?|"
+    r"(I'm|I am) (not able|unable) to|I (can't|cannot) (access|retrieve|list|query|look up|check|find|get|answer))\b",
+    re.IGNORECASE)
+
+_patterns = {name: re.compile(pattern, re.IGNORECASE) for name, pattern in ROUTES.items()}
+_tool_names = [tool.name for tool in list_of_tools]
+
+def route_tools(query: str, previous_tools: Iterable[str] = ()) -> Tuple[List[str], str]:
+    """
+    Selects the tools to expose for a turn.
+
+    Returns:
+        tuple: the tool names in the order of list_of_tools, and the reason of the decision for the log
+    """
+    matched = {name for name, pattern in _patterns.items() if pattern.search(query or "")}
+    previous_tools = [name for name in previous_tools if name in _tool_names]
+    if not matched and previous_tools:
+        # Questions like 'and in us-east-1?' continue with the tools of the previous turn
+        return [name for name in _tool_names if name in previous_tools], "no tool matched, follow-up of the previous turn"
+    if not matched:
+        return list(_tool_names), "no tool matched, all tools"
+
+    selected = set(matched)
+    for name in matched:
+        selected.update(ROUTE_DEPENDENCIES.get(name, []))
+    sticky = set(previous_tools) - selected
+    selected.update(sticky)
+
+    reason = f"matched {', '.join(sorted(matched))}"
+    if sticky:
+        reason += f", kept {', '.join(sorted(sticky))} from the previous turn"
+    return [name for name in _tool_names if name in selected], reason
+
+def widen_reason(query: str, tool_names: Optional[Iterable[str]], output: str, intermediate_steps: list) -> Optional[str]:
+    """
+    Returns why a turn that only saw the routed tools should run again with all tools, or None when it
+    saw all tools or got an answer.
+    """
+    if tool_names is None or set(_tool_names) <= set(tool_names):
+        return None
+    match = CANNOT_ANSWER_PATTERN.search(output)
+    if match:
+        return f"the answer says it cannot answer ({match.group(0)})"
+    if not intermediate_steps and any(pattern.search(query or "") for pattern in _patterns.values()):
+        # A question about AWS resources that no routed tool was used for, a follow-up can be answered
+        # from the history and is not widened
+        return "no routed tool was called"
+    return None